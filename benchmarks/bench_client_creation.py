@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Compares the cost of creating the EC2 and EC2 Instance Connect clients from a new session, as every CLI invocation
+does, with botocore's full service models and with the trimmed models from the model cache.
+
+Usage: python benchmarks/bench_client_creation.py [iterations]
+"""
+
+import sys
+import timeit
+
+import botocore.session
+
+from ec2instanceconnectcli import model_cache
+
+
+def create_clients(trimmed):
+    session = botocore.session.get_session()
+    if trimmed:
+        model_cache.install(session)
+    session.create_client('ec2', region_name='us-east-1')
+    session.create_client('ec2-instance-connect', region_name='us-east-1')
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    # Builds the trimmed models, so that their one-off cost is not measured
+    create_clients(True)
+    print('{0:<10} {1:>12} {2:>12} {3:>12}'.format('models', 'min (ms)', 'median (ms)', 'max (ms)'))
+    for name, trimmed in (('full', False), ('trimmed', True)):
+        timings = sorted(timeit.repeat(lambda: create_clients(trimmed), number=1, repeat=iterations))
+        print('{0:<10} {1:>12.3f} {2:>12.3f} {3:>12.3f}'.format(name,
+                                                               timings[0] * 1000,
+                                                               timings[len(timings) // 2] * 1000,
+                                                               timings[-1] * 1000))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
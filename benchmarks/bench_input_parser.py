@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Measures target parsing at fleet scale: streaming a targets file through input_parser.parse_targets_file, and
+validating host names with _is_valid_target.  Reports time per target and the peak memory allocated while
+consuming the targets file, which stays flat as the number of targets grows.
+
+Usage: python benchmarks/bench_input_parser.py [targets]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from ec2instanceconnectcli import input_parser
+
+
+def write_targets(path, count):
+    with open(path, 'w') as f:
+        for index in range(count):
+            if index % 2:
+                f.write('ubuntu@i-{0:017x}\n'.format(index))
+            else:
+                f.write('i-{0:017x}\n'.format(index))
+
+
+def bench_targets_file(path, count):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-u', '--profile', default='default')
+    parser.add_argument('-t', '--instance_id', default='')
+    parser.add_argument('-r', '--region')
+    parser.add_argument('-z', '--zone')
+    parser.add_argument('--targets-file')
+    args = parser.parse_known_args(['--targets-file', path, '-p', '22', 'uptime'])
+
+    start = time.perf_counter()
+    fleet_bundles, _, _ = input_parser.parse_targets_file(args)
+    parsed = sum(1 for _ in fleet_bundles)
+    elapsed = time.perf_counter() - start
+    assert parsed == count
+
+    # Tracing allocations slows parsing down, so memory is measured on a second pass
+    tracemalloc.start()
+    fleet_bundles, _, _ = input_parser.parse_targets_file(args)
+    for _ in fleet_bundles:
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_hostnames(count):
+    hostnames = ['ec2-54-245-{0}-{1}.us-west-2.compute.amazonaws.com'.format(index // 256 % 256, index % 256)
+                 for index in range(count)]
+    start = time.perf_counter()
+    valid = sum(1 for hostname in hostnames if input_parser._is_valid_target(hostname))
+    elapsed = time.perf_counter() - start
+    assert valid == count
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    fd, path = tempfile.mkstemp(suffix='.txt')
+    os.close(fd)
+    try:
+        write_targets(path, count)
+        elapsed, peak = bench_targets_file(path, count)
+    finally:
+        os.remove(path)
+    print('{0:<20} {1:>10} {2:>12} {3:>14} {4:>16}'.format('benchmark', 'targets', 'total (s)', 'per target (us)',
+                                                           'peak memory (KiB)'))
+    print('{0:<20} {1:>10} {2:>12.3f} {3:>14.2f} {4:>16.1f}'.format('--targets-file', count, elapsed,
+                                                                   elapsed / count * 1e6, peak / 1024.0))
+    elapsed = bench_hostnames(count)
+    print('{0:<20} {1:>10} {2:>12.3f} {3:>14.2f} {4:>16}'.format('_is_valid_target', count, elapsed,
+                                                                elapsed / count * 1e6, '-'))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
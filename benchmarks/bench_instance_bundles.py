@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Compares the memory held by the instance bundles of a fleet when they are plain dicts and when they are
+InstanceBundles.  Every target's strings are built separately, as they are when read from a targets file, so the
+numbers include what interning the shared fields saves.
+
+Usage: python benchmarks/bench_instance_bundles.py [targets]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from ec2instanceconnectcli.instance_bundle import InstanceBundle
+
+
+def target_fields(index):
+    return {'profile': ''.join(['def', 'ault']), 'instance_id': 'i-{0:017x}'.format(index),
+            'region': ''.join(['us-west', '-2']), 'zone': ''.join(['us-west-', '2a']), 'target': None,
+            'username': ''.join(['ec2-', 'user']), 'host_info': '10.0.{0}.{1}'.format(index // 256 % 256, index % 256)}
+
+
+def bench(factory, count):
+    tracemalloc.start()
+    start = time.perf_counter()
+    bundles = [factory(**target_fields(index)) for index in range(count)]
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(bundles) == count
+    return elapsed, size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print('{0:<16} {1:>10} {2:>12} {3:>16} {4:>18}'.format('bundle', 'targets', 'total (s)', 'memory (MiB)',
+                                                           'per target (bytes)'))
+    for name, factory in (('dict', dict), ('InstanceBundle', InstanceBundle)):
+        elapsed, size = bench(factory, count)
+        print('{0:<16} {1:>10} {2:>12.3f} {3:>16.1f} {4:>18.0f}'.format(name, count, elapsed, size / 1048576.0,
+                                                                       size / float(count)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Compares the per-invocation cost of setting up an ephemeral key for each supported key type:
+generation plus OpenSSH public and PEM private serialization, i.e. the work done by EC2InstanceConnectKey.
+
+Usage: python benchmarks/bench_key_generation.py [iterations]
+"""
+
+import sys
+import timeit
+
+from ec2instanceconnectcli import key_utils
+
+
+def setup_key(key_type):
+    key = key_utils.generate_key_by_type(key_type)
+    key_utils.serialize_key(key, encoding='OpenSSH')
+    key_utils.serialize_key(key, return_private=True)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print('{0:<10} {1:>12} {2:>12} {3:>12}'.format('key type', 'min (ms)', 'median (ms)', 'max (ms)'))
+    for key_type in key_utils.supported_key_types:
+        timings = sorted(timeit.repeat(lambda: setup_key(key_type), number=1, repeat=iterations))
+        print('{0:<10} {1:>12.3f} {2:>12.3f} {3:>12.3f}'.format(key_type,
+                                                               timings[0] * 1000,
+                                                               timings[len(timings) // 2] * 1000,
+                                                               timings[-1] * 1000))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
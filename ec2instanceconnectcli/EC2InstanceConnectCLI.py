@@ -11,14 +11,89 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+import contextlib
 import logging
+import os
+import signal
 import sys
+import threading
 import time
 from subprocess import Popen
 
-import botocore.session
 from ec2instanceconnectcli import __version__ as CLI_VERSION
-from ec2instanceconnectcli import ec2_util, key_publisher
+from ec2instanceconnectcli import address_race, ec2_util, hedging, instance_cache, key_cache, key_publisher, \
+    model_cache, multiplex, region_discovery, timings
+from ec2instanceconnectcli.client_cache import ClientCache
+
+# ssh's exit status when it could not connect or authenticate
+SSH_CONNECTION_FAILED = 255
+
+# Signals relayed to the child while we wait on it; not every platform has all of them
+FORWARDED_SIGNALS = tuple(getattr(signal, name) for name in ('SIGINT', 'SIGTERM', 'SIGHUP', 'SIGWINCH')
+                          if hasattr(signal, name))
+# Signals the terminal sends to its whole foreground process group, the child included
+TERMINAL_SIGNALS = tuple(getattr(signal, name) for name in ('SIGINT', 'SIGWINCH') if hasattr(signal, name))
+
+
+def _in_terminal_foreground():
+    """
+    :return: Whether the CLI is in the foreground process group of its controlling terminal
+    :rtype: bool
+    """
+    try:
+        fd = os.open(os.ctermid(), os.O_RDONLY)
+    except (AttributeError, OSError):
+        return False
+    try:
+        return os.tcgetpgrp(fd) == os.getpgrp()
+    except (AttributeError, OSError):
+        return False
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def _forward_signals(proc):
+    """
+    Relays FORWARDED_SIGNALS received by the CLI to the child process for the duration of the context, so that the
+    child decides how to react (e.g. ssh cleaning up its session) and its exit status is what we report.
+    In the terminal's foreground the child, which stays in our process group, gets TERMINAL_SIGNALS such as
+    Ctrl-C straight from the terminal; those are only kept from interrupting the CLI, not sent a second time.
+    Signal handlers can only be installed from the main thread; elsewhere this is a no-op.
+
+    :param proc: Child process to forward signals to
+    :type proc: subprocess.Popen
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def forward(signum, frame):
+        if proc.returncode is None:
+            proc.send_signal(signum)
+
+    def ignore(signum, frame):
+        pass
+
+    terminal_signals = TERMINAL_SIGNALS if _in_terminal_foreground() else ()
+    previous = {}
+    try:
+        for signum in FORWARDED_SIGNALS:
+            previous[signum] = signal.signal(signum, ignore if signum in terminal_signals else forward)
+        yield
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+
+def _exit_status(returncode):
+    """
+    :return: The child's exit status as a shell would report it: 128 + signal number if it was killed by a signal
+    :rtype: int
+    """
+    if returncode < 0:
+        return 128 - returncode
+    return returncode
 
 
 class EC2InstanceConnectCLI(object):
@@ -28,9 +103,10 @@ class EC2InstanceConnectCLI(object):
     establishes an SSH connection using the respective private key
     """
 
-    def __init__(self, instance_bundles, pub_key, cli_command, logger):
+    def __init__(self, instance_bundles, pub_key, cli_command, logger, cache_priv_key=None, replace_process=False,
+                 client_cache=None, instance_cache_ttl=0, hedge_percentile=None, regions=None, race_port=None):
         """
-        :param instance_bundles: list of dicts that provide dns name, zone, etc information about EC2 instances
+        :param instance_bundles: InstanceBundles that provide dns name, zone, etc information about EC2 instances
         :type instance_bundles: list
         :param pub_key: ssh public key
         :type pub_key: basestring
@@ -38,93 +114,459 @@ class EC2InstanceConnectCLI(object):
         :type cli_command: basestring
         :param logger: CLI logging utility to send log messages to
         :type logger: ec2instanceconnectcli.EC2InstanceConnectLogger.EC2InstanceConnectLogger
+        :param cache_priv_key: private key matching pub_key. If given, pushes are recorded in the pushed key cache \
+            and skipped while an earlier push of the same key to the same instance is still valid.
+        :type cache_priv_key: basestring
+        :param replace_process: exec the command in place of the CLI process instead of waiting for it to finish
+        :type replace_process: bool
+        :param client_cache: botocore session and client cache to share, e.g. across several CLI instances. \
+            If not given, a new one is used for this CLI instance.
+        :type client_cache: ec2instanceconnectcli.client_cache.ClientCache
+        :param instance_cache_ttl: seconds for which instance information is served from the instance cache instead \
+            of DescribeInstances. 0 disables the cache.
+        :type instance_cache_ttl: int
+        :param hedge_percentile: latency percentile after which slow DescribeInstances and SendSSHPublicKey calls \
+            are hedged with a second call. None disables hedging.
+        :type hedge_percentile: float
+        :param regions: regions to search, along with the profile's default region, for instances given without a \
+            region. None or empty disables region discovery.
+        :type regions: list
+        :param race_port: port to race connections to each instance's addresses on, to pick the first reachable \
+            one. None connects to the public IP, or the private IP if there is none.
+        :type race_port: int
         """
         self.instance_bundles = instance_bundles
         self.pub_key = pub_key
         self.logger = logger
         self.cli_command = cli_command
+        self.cache_priv_key = cache_priv_key
+        self.replace_process = replace_process
+        if client_cache is None:
+            client_cache = ClientCache(self._get_debug_session)
+        self.client_cache = client_cache
+        self.instance_cache_ttl = instance_cache_ttl
+        self.hedge_percentile = hedge_percentile
+        self.regions = regions or []
+        # Bundles whose instance information came from the instance cache rather than EC2
+        self.cached_bundles = []
+        # Bundles whose region came from the region cache
+        self.region_cached_bundles = []
+        # Instance information found by region discovery, by InstanceID
+        self.discovered_instances = {}
+        self.race_port = race_port
+        # Bundles whose address came from the address race cache
+        self.address_cached_bundles = []
 
     def call_ec2(self):
         """
-        Fetches information on the associated EC2 instance
+        Fetches information on the associated EC2 instances, with one batched lookup per session
         """
 
+        # Bundles sharing a session (i.e. profile and region) are looked up together
+        lookups = {}
         for bundle in self.instance_bundles:
-            session = bundle['session']
+            session = bundle.session
             #If bundle['target'] has a value, then use it.
-            if bundle['target']:
-                bundle['host_info'] = bundle['target']
+            if bundle.target:
+                bundle['host_info'] = bundle.target
             else:
                 bundle['host_info'] = None
 
-            if (bundle['target'] and bundle['zone']) or len(bundle['instance_id']) == 0:
+            if (bundle.target and bundle.zone) or len(bundle.instance_id) == 0:
                 # If both are specified or we're not using an instance then we have no reason to call EC2
-                self.logger.debug("{0} does not require lookup".format(bundle['target']))
+                self.logger.debug("{0} does not require lookup".format(bundle.target))
                 continue
 
-            instance_info = ec2_util.get_instance_data(session, bundle['instance_id'])
-            bundle['zone'] = instance_info.availability_zone
-            #If host_info is not available, fallback to using public ipaddress and then private ipaddress.
-            if not bundle['host_info']:
-                bundle['host_info'] = instance_info.public_ip if instance_info.public_ip else instance_info.private_ip
-            self.logger.debug('Successfully got instance information from EC2 API for {0}'.format(bundle['instance_id']))
+            lookups.setdefault(id(session), (session, []))[1].append(bundle)
+
+        for session, bundles in lookups.values():
+            instance_ids = [bundle.instance_id for bundle in bundles]
+            instance_infos = self._get_cached_instances(bundles[0], instance_ids)
+            cached_ids = set(instance_infos)
+            for instance_id in instance_ids:
+                if instance_id in self.discovered_instances and instance_id not in instance_infos:
+                    instance_infos[instance_id] = self.discovered_instances[instance_id]
+            missing_ids = [instance_id for instance_id in instance_ids if instance_id not in instance_infos]
+            if missing_ids:
+                try:
+                    fetched_infos = ec2_util.get_instances_data(session, missing_ids, client_cache=self.client_cache,
+                                                                hedge_percentile=self.hedge_percentile)
+                except SystemExit:
+                    # e.g. the instance was terminated since its region was cached
+                    # By identity: bundles compare equal by value, as the dicts they replaced did, and the same
+                    # target can be listed twice
+                    region_cached = set(id(cached) for cached in self.region_cached_bundles)
+                    self._forget_regions([bundle for bundle in bundles if id(bundle) in region_cached])
+                    raise
+                self._cache_instances(bundles[0], fetched_infos)
+                instance_infos.update(fetched_infos)
+            for bundle in bundles:
+                instance_info = instance_infos[bundle.instance_id]
+                bundle['zone'] = instance_info.availability_zone
+                if not bundle.host_info:
+                    bundle['host_info'] = self._pick_address(bundle, instance_info)
+                if bundle.instance_id in missing_ids:
+                    self.logger.debug('Successfully got instance information from EC2 API for {0}'.format(bundle.instance_id))
+                elif bundle.instance_id in cached_ids:
+                    self.cached_bundles.append(bundle)
+                    self.logger.debug('Using cached instance information for {0}'.format(bundle.instance_id))
+                else:
+                    self.logger.debug('Using instance information from region discovery for {0}'.format(bundle.instance_id))
+        self._record_master_hosts()
+
+    def _pick_address(self, bundle, instance_info):
+        """
+        Picks the address to connect to the bundle's instance on: the first to accept a connection if addresses are
+        raced, else the public IP, falling back to the private IP and then to IPv6
+        """
+        default = instance_info.public_ip or instance_info.private_ip or \
+            (getattr(instance_info, 'ipv6_addresses', None) or [None])[0]
+        if not self.race_port:
+            return default
+        try:
+            candidates = address_race.get_candidates(instance_info)
+            location = address_race.network_location()
+            address = address_race.lookup(location, bundle.instance_id, candidates)
+            if address:
+                self.logger.debug('Using cached address {0} for {1}'.format(address, bundle.instance_id))
+                self.address_cached_bundles.append(bundle)
+                return address
+            with timings.span('address_race', instance_id=bundle.instance_id, candidates=len(candidates)):
+                address = address_race.race(candidates, self.race_port)
+            if address is None:
+                self.logger.debug('None of {0} accepted a connection on port {1}'.format(', '.join(candidates),
+                                                                                        self.race_port))
+                return default
+            self.logger.debug('Connecting to {0} on {1}'.format(bundle.instance_id, address))
+            address_race.remember(location, bundle.instance_id, address)
+            return address
+        except Exception as e:
+            self.logger.debug('Address race failed: {0}'.format(str(e)))
+            return default
+
+    def _forget_addresses(self, bundles):
+        try:
+            location = address_race.network_location()
+            for bundle in bundles:
+                address_race.forget(location, bundle.instance_id)
+                self.logger.debug('Forgot the cached address of {0}'.format(bundle.instance_id))
+        except Exception as e:
+            self.logger.debug('Failed to update the address cache: {0}'.format(str(e)))
+
+    @staticmethod
+    def _get_cache_namespace(bundle):
+        """
+        :return: The profile and region the bundle's instance is looked up with, resolving the session's default region
+        :rtype: tuple
+        """
+        region = bundle.region or bundle.session.get_config_variable('region')
+        return bundle.profile, region
+
+    def _get_cached_instances(self, bundle, instance_ids):
+        """
+        Looks up instances sharing the given bundle's profile and region in the instance cache
+        """
+        if self.instance_cache_ttl <= 0:
+            return {}
+        try:
+            profile, region = self._get_cache_namespace(bundle)
+            return instance_cache.get(profile, region, instance_ids, self.instance_cache_ttl)
+        except Exception as e:
+            self.logger.debug('Instance cache unavailable: {0}'.format(str(e)))
+            return {}
+
+    def _cache_instances(self, bundle, instance_infos):
+        """
+        Stores instance information fetched from EC2 for the given bundle's profile and region in the instance cache
+        """
+        if self.instance_cache_ttl <= 0:
+            return
+        try:
+            profile, region = self._get_cache_namespace(bundle)
+            instance_cache.put(profile, region, instance_infos, self.instance_cache_ttl)
+        except Exception as e:
+            self.logger.debug('Failed to update the instance cache: {0}'.format(str(e)))
+
+    def _invalidate_cached_instances(self, bundles):
+        """
+        Drops the given bundles' instances from the instance cache, e.g. because the cached zone or address was stale
+        """
+        for bundle in bundles:
+            try:
+                profile, region = self._get_cache_namespace(bundle)
+                instance_cache.invalidate(profile, region, [bundle.instance_id])
+                self.logger.debug('Invalidated cached instance information for {0}'.format(bundle.instance_id))
+            except Exception as e:
+                self.logger.debug('Failed to update the instance cache: {0}'.format(str(e)))
+
+    def _get_control_path(self, bundle):
+        """
+        :return: ControlPath the command uses for the bundle's instance, or None if it does not multiplex it
+        :rtype: basestring
+        """
+        if self.cli_command is None or bundle is not self.instance_bundles[0]:
+            # Only the first target is connected to through a master
+            return None
+        return self.cli_command.get_control_path(bundle)
+
+    def reuse_master(self):
+        """
+        Checks whether every instance to connect to has a live ssh master connection.  If so, the addresses the
+        masters were connected to are filled in and the command can be run without looking the instances up or
+        pushing a key.
+        :return: Whether the masters can be reused
+        :rtype: bool
+        """
+        hosts = []
+        multiplexed = False
+        for bundle in self.instance_bundles:
+            if len(bundle.instance_id) == 0:
+                hosts.append(bundle.target)
+                continue
+            multiplexed = True
+            control_path = self._get_control_path(bundle)
+            if not control_path or not multiplex.is_master_alive(control_path):
+                return False
+            host_info = bundle.target or multiplex.read_host(control_path)
+            if not host_info:
+                return False
+            hosts.append(host_info)
+        if not multiplexed:
+            return False
+        for bundle, host_info in zip(self.instance_bundles, hosts):
+            bundle['host_info'] = host_info
+            if len(bundle.instance_id) > 0:
+                self.logger.debug('Reusing the live ssh master connection to {0}'.format(bundle.instance_id))
+        return True
+
+    def _record_master_hosts(self):
+        """
+        Records the address of each instance the command may start a master connection to, for reuse_master
+        """
+        for bundle in self.instance_bundles:
+            if len(bundle.instance_id) == 0 or bundle.target:
+                continue
+            control_path = self._get_control_path(bundle)
+            if not control_path:
+                continue
+            try:
+                multiplex.write_host(control_path, bundle.host_info)
+            except Exception as e:
+                self.logger.debug('Failed to record the master connection address: {0}'.format(str(e)))
 
     def handle_keys(self):
         """
         Pushes the public key to the EC2 Instance(s) using AWS EC2 Instance Connect
         """
         for bundle in self.instance_bundles:
-            session = bundle['session']
-            if len(bundle['instance_id']) == 0:
-                self.logger.debug("{0} does not require pushing public key using EC2InstanceConnect".format(bundle['target']))
+            session = bundle.session
+            if len(bundle.instance_id) == 0:
+                self.logger.debug("{0} does not require pushing public key using EC2InstanceConnect".format(bundle.target))
+                continue
+            if self._is_key_pushed(bundle):
+                self.logger.debug('Reusing the public key pushed to {0} within the last {1} seconds'.format(
+                    bundle.instance_id, key_cache.MAX_AGE_SECONDS))
                 continue
-            key_publisher.push_public_key(session, bundle['instance_id'], bundle['username'], self.pub_key, bundle['zone'])
-            self.logger.debug('Successfully pushed the public key to {0}'.format(bundle['instance_id']))
+            pushed_at = time.time()
+            try:
+                key_publisher.push_public_key(session, bundle.instance_id, bundle.username, self.pub_key,
+                                              bundle.zone, client_cache=self.client_cache,
+                                              hedge_percentile=self.hedge_percentile)
+            except SystemExit:
+                # e.g. the instance moved and the cached availability zone no longer matches
+                if any(cached is bundle for cached in self.cached_bundles):
+                    self._invalidate_cached_instances([bundle])
+                raise
+            self.logger.debug('Successfully pushed the public key to {0}'.format(bundle.instance_id))
+            self._record_key_push(bundle, pushed_at)
+
+    def _is_key_pushed(self, bundle):
+        """
+        Checks the pushed key cache for a still-valid push of our key to the bundle's instance and user
+        """
+        if not self.cache_priv_key:
+            return False
+        try:
+            return key_cache.is_pushed(bundle.instance_id, bundle.username, bundle.profile, bundle.region,
+                                       self.pub_key)
+        except Exception as e:
+            self.logger.debug('Pushed key cache unavailable: {0}'.format(str(e)))
+            return False
+
+    def _record_key_push(self, bundle, pushed_at):
+        """
+        Records a push in the pushed key cache so that later invocations can reuse the key
+        """
+        if not self.cache_priv_key:
+            return
+        try:
+            key_cache.store(bundle.instance_id, bundle.username, bundle.profile, bundle.region,
+                            self.pub_key, self.cache_priv_key, pushed_at)
+        except Exception as e:
+            self.logger.debug('Failed to record the key push: {0}'.format(str(e)))
 
     def run_command(self, command=None):
         """
-        Runs the given command in a sub-shell
-        :param command: Command to invoke
-        :type command: basestring
-        :return: Return code for remote command
+        Runs the given command without a shell and blocks until it exits, forwarding SIGINT, SIGTERM, SIGHUP and
+        SIGWINCH to it in the meantime unless the terminal delivers them to it already
+        :param command: Program and arguments to invoke
+        :type command: list
+        :return: Return code for remote command, or 128 + signal number if it was killed by a signal
         :rtype: int
         """
         if not command:
             raise ValueError('Must provide a command')
 
-        invocation_proc = Popen(command, shell=True)
-        while invocation_proc.poll() is None: #sub-process not terminated
-            time.sleep(0.1)
-        return invocation_proc.returncode
+        start = time.monotonic()
+        with timings.span('ssh_spawn', program=command[0]):
+            invocation_proc = Popen(command)
+        with _forward_signals(invocation_proc):
+            returncode = invocation_proc.wait()
+        timings.add_span('ssh', start, time.monotonic(), program=command[0])
+        return _exit_status(returncode)
+
+    def exec_command(self, command=None):
+        """
+        Replaces the current process with the given command, so nothing of the CLI stays resident
+        for the duration of the session.  Does not return.
+        :param command: Program and arguments to invoke
+        :type command: list
+        """
+        if not command:
+            raise ValueError('Must provide a command')
+
+        # Nothing after the exec can report the timings or save the latencies recorded at exit
+        timings.emit()
+        hedging.save_all()
+        try:
+            instance_cache.flush()
+        except Exception as e:
+            self.logger.debug('Failed to update the instance cache: {0}'.format(str(e)))
+        logging.shutdown()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.execvp(command[0], command)
 
     def invoke_command(self):
         """
-        Generates the appropriate shell command and invokes it
+        Generates the appropriate command and invokes it
         :return: Return code for remote command
         :rtype: int
         """
         try:
-            for bundle in self.instance_bundles:
-                session = self._get_botocore_session(profile_name=bundle['profile'], region=bundle['region'])
-                # enable debug logging on botocore session if command line debug option is set
-                if self.logger.getEffectiveLevel() == logging.DEBUG:
-                    session.set_debug_logger()
-                bundle['session'] = session
-
+            if self.reuse_master():
+                # The master is already authenticated; ssh only opens a new channel over it
+                return self.connect()
+            self.create_sessions()
             self.call_ec2()
             self.handle_keys()
-
-            #important to generate the command after calling call_ec2 and handle_keys
-            return self.run_command(self.cli_command.get_command())
+            return self.connect()
 
         except Exception as e:
             self.logger.error("Failed with: " + str(e))
             sys.exit(1)
 
+    def connect(self):
+        """
+        Generates the command for instances that have been looked up and had the key pushed, and invokes it
+        :return: Return code for remote command
+        :rtype: int
+        """
+        #important to generate the command after calling call_ec2 and handle_keys
+        command = self.cli_command.get_command()
+        if self.replace_process:
+            self.exec_command(command)
+        return self.command_finished(self.run_command(command))
+
+    def create_sessions(self):
+        """
+        Gives every bundle its botocore session; bundles with the same profile and region share one.
+        Bundles without a region get the instance's region first if region discovery is enabled.
+        """
+        self.resolve_regions()
+        with timings.span('session'):
+            for bundle in self.instance_bundles:
+                bundle['session'] = self.client_cache.get_session(profile_name=bundle.profile,
+                                                                  region=bundle.region)
+
+    def resolve_regions(self):
+        """
+        Sets the region of bundles whose instance is given without one, from the region cache or by probing the
+        profile's default region and self.regions in parallel
+        """
+        if not self.regions:
+            return
+        for bundle in self.instance_bundles:
+            if bundle.region or len(bundle.instance_id) == 0 or (bundle.target and bundle.zone):
+                continue
+            region = self._lookup_region(bundle)
+            if region:
+                self.logger.debug('Using cached region {0} for {1}'.format(region, bundle.instance_id))
+                bundle['region'] = region
+                self.region_cached_bundles.append(bundle)
+                continue
+
+            session = self.client_cache.get_session(profile_name=bundle.profile)
+            with timings.span('region_discovery', instance_id=bundle.instance_id):
+                found = region_discovery.discover(session, bundle.instance_id, self.regions,
+                                                  client_cache=self.client_cache)
+            if found is None:
+                self.logger.error('Instance {0} not found in {1} or the default region'.format(
+                    bundle.instance_id, ', '.join(self.regions)))
+                sys.exit(1)
+            bundle['region'], instance_info = found
+            self.discovered_instances[bundle.instance_id] = instance_info
+            self._cache_instances(bundle, {bundle.instance_id: instance_info})
+            try:
+                region_discovery.remember(bundle.profile, bundle.instance_id, bundle.region)
+            except Exception as e:
+                self.logger.debug('Failed to update the region cache: {0}'.format(str(e)))
+
+    def _lookup_region(self, bundle):
+        try:
+            return region_discovery.lookup(bundle.profile, bundle.instance_id)
+        except Exception as e:
+            self.logger.debug('Region cache unavailable: {0}'.format(str(e)))
+            return None
+
+    def _forget_regions(self, bundles):
+        for bundle in bundles:
+            try:
+                region_discovery.forget(bundle.profile, bundle.instance_id)
+            except Exception as e:
+                self.logger.debug('Failed to update the region cache: {0}'.format(str(e)))
+
+    def command_finished(self, returncode):
+        """
+        Reacts to the command's exit status once it has finished
+        :param returncode: Exit status of the command
+        :type returncode: int
+        :return: The exit status to report
+        :rtype: int
+        """
+        if returncode == SSH_CONNECTION_FAILED and self.cached_bundles:
+            # The cached address may be stale; look the instances up again next time
+            self._invalidate_cached_instances(self.cached_bundles)
+        if returncode == SSH_CONNECTION_FAILED and self.address_cached_bundles:
+            # The network may have changed in a way network_location does not notice; race again next time
+            self._forget_addresses(self.address_cached_bundles)
+        return returncode
+
+    def _get_debug_session(self, profile_name=None, region=None):
+        """
+        Generates a botocore session as _get_botocore_session does, with debug logging enabled if the command line
+        debug option is set
+        """
+        session = self._get_botocore_session(profile_name=profile_name, region=region)
+        if self.logger.getEffectiveLevel() == logging.DEBUG:
+            session.set_debug_logger()
+        return session
+
     @staticmethod
     def _get_botocore_session(profile_name=None, region=None):
         """
-        Generates a botocore session with Managed SSH CLI set as the user agent
+        Generates a botocore session with Managed SSH CLI set as the user agent, loading trimmed service models
+        from the model cache
 
         :param profile_name: The name of a profile to use.  If not given, then the \
             default profile is used.
@@ -134,6 +576,9 @@ class EC2InstanceConnectCLI(object):
         :return: A Botocore session object
         :rtype: botocore.session.Session
         """
+        # botocore takes longer to import than anything else the CLI does before its first API call
+        import botocore.session
+
         session = botocore.session.get_session()
         botocore_info = 'Botocore/{0}'.format(session.user_agent_version)
         if session.user_agent_extra:
@@ -142,6 +587,8 @@ class EC2InstanceConnectCLI(object):
             session.user_agent_extra = botocore_info
         session.user_agent_name = 'aws-ec2-instance-connect-cli'
         session.user_agent_version = CLI_VERSION
+        with timings.span('model_cache'):
+            model_cache.install(session)
 
         """
         # Credential precedence:
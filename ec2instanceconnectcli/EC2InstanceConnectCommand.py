@@ -11,25 +11,36 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+import shlex
+
+from ec2instanceconnectcli import multiplex
+
+
 class EC2InstanceConnectCommand(object):
     """
     Generates commands relevant for the client.
     """
 
-    def __init__(self, program, instance_bundles, key_file, flags, program_command, logger):
+    def __init__(self, program, instance_bundles, key_file, flags, program_command, logger, identity_agent=None,
+                 control_persist=0):
         """
         Utility class to generate program specific command.
 
         :param program: Client program to be invoked by the CLI.
         :type program: basestring
-        :param key_file: private key file name.
+        :param key_file: private key file name, or None to connect over a live master connection without one.
         :type key_file: basestring
         :param flags: program specific flags.
-        :type flags: basestring
-        :param program_command: program specific ad-hoc command.
-        :type program_command: basestring
+        :type flags: list
+        :param program_command: program specific ad-hoc command arguments.
+        :type program_command: list
         :param logger: EC2 Instance Connect CLI logger to write log messages to
         :type logger: ec2instanceconnectcli.EC2InstanceConnectLogger.EC2InstanceConnectLogger
+        :param identity_agent: ssh-agent socket holding the private key; key_file then names its public key.
+        :type identity_agent: basestring
+        :param control_persist: seconds for which ssh keeps the master connection to an instance open after the \
+            session ends, for later connections to reuse. 0 disables multiplexing.
+        :type control_persist: int
         """
         self.logger = logger
         self.program = program
@@ -37,46 +48,91 @@ class EC2InstanceConnectCommand(object):
         self.key_file = key_file
         self.flags = flags
         self.program_command = program_command
+        self.identity_agent = identity_agent
+        self.control_persist = control_persist
 
     def get_command(self):
         """
-        Generates and returns the generated command
+        Generates and returns the generated command as an argument list, to be run without a shell
+
+        :return: program and its arguments
+        :rtype: list
         """
         # Start with protocol & identity file
-        command = '{0} -o "IdentitiesOnly=yes" -i {1}'.format(self.program, self.key_file)
+        command = [self.program]
+        if self.key_file:
+            command.extend(['-o', 'IdentitiesOnly=yes', '-i', self.key_file])
+        if self.identity_agent:
+            command.extend(['-o', 'IdentityAgent={0}'.format(self.identity_agent)])
+        control_path = self.get_control_path(self.instance_bundles[0])
+        if control_path:
+            command.extend(['-o', 'ControlMaster=auto', '-o', 'ControlPath={0}'.format(control_path),
+                            '-o', 'ControlPersist={0}'.format(self.control_persist)])
 
         # Next add command flags if present
-        if len(self.flags) > 0:
-            command = "{0} {1}".format(command, self.flags)
+        command.extend(self.flags)
 
         # Target
-        command = "{0} {1}".format(command, self._get_target(self.instance_bundles[0]))
+        self._append_target(command, self.instance_bundles[0])
 
         #program specific command
-        if len(self.program_command) > 0:
-            command = "{0} {1}".format(command, self.program_command)
+        command.extend(self.program_command)
 
         if len(self.instance_bundles) > 1:
-            command = "{0} {1}".format(command, self._get_target(self.instance_bundles[1]))
+            self._append_target(command, self.instance_bundles[1])
 
-        self.logger.debug('Generated command: {0}'.format(command))
+        self.logger.debug('Generated command: {0}'.format(self.render_command(command)))
 
         return command
 
+    def get_control_path(self, instance_bundle):
+        """
+        :param instance_bundle: dict of information on the desired EC2 instance
+        :type instance_bundle: ec2instanceconnectcli.instance_bundle.InstanceBundle
+        :return: ControlPath of the master connection to the bundle's instance, or None if multiplexing is disabled \
+            or not possible for it
+        :rtype: basestring
+        """
+        if self.control_persist <= 0 or not instance_bundle.instance_id or not multiplex.is_supported():
+            return None
+        try:
+            return multiplex.get_control_path(instance_bundle, self.flags)
+        except Exception as e:
+            self.logger.debug('Multiplexing unavailable: {0}'.format(str(e)))
+            return None
+
+    @staticmethod
+    def render_command(command):
+        """
+        Renders an argument list as a shell-quoted string, for logging
+
+        :param command: program and its arguments
+        :type command: list
+        :return: printable command line
+        :rtype: basestring
+        """
+        return ' '.join(shlex.quote(arg) for arg in command)
+
+    @classmethod
+    def _append_target(cls, command, instance_bundle):
+        target = cls._get_target(instance_bundle)
+        if target:
+            command.append(target)
+
     @staticmethod
     def _get_target(instance_bundle):
         """
         Determines the ssh target (and potentially sftp file target) for a given EC2 instance bundle dict
         :param instance_bundle: dict of information on the desired EC2 instance
-        :type instance_bundle: dict
+        :type instance_bundle: ec2instanceconnectcli.instance_bundle.InstanceBundle
         :return: target in the form "user@host[:file]"
         :rtype: basestring
         """
         target = ''
-        if instance_bundle.get('host_info', None):
-            target = "{0}@{1}".format(instance_bundle['username'], instance_bundle['host_info'])
+        if instance_bundle.host_info:
+            target = "{0}@{1}".format(instance_bundle.username, instance_bundle.host_info)
         # file will exist only for SFTP and SCP operations.
-        if instance_bundle.get('file', None):
-            target = "{0}:{1}".format(target, instance_bundle['file']).lstrip(':')
+        if instance_bundle.file:
+            target = "{0}:{1}".format(target, instance_bundle.file).lstrip(':')
 
         return target
@@ -14,24 +14,107 @@
 import os
 import tempfile
 
-from ec2instanceconnectcli import key_utils
+from ec2instanceconnectcli import key_pool, key_utils
+
+FILE_DELIVERY = 'file'
+AGENT_DELIVERY = 'agent'
+MEMFD_DELIVERY = 'memfd'
+DELIVERY_MODES = (FILE_DELIVERY, AGENT_DELIVERY, MEMFD_DELIVERY)
+
+
+def fd_delivery_supported():
+    """
+    Whether the private key can be handed to a child program as /dev/fd/N, as memfd delivery requires
+
+    :return: True on platforms with /dev/fd
+    :rtype: bool
+    """
+    return os.name == 'posix' and os.path.isdir('/dev/fd')
 
 
 class EC2InstanceConnectKey(object):
     """
-    Generates 2048 bit RSA SSH key pair to be used in conjunction with the CLI.
+    Generates an SSH key pair (2048 bit RSA by default, or Ed25519/ECDSA P-256) to be used in conjunction with the CLI.
     Writes the private key to a temporary file on disk and changes it's permissions to 600 (read/write only by owner)
+    If a key pool watermark is given, the key pair is taken from the pre-generated key pool instead when available.
+    With agent delivery the private key is never written; it is served from an in-process ssh-agent instead.
+    With memfd delivery the private key lives in an anonymous memory file (or an already-unlinked temp file where
+    memfd_create is unavailable) passed as /dev/fd/N, so nothing needs cleaning up and the CLI can exec into ssh.
     """
-    def __init__(self, logger):
+    def __init__(self, logger, key_type=key_utils.default_key_type, pool_watermark=0, key_pair=None,
+                 delivery=FILE_DELIVERY):
         """
         :param logger: EC2 Instance Connect CLI logger to use for log messages
         :type logger: ec2instanceconnectcli.EC2InstanceConnectLogger.EC2InstanceConnectLogger
+        :param key_type: Type of key pair to generate, one of key_utils.supported_key_types. Default: 'rsa'
+        :type key_type: basestring
+        :param pool_watermark: Number of key pairs to keep in the key pool; 0 disables the pool. Default: 0
+        :type pool_watermark: int
+        :param key_pair: Existing public and private key to use instead of a new one, e.g. a recently pushed key
+        :type key_pair: tuple
+        :param delivery: How the private key is handed to ssh: 'file', 'agent' or 'memfd'. Default: 'file'
+        :type delivery: basestring
         """
         self.logger = logger
-        key = key_utils.generate_key(2048)
-        self.pub_key = key_utils.serialize_key(key, encoding='OpenSSH').decode('utf-8')
-        priv_key = key_utils.serialize_key(key, return_private=True).decode('utf-8')
-        self.tempf = self._write_priv_key(priv_key)
+        self.tempf = None
+        self.agent = None
+        self.key_fd = None
+        self.key_type = key_type
+        key = None
+
+        if not key_pair and pool_watermark > 0 and key_pool.is_supported():
+            key_pair = self._take_pooled_key(pool_watermark)
+
+        if key_pair:
+            self.pub_key, self.priv_key = key_pair
+        else:
+            key = key_utils.generate_key_by_type(key_type)
+            self.pub_key = key_utils.serialize_key(key, encoding='OpenSSH').decode('utf-8')
+            self.priv_key = key_utils.serialize_key(key, return_private=True).decode('utf-8')
+
+        if delivery == AGENT_DELIVERY:
+            self.agent = self._start_agent(key)
+        elif delivery == MEMFD_DELIVERY:
+            self.key_fd = self._write_priv_key_fd(self.priv_key)
+        else:
+            self.tempf = self._write_priv_key(self.priv_key)
+
+    def _start_agent(self, key):
+        """
+        Starts an in-process ssh-agent serving the private key
+
+        :param key: Private key object, or None to load it from the serialized private key
+        :type key: cryptography.hazmat.primitives.asymmetric.rsa.RSAPrivateKey
+        :return: The running agent
+        :rtype: ec2instanceconnectcli.ssh_agent.SSHAgent
+        """
+        from ec2instanceconnectcli import ssh_agent
+        if key is None:
+            key = key_utils.load_private_key(self.priv_key.encode('utf-8'))
+        agent = ssh_agent.SSHAgent(key, self.pub_key, self.logger)
+        agent.start()
+        return agent
+
+    def _take_pooled_key(self, pool_watermark):
+        """
+        Takes a key pair from the key pool and starts a background refill if the pool is running low.
+        Pool failures are never fatal: the caller falls back to generating a key.
+
+        :param pool_watermark: Number of key pairs to keep in the key pool
+        :type pool_watermark: int
+        :return: Tuple of public and private key, or None if no pooled key is available
+        :rtype: tuple
+        """
+        try:
+            pooled_key = key_pool.take(self.key_type)
+            if key_pool.spawn_refill(self.key_type, pool_watermark):
+                self.logger.debug('Started background refill of the {0} key pool'.format(self.key_type))
+        except Exception as e:
+            self.logger.debug('Key pool unavailable: {0}'.format(str(e)))
+            return None
+        if pooled_key:
+            self.logger.debug('Using a pre-generated {0} key from the key pool'.format(self.key_type))
+        return pooled_key
 
     def _write_priv_key(self, _priv_key):
         """
@@ -47,28 +130,90 @@ class EC2InstanceConnectKey(object):
         tempf.file.close()
         return tempf
 
+    def _write_priv_key_fd(self, _priv_key):
+        """
+        Writes the private key to an anonymous file that only exists as an inheritable file descriptor
+
+        :param _priv_key: private key body
+        :type _priv_key: basestring
+        :return: file descriptor holding the private key
+        :rtype: int
+        """
+        if hasattr(os, 'memfd_create'):
+            fd = os.memfd_create('ec2-instance-connect-key', 0)
+            os.fchmod(fd, 0o600)
+        else:
+            fd, path = tempfile.mkstemp()
+            os.remove(path)
+        os.write(fd, _priv_key.encode('utf-8'))
+        # Where /dev/fd/N duplicates the descriptor rather than reopening it, the child shares our offset
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.set_inheritable(fd, True)
+        return fd
+
     def get_pub_key(self):
         """
-        Returns the generated RSA public key.
+        Returns the generated public key in OpenSSH format.
 
         :return: Public key body
         :rtype: bytearray
         """
         return self.pub_key
 
+    def get_priv_key(self):
+        """
+        Returns the private key matching the public key.
+
+        :return: PEM private key body
+        :rtype: basestring
+        """
+        return self.priv_key
+
     def get_priv_key_file(self):
         """
-        Returns either user provided key file or the temp file with generated RSA private key.
+        Returns either user provided key file or the temp file with generated private key.
 
-        :return: Private key filepath
+        :return: Private key filepath, or None with agent delivery
         :rtype: basestring
         """
+        if self.key_fd is not None:
+            return '/dev/fd/{0}'.format(self.key_fd)
+        if self.tempf is None:
+            return None
         return self.tempf.name
 
+    def get_identity_file(self):
+        """
+        Returns the file to pass to ssh with -i: the private key file, or with agent delivery the public key file
+        that selects the agent's key.
+
+        :return: Identity filepath
+        :rtype: basestring
+        """
+        if self.agent is not None:
+            return self.agent.get_pub_key_file()
+        return self.get_priv_key_file()
+
+    def get_identity_agent(self):
+        """
+        Returns the socket of the in-process ssh-agent serving the private key.
+
+        :return: Agent socket path, or None unless using agent delivery
+        :rtype: basestring
+        """
+        if self.agent is None:
+            return None
+        return self.agent.get_socket_path()
+
     def __del__(self):
         """
-        Remove the temp file with private key.
+        Remove the temp file with private key, or stop the ssh-agent serving it.
         """
+        if self.agent is not None:
+            self.logger.debug('Stopping the ssh-agent')
+            self.agent.stop()
+        if self.key_fd is not None:
+            os.close(self.key_fd)
         if self.tempf is not None:
             self.logger.debug('Deleting the private key file: {0}'.format(self.tempf.name))
             os.remove(self.tempf.name)
@@ -0,0 +1,227 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Picks which of an instance's addresses to connect to.
+
+Whether the public IPv4 address, the private one or an IPv6 address is reachable, and which is the shortest path,
+depends on where the CLI runs.  Connection attempts to the candidates are started STAGGER_SECONDS apart, or as soon
+as the previous attempt fails, and the first address to accept a connection wins (Happy Eyeballs, RFC 8305).
+The winner is cached per network location, identified by the local addresses the host routes to the internet from,
+and reused as long as the instance still has that address.  When ssh connects through a jump host or a ProxyCommand,
+what is reachable from here says nothing about what is reachable from there, so no race is run.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import socket
+import threading
+import time
+
+from ec2instanceconnectcli import local_cache
+
+ADDRESS_RACE_ENV = 'MSSH_ADDRESS_RACE'
+CACHE_DIR = 'addresses'
+LOCK_FILE = '.lock'
+DEFAULT_PORT = 22
+STAGGER_SECONDS = 0.25
+TIMEOUT_SECONDS = 5
+MAX_AGE_SECONDS = 24 * 60 * 60
+MAX_ENTRIES = 10000
+# Documentation addresses: connecting a UDP socket to them sends nothing, it only picks the local address of the
+# default route
+ROUTE_PROBES = ((socket.AF_INET, '192.0.2.1'), (getattr(socket, 'AF_INET6', None), '2001:db8::1'))
+# ssh options, lower case, that have it connect from somewhere else
+PROXY_OPTIONS = ('proxyjump', 'proxycommand')
+
+
+def routes_through_proxy(flags):
+    """
+    :param flags: ssh or sftp flags
+    :type flags: list
+    :return: Whether the flags have the program connect through a jump host (-J, -o ProxyJump) or a ProxyCommand
+    :rtype: bool
+    """
+    for index, flag in enumerate(flags):
+        if flag.startswith('-J'):
+            return True
+        if flag == '-o' and index + 1 < len(flags):
+            option = flags[index + 1]
+        elif flag.startswith('-o'):
+            option = flag[2:]
+        else:
+            continue
+        # Options are given as Name=value or Name value
+        name, _, value = option.strip().replace('=', ' ', 1).partition(' ')
+        if name.lower() in PROXY_OPTIONS and value.strip().lower() != 'none':
+            return True
+    return False
+
+
+def get_candidates(instance_info):
+    """
+    :param instance_info: Instance information as returned by ec2_util.get_instance_data
+    :type instance_info: argparse.Namespace
+    :return: The instance's addresses in order of preference: private IPv4, IPv6, public IPv4; or its DNS names
+        if it has no addresses
+    :rtype: list
+    """
+    # Inside the VPC the hairpinned public address usually connects within the stagger too, so the private address
+    # must start first to win.  Outside, it costs one stagger before the public address is tried, and only until
+    # the winner is cached.
+    addresses = [instance_info.private_ip] + list(getattr(instance_info, 'ipv6_addresses', None) or []) + \
+        [instance_info.public_ip]
+    candidates = [address for address in addresses if address]
+    if not candidates:
+        candidates = [name for name in (instance_info.private_dns_name, instance_info.public_dns_name) if name]
+    return list(dict.fromkeys(candidates))
+
+
+def network_location():
+    """
+    :return: Identifies the network the host is on by the local addresses of its default routes
+    :rtype: basestring
+    """
+    local_addresses = []
+    for family, address in ROUTE_PROBES:
+        if family is None:
+            continue
+        try:
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+        except (socket.error, IOError):
+            continue
+        try:
+            sock.connect((address, 9))
+            local_addresses.append(sock.getsockname()[0])
+        except (socket.error, IOError):
+            # No route for this family
+            pass
+        finally:
+            sock.close()
+    return '|'.join(local_addresses)
+
+
+def _index_path(location):
+    return os.path.join(local_cache.get_cache_dir(CACHE_DIR),
+                        hashlib.sha256(location.encode('utf-8')).hexdigest() + '.json')
+
+
+def _read_index(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _update_index(location, update):
+    """
+    Applies update(index) to the location's index under the cache lock and writes it back atomically
+    """
+    path = _index_path(location)
+    with local_cache.file_lock(os.path.join(os.path.dirname(path), LOCK_FILE)):
+        index = _read_index(path)
+        update(index)
+        local_cache.write_private_file(path, json.dumps(index, separators=(',', ':')).encode('utf-8'))
+
+
+def lookup(location, instance_id, candidates):
+    """
+    :param location: Network location, as returned by network_location
+    :type location: basestring
+    :param instance_id: InstanceID of the instance
+    :type instance_id: basestring
+    :param candidates: The instance's current addresses
+    :type candidates: list
+    :return: The address that won the last race from this location, if recent and still one of the candidates
+    :rtype: basestring
+    """
+    entry = _read_index(_index_path(location)).get(instance_id)
+    if entry is None or not 0 <= time.time() - entry['raced_at'] < MAX_AGE_SECONDS:
+        return None
+    return entry['address'] if entry['address'] in candidates else None
+
+
+def remember(location, instance_id, address):
+    """
+    Caches the winner of a race, dropping the oldest entries beyond MAX_ENTRIES
+    """
+    def update(index):
+        index[instance_id] = {'address': address, 'raced_at': time.time()}
+        if len(index) > MAX_ENTRIES:
+            for old_id in sorted(index, key=lambda key: index[key]['raced_at'])[:len(index) - MAX_ENTRIES]:
+                del index[old_id]
+
+    _update_index(location, update)
+
+
+def forget(location, instance_id):
+    """
+    Removes an instance from the cache, e.g. because its cached address could not be connected to
+    """
+    def update(index):
+        index.pop(instance_id, None)
+
+    _update_index(location, update)
+
+
+def race(candidates, port=DEFAULT_PORT, stagger=STAGGER_SECONDS, timeout=TIMEOUT_SECONDS):
+    """
+    Connects to the candidates with staggered starts and returns the first to accept the connection
+
+    :param candidates: Addresses or host names in order of preference
+    :type candidates: list
+    :param port: TCP port to connect to
+    :type port: int
+    :param stagger: Seconds to wait for an attempt before starting the next one
+    :type stagger: float
+    :param timeout: Seconds after which all attempts are given up
+    :type timeout: float
+    :return: The winning candidate, or None if none could be connected to in time
+    :rtype: basestring
+    """
+    results = queue.Queue()
+    deadline = time.monotonic() + timeout
+
+    def attempt(address):
+        try:
+            sock = socket.create_connection((address, port), timeout=max(deadline - time.monotonic(), 0.001))
+        except (socket.error, IOError) as e:
+            results.put((address, e))
+            return
+        sock.close()
+        results.put((address, None))
+
+    started = 0
+    failed = 0
+    while failed < len(candidates):
+        if started < len(candidates):
+            thread = threading.Thread(target=attempt, args=(candidates[started],),
+                                      name='connect-{0}'.format(candidates[started]))
+            # Attempts that lost the race must not keep the CLI from exiting
+            thread.daemon = True
+            thread.start()
+            started += 1
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        try:
+            address, error = results.get(timeout=min(stagger, remaining) if started < len(candidates) else remaining)
+        except queue.Empty:
+            continue
+        if error is None:
+            return address
+        failed += 1
+    return None
@@ -0,0 +1,177 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+asyncio engine for the lookup -> push -> connect pipeline of many targets.
+
+Each target moves through the stages on its own: its key push starts as soon as its own DescribeInstances returns,
+without waiting for the other targets.  The blocking botocore calls of EC2InstanceConnectCLI run on a thread pool,
+and the program is started with asyncio.create_subprocess_exec, so waiting on many ssh sessions needs no threads.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ec2instanceconnectcli import timings
+from ec2instanceconnectcli.EC2InstanceConnectCLI import _exit_status
+
+# Output lines longer than this are passed on in pieces
+STREAM_LIMIT = 64 * 1024
+
+
+class AsyncEngine(object):
+    """
+    Runs EC2InstanceConnectCLI pipelines for many targets with at most `concurrency` of them in flight at a time
+    """
+
+    def __init__(self, logger, output, concurrency):
+        """
+        :param logger: CLI logging utility to send log messages to
+        :type logger: ec2instanceconnectcli.EC2InstanceConnectLogger.EC2InstanceConnectLogger
+        :param output: Where the hosts' output goes, prefixed with each host's label
+        :type output: ec2instanceconnectcli.fleet.PrefixedOutput
+        :param concurrency: Maximum number of targets processed at once
+        :type concurrency: int
+        """
+        if concurrency < 1:
+            raise AssertionError('Concurrency must be at least 1')
+        self.logger = logger
+        self.output = output
+        self.concurrency = concurrency
+
+    def run(self, hosts):
+        """
+        Runs every host's pipeline to completion on a new event loop
+
+        :param hosts: (label, EC2InstanceConnectCLI) pairs. Consumed lazily, so it may be a generator over
+            any number of targets.
+        :type hosts: iterable
+        :return: Exit status of each host, in the order the hosts finished
+        :rtype: list
+        """
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            # The loop has to be the current one for its child watcher on older Pythons
+            asyncio.set_event_loop(loop)
+            return loop.run_until_complete(self._run(iter(hosts), executor))
+        finally:
+            executor.shutdown(wait=True)
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    async def _run(self, hosts, executor):
+        returncodes = []
+        loop = asyncio.get_event_loop()
+        hosts_lock = threading.Lock()
+
+        def next_host():
+            with hosts_lock:
+                return next(hosts, None)
+
+        async def worker():
+            # Workers share the iterator, so only as many targets as there are workers are ever materialized.
+            # Producing a target may page through DescribeInstances, so it happens on the executor too.
+            while True:
+                host = await loop.run_in_executor(executor, next_host)
+                if host is None:
+                    return
+                label, cli = host
+                returncodes.append(await self.run_host(label, cli, executor))
+
+        await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+        return returncodes
+
+    async def run_host(self, label, cli, executor):
+        """
+        Looks up the host, pushes the key and runs the program; only the last step is needed if the host has a
+        live ssh master connection
+
+        :return: Exit status for the host
+        :rtype: int
+        """
+        returncode = None
+        if not cli.reuse_master():
+            returncode = await self._run_blocking(executor, cli.create_sessions, cli.call_ec2, cli.handle_keys)
+        if returncode is None:
+            try:
+                returncode = cli.command_finished(await self.connect(label, cli.cli_command.get_command()))
+            except Exception as e:
+                self.logger.error("Failed with: " + str(e))
+                returncode = 1
+        if returncode != 0:
+            self.output.write_line(label, 'exited with status {0}'.format(returncode).encode('utf-8'),
+                                   self.output.stderr)
+        return returncode
+
+    async def _run_blocking(self, executor, *stages):
+        """
+        Runs blocking pipeline stages one after the other on the executor
+
+        :return: None if every stage succeeded, otherwise the exit status the failing stage asked for
+        :rtype: int
+        """
+        loop = asyncio.get_event_loop()
+        for stage in stages:
+            returncode = await loop.run_in_executor(executor, self._call_stage, stage)
+            if returncode is not None:
+                return returncode
+        return None
+
+    def _call_stage(self, stage):
+        try:
+            stage()
+        except SystemExit as e:
+            # Lookup and push failures exit; here they only fail this host
+            return e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            self.logger.error("Failed with: " + str(e))
+            return 1
+        return None
+
+    async def connect(self, label, command):
+        """
+        Runs the program with stdin from /dev/null, streaming its output with the host's label
+
+        :param label: Name to prefix the host's output with
+        :type label: basestring
+        :param command: Program and arguments to invoke
+        :type command: list
+        :return: Exit status of the program, or 128 + signal number if it was killed by a signal
+        :rtype: int
+        """
+        start = time.monotonic()
+        proc = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.DEVNULL,
+                                                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                    limit=STREAM_LIMIT)
+        timings.add_span('ssh_spawn', start, time.monotonic(), program=command[0], host=label)
+        await asyncio.gather(self._relay(label, proc.stdout, self.output.stdout),
+                             self._relay(label, proc.stderr, self.output.stderr))
+        returncode = await proc.wait()
+        timings.add_span('ssh', start, time.monotonic(), program=command[0], host=label)
+        return _exit_status(returncode)
+
+    async def _relay(self, label, reader, stream):
+        while True:
+            try:
+                line = await reader.readuntil(b'\n')
+            except asyncio.IncompleteReadError as e:
+                # Last line without a newline
+                line = e.partial
+            except asyncio.LimitOverrunError as e:
+                line = await reader.read(e.consumed)
+            if not line:
+                return
+            self.output.write_line(label, line, stream)
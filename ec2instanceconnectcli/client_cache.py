@@ -0,0 +1,85 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import threading
+
+
+class ClientCache(object):
+    """
+    Shares botocore sessions and clients within a run.
+    Sessions are created once per (profile, region) and clients once per (profile, region, service name), since
+    client creation loads service models and endpoint rules and is the slowest step before the first API call.
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self, session_factory):
+        """
+        :param session_factory: Creates a session given profile_name and region keyword arguments
+        :type session_factory: callable
+        """
+        self.session_factory = session_factory
+        self.sessions = {}
+        self.session_keys = {}
+        self.clients = {}
+        self.lock = threading.RLock()
+
+    def get_session(self, profile_name=None, region=None):
+        """
+        Returns the shared session for the given profile and region, creating it on first use
+
+        :param profile_name: The name of a profile to use. If not given, then the default profile is used.
+        :type profile_name: basestring
+        :param region: An AWS region name to set as the default for the session
+        :type region: basestring
+        :return: A Botocore session object
+        :rtype: botocore.session.Session
+        """
+        key = (profile_name, region)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.session_factory(profile_name=profile_name, region=region)
+                self.sessions[key] = session
+                self.session_keys[id(session)] = key
+            return session
+
+    def get_client(self, session, service_name, config=None, region_name=None):
+        """
+        Returns the shared client for the given service, creating it on first use.
+        Clients are cached by the profile and region of sessions handed out by get_session, and the region they are
+        created for; other sessions always get a new client.
+
+        :param session: Session to create the client from
+        :type session: botocore.session.Session
+        :param service_name: Name of the AWS service, e.g. 'ec2'
+        :type service_name: basestring
+        :param config: Client configuration. Callers sharing a service are expected to pass the same one.
+        :type config: botocore.config.Config
+        :param region_name: Region to create the client for instead of the session's
+        :type region_name: basestring
+        :return: A Botocore client
+        :rtype: botocore.client.BaseClient
+        """
+        kwargs = {'config': config}
+        if region_name is not None:
+            kwargs['region_name'] = region_name
+        with self.lock:
+            session_key = self.session_keys.get(id(session))
+            if session_key is None:
+                return session.create_client(service_name, **kwargs)
+            key = session_key + (service_name, region_name)
+            client = self.clients.get(key)
+            if client is None:
+                client = session.create_client(service_name, **kwargs)
+                self.clients[key] = client
+            return client
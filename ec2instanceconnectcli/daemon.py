@@ -0,0 +1,527 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Optional per-user daemon that does the AWS side of an invocation for the CLI.
+
+The daemon keeps botocore sessions, clients (and with them their HTTPS connection pools) and a few pre-generated key
+pairs warm between invocations.  The CLI sends it the parsed instance bundles over a Unix socket in the private
+local cache; the daemon looks the instances up, pushes a key and replies with the resolved bundles and the key pair,
+and the CLI then runs ssh itself.  Whenever the daemon cannot be used the CLI does the work in-process as usual.
+
+The protocol is one JSON request and one JSON response per connection, each terminated by a newline.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from ec2instanceconnectcli import __version__ as CLI_VERSION
+from ec2instanceconnectcli import instance_cache, key_cache, key_utils, local_cache, region_discovery, timings
+from ec2instanceconnectcli.instance_bundle import InstanceBundle
+
+CACHE_DIR = 'daemon'
+SOCKET_NAME = 'mssh.sock'
+LOCK_FILE = 'daemon.lock'
+IDLE_TIMEOUT_SECONDS = 15 * 60
+# Pre-generated key pairs kept in memory per key type
+KEY_POOL_SIZE = 4
+REQUEST_TIMEOUT_SECONDS = 30
+MAX_MESSAGE_BYTES = 1024 * 1024
+# Environment variables that change which credentials and configuration botocore picks up
+ENVIRONMENT_PREFIXES = ('AWS_',)
+ENVIRONMENT_NAMES = ('HOME', local_cache.CACHE_DIR_ENV)
+# Files botocore reads credentials from: the variable naming each one and its default location
+CREDENTIAL_FILES = (('AWS_CONFIG_FILE', '~/.aws/config'), ('AWS_SHARED_CREDENTIALS_FILE', '~/.aws/credentials'))
+# Where botocore and the AWS CLI cache the credentials of SSO logins and assumed roles
+CREDENTIAL_CACHE_DIRS = ('~/.aws/sso/cache', '~/.aws/cli/cache')
+
+
+def is_supported():
+    """
+    :return: Whether the daemon can run on this platform
+    :rtype: bool
+    """
+    return hasattr(socket, 'AF_UNIX') and local_cache.locking_supported()
+
+
+def get_socket_path():
+    """
+    :return: Path of the daemon's socket, in the private local cache
+    :rtype: basestring
+    """
+    return os.path.join(local_cache.get_cache_dir(CACHE_DIR), SOCKET_NAME)
+
+
+def environment_fingerprint(environ=None):
+    """
+    Fingerprints the parts of the environment that affect the AWS configuration, so that the daemon only serves
+    clients that would have resolved the same credentials
+
+    :param environ: Environment to fingerprint. Default: os.environ
+    :type environ: dict
+    :rtype: basestring
+    """
+    if environ is None:
+        environ = os.environ
+    items = sorted((name, value) for name, value in environ.items()
+                   if name.startswith(ENVIRONMENT_PREFIXES) or name in ENVIRONMENT_NAMES)
+    return hashlib.sha256(json.dumps(items).encode('utf-8')).hexdigest()
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def credentials_fingerprint(environ=None):
+    """
+    Fingerprints where the caller's credentials come from: the environment, as environment_fingerprint, and the
+    modification times of the AWS config and credentials files and of the files in the credential caches.  It
+    changes whenever credentials are rotated, a role is assumed again or an SSO login is refreshed.
+
+    :param environ: Environment to fingerprint. Default: os.environ
+    :type environ: dict
+    :rtype: basestring
+    """
+    if environ is None:
+        environ = os.environ
+    stamps = []
+    for name, default in CREDENTIAL_FILES:
+        path = os.path.expanduser(environ.get(name) or default)
+        stamps.append((path, _stat(path)))
+    for cache_dir in CREDENTIAL_CACHE_DIRS:
+        cache_dir = os.path.expanduser(cache_dir)
+        try:
+            names = sorted(os.listdir(cache_dir))
+        except OSError:
+            continue
+        stamps.extend((os.path.join(cache_dir, name), _stat(os.path.join(cache_dir, name))) for name in names)
+    return hashlib.sha256(json.dumps([environment_fingerprint(environ), stamps]).encode('utf-8')).hexdigest()
+
+
+def _send(sock, message):
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def _receive(sock):
+    """
+    :return: The next newline-terminated JSON message from the socket
+    :rtype: dict
+    """
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise IOError('Connection closed before a complete message was received')
+        data += chunk
+        if len(data) > MAX_MESSAGE_BYTES:
+            raise IOError('Message too large')
+    return json.loads(data.decode('utf-8'))
+
+
+def request(message, timeout=REQUEST_TIMEOUT_SECONDS):
+    """
+    Sends a request to the running daemon and waits for its response
+
+    :param message: Request, with an 'op' of 'prepare', 'invalidate', 'ping' or 'stop'
+    :type message: dict
+    :param timeout: Seconds to wait for the response
+    :type timeout: float
+    :return: The daemon's response
+    :rtype: dict
+    :raises socket.error: if no daemon is running
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(get_socket_path())
+        _send(sock, message)
+        return _receive(sock)
+    finally:
+        sock.close()
+
+
+def spawn():
+    """
+    Starts the daemon in a detached background process.  If one is already running the new process exits at once.
+    """
+    subprocess.Popen([sys.executable, '-m', 'ec2instanceconnectcli.daemon'], stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, close_fds=True, start_new_session=True)
+
+
+def prepare(instance_bundles, key_type, logger, reuse_key=False, instance_cache_ttl=0, hedge_percentile=None,
+            regions=None, race_port=None):
+    """
+    Has the daemon look up the instances and push a key to them.  Starts the daemon for later invocations if none
+    is running.  Failures are never fatal: the caller does the work itself instead.
+
+    :param instance_bundles: Instance bundles as returned by input_parser.parseargs
+    :type instance_bundles: list
+    :param key_type: Type of key pair to push, one of key_utils.supported_key_types
+    :type key_type: basestring
+    :param logger: CLI logging utility to send log messages to
+    :type logger: logging.Logger
+    :param reuse_key: Reuse a key recently pushed to the same instance and user
+    :type reuse_key: bool
+    :param instance_cache_ttl: See EC2InstanceConnectCLI
+    :type instance_cache_ttl: int
+    :param hedge_percentile: See EC2InstanceConnectCLI
+    :type hedge_percentile: float
+    :param regions: See EC2InstanceConnectCLI
+    :type regions: list
+    :param race_port: See EC2InstanceConnectCLI
+    :type race_port: int
+    :return: The resolved instance bundles, a tuple of the pushed public and private key and the bundles whose
+        instance information came from the instance cache; or None
+    :rtype: tuple
+    """
+    if not is_supported():
+        return None
+    message = {'op': 'prepare', 'version': CLI_VERSION, 'environment': environment_fingerprint(),
+               'credentials': credentials_fingerprint(), 'bundles': [dict(bundle) for bundle in instance_bundles],
+               'key_type': key_type, 'reuse_key': reuse_key, 'instance_cache_ttl': instance_cache_ttl,
+               'hedge_percentile': hedge_percentile, 'regions': regions, 'race_port': race_port}
+    try:
+        response = request(message)
+    except (socket.error, IOError, ValueError) as e:
+        if isinstance(e, (FileNotFoundError, ConnectionRefusedError)):
+            logger.debug('No mssh daemon is running; starting one')
+            try:
+                spawn()
+            except Exception as spawn_error:
+                logger.debug('Failed to start the mssh daemon: {0}'.format(str(spawn_error)))
+        else:
+            logger.debug('mssh daemon unavailable: {0}'.format(str(e)))
+        return None
+    if not response.get('ok'):
+        logger.debug('mssh daemon failed: {0}'.format(response.get('error')))
+        return None
+    logger.debug('Instances resolved and key pushed by the mssh daemon')
+    bundles = [InstanceBundle(**bundle) for bundle in response['bundles']]
+    return bundles, (response['pub_key'], response['priv_key']), [bundles[index] for index in response['cached']]
+
+
+def invalidate(instance_bundles, logger):
+    """
+    Has the daemon drop the given bundles' instances from the instance cache, as EC2InstanceConnectCLI does when ssh
+    cannot connect to a cached address.  Best effort.
+
+    :param instance_bundles: Bundles returned by prepare
+    :type instance_bundles: list
+    :param logger: CLI logging utility to send log messages to
+    :type logger: logging.Logger
+    """
+    message = {'op': 'invalidate', 'version': CLI_VERSION, 'environment': environment_fingerprint(),
+               'credentials': credentials_fingerprint(), 'bundles': [dict(bundle) for bundle in instance_bundles]}
+    try:
+        response = request(message)
+    except (socket.error, IOError, ValueError) as e:
+        response = {'error': str(e)}
+    if not response.get('ok'):
+        logger.debug('Failed to update the instance cache: {0}'.format(response.get('error')))
+
+
+def _generate_key_pair(key_type):
+    key = key_utils.generate_key_by_type(key_type)
+    return (key_utils.serialize_key(key, encoding='OpenSSH').decode('utf-8'),
+            key_utils.serialize_key(key, return_private=True).decode('utf-8'))
+
+
+class Daemon(object):
+    """
+    Serves prepare requests with warm botocore sessions, clients and keys
+    """
+
+    def __init__(self, logger, idle_timeout=IDLE_TIMEOUT_SECONDS, environment=None):
+        """
+        :param logger: CLI logging utility to send log messages to
+        :type logger: logging.Logger
+        :param idle_timeout: Seconds without requests after which the daemon exits
+        :type idle_timeout: float
+        :param environment: Fingerprint of the environment clients must match. Default: this process's
+        :type environment: basestring
+        """
+        self.logger = logger
+        self.idle_timeout = idle_timeout
+        self.environment = environment if environment is not None else environment_fingerprint()
+        # Sessions and clients hold resolved credentials, so they are only reused while the credentials fingerprint
+        # of the requests stays the same
+        self.credentials = None
+        self.client_cache = None
+        self.keys = {}
+        self.refilling = set()
+        self.lock = threading.Lock()
+        self.running = False
+        self.active_requests = 0
+
+    def handle(self, message):
+        """
+        :param message: Request received from a client, with an 'op' of 'prepare', 'invalidate', 'ping' or 'stop'
+        :type message: dict
+        :return: Response to send back
+        :rtype: dict
+        """
+        op = message.get('op')
+        if message.get('version') != CLI_VERSION:
+            # An upgraded CLI; make way for a daemon of its version
+            self.running = False
+            return {'ok': False, 'error': 'Daemon runs version {0}'.format(CLI_VERSION)}
+        if op == 'ping':
+            return {'ok': True, 'pid': os.getpid()}
+        if op == 'stop':
+            self.running = False
+            return {'ok': True}
+        if op not in ('prepare', 'invalidate'):
+            return {'ok': False, 'error': 'Unknown request {0}'.format(op)}
+        if message.get('environment') != self.environment:
+            return {'ok': False, 'error': 'Daemon was started with a different AWS environment'}
+        if op == 'prepare' and message.get('key_type') not in key_utils.supported_key_types:
+            return {'ok': False, 'error': '{0} is not a supported key type'.format(message.get('key_type'))}
+        client_cache = self._get_client_cache(message.get('credentials'))
+        try:
+            if op == 'invalidate':
+                return self._invalidate(message, client_cache)
+            return self._prepare(message, client_cache)
+        except SystemExit as e:
+            # Lookup and push failures exit; the client redoes the work and reports the error itself
+            return {'ok': False, 'error': 'Exited with status {0}'.format(e.code)}
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+    def _get_client_cache(self, credentials):
+        """
+        :param credentials: Credentials fingerprint of the request, as returned by credentials_fingerprint
+        :type credentials: basestring
+        :return: The cache of sessions and clients for these credentials, replacing the previous one if they changed
+        :rtype: ec2instanceconnectcli.client_cache.ClientCache
+        """
+        from ec2instanceconnectcli.EC2InstanceConnectCLI import EC2InstanceConnectCLI
+        from ec2instanceconnectcli.client_cache import ClientCache
+
+        with self.lock:
+            if self.client_cache is None or credentials != self.credentials:
+                if self.client_cache is not None:
+                    self.logger.debug('AWS credentials changed; dropping cached sessions')
+                self.credentials = credentials
+                self.client_cache = ClientCache(EC2InstanceConnectCLI._get_botocore_session)
+            return self.client_cache
+
+    def _prepare(self, message, client_cache):
+        from ec2instanceconnectcli.EC2InstanceConnectCLI import EC2InstanceConnectCLI
+
+        bundles = [InstanceBundle(**bundle) for bundle in message['bundles']]
+        key_pair = None
+        if message.get('reuse_key'):
+            key_pair = self._lookup_pushed_key(bundles, message.get('regions'))
+        if key_pair is None:
+            key_pair = self._take_key(message['key_type'])
+        pub_key, priv_key = key_pair
+
+        cli = EC2InstanceConnectCLI(bundles, pub_key, None, self.logger,
+                                    cache_priv_key=priv_key if message.get('reuse_key') else None,
+                                    client_cache=client_cache,
+                                    instance_cache_ttl=message.get('instance_cache_ttl') or 0,
+                                    hedge_percentile=message.get('hedge_percentile'),
+                                    regions=message.get('regions'), race_port=message.get('race_port'))
+        cli.create_sessions()
+        cli.call_ec2()
+        cli.handle_keys()
+        try:
+            # Runs that don't go through the daemon read the index directly
+            instance_cache.flush()
+        except Exception as e:
+            self.logger.debug('Failed to update the instance cache: {0}'.format(str(e)))
+        # The spans of a request are never reported; keep them from piling up over the daemon's life
+        timings.clear()
+        cached = [index for index, bundle in enumerate(bundles)
+                  if any(bundle is cached_bundle for cached_bundle in cli.cached_bundles)]
+        for bundle in bundles:
+            del bundle['session']
+        return {'ok': True, 'bundles': [dict(bundle) for bundle in bundles], 'pub_key': pub_key, 'priv_key': priv_key,
+                'cached': cached}
+
+    def _invalidate(self, message, client_cache):
+        from ec2instanceconnectcli.EC2InstanceConnectCLI import EC2InstanceConnectCLI
+
+        bundles = [InstanceBundle(**bundle) for bundle in message['bundles']]
+        cli = EC2InstanceConnectCLI(bundles, None, None, self.logger, client_cache=client_cache)
+        cli.create_sessions()
+        cli._invalidate_cached_instances(bundles)
+        return {'ok': True}
+
+    def _lookup_pushed_key(self, bundles, regions):
+        for bundle in bundles:
+            if len(bundle.instance_id) > 0:
+                try:
+                    region = bundle.region
+                    if not region and regions:
+                        region = region_discovery.lookup(bundle.profile, bundle.instance_id)
+                    return key_cache.lookup(bundle.instance_id, bundle.username, bundle.profile, region)
+                except Exception as e:
+                    self.logger.debug('Pushed key cache unavailable: {0}'.format(str(e)))
+                    return None
+        return None
+
+    def _take_key(self, key_type):
+        """
+        Takes a pre-generated key pair, generating one if none is left, and tops the pool up in the background
+        """
+        with self.lock:
+            pool = self.keys.setdefault(key_type, [])
+            key_pair = pool.pop() if pool else None
+            refill = key_type not in self.refilling
+            if refill:
+                self.refilling.add(key_type)
+        if refill:
+            thread = threading.Thread(target=self._refill, args=(key_type,), name='refill-{0}'.format(key_type))
+            thread.daemon = True
+            thread.start()
+        if key_pair is None:
+            key_pair = _generate_key_pair(key_type)
+        return key_pair
+
+    def _refill(self, key_type):
+        try:
+            while True:
+                with self.lock:
+                    if len(self.keys[key_type]) >= KEY_POOL_SIZE:
+                        return
+                key_pair = _generate_key_pair(key_type)
+                with self.lock:
+                    self.keys[key_type].append(key_pair)
+        finally:
+            with self.lock:
+                self.refilling.discard(key_type)
+
+    def serve(self):
+        """
+        Serves requests until stopped or idle for idle_timeout seconds.  Returns at once if another daemon is
+        already running.
+
+        :return: Whether this process served as the daemon
+        :rtype: bool
+        """
+        cache_dir = local_cache.get_cache_dir(CACHE_DIR)
+        with local_cache.file_lock(os.path.join(cache_dir, LOCK_FILE), blocking=False) as acquired:
+            if not acquired:
+                self.logger.debug('An mssh daemon is already running')
+                return False
+            socket_path = get_socket_path()
+            if os.path.exists(socket_path):
+                # Left behind by a daemon that was killed; we hold the lock, so nothing is listening on it
+                os.remove(socket_path)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                server.bind(socket_path)
+                os.chmod(socket_path, 0o600)
+                server.listen(64)
+                server.settimeout(1.0)
+                self._accept_loop(server)
+            finally:
+                server.close()
+                if os.path.exists(socket_path):
+                    os.remove(socket_path)
+        return True
+
+    def _accept_loop(self, server):
+        self.running = True
+        last_request = time.monotonic()
+        self.logger.debug('mssh daemon {0} listening'.format(os.getpid()))
+        while self.running:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                with self.lock:
+                    busy = self.active_requests > 0
+                if busy:
+                    last_request = time.monotonic()
+                elif time.monotonic() - last_request > self.idle_timeout:
+                    self.logger.debug('mssh daemon idle, exiting')
+                    break
+                continue
+            last_request = time.monotonic()
+            with self.lock:
+                self.active_requests += 1
+            thread = threading.Thread(target=self._serve_connection, args=(conn,), name='mssh-daemon-request')
+            thread.daemon = True
+            thread.start()
+
+    def _serve_connection(self, conn):
+        try:
+            conn.settimeout(REQUEST_TIMEOUT_SECONDS)
+            if not self._is_same_user(conn):
+                self.logger.debug('Rejected a connection from another user')
+                return
+            _send(conn, self.handle(_receive(conn)))
+        except Exception as e:
+            self.logger.debug('Request failed: {0}'.format(str(e)))
+        finally:
+            conn.close()
+            with self.lock:
+                self.active_requests -= 1
+
+    @staticmethod
+    def _is_same_user(conn):
+        """
+        Checks the peer's uid where the platform reports it.  Elsewhere the 0700 cache directory keeps other users
+        away from the socket.
+        """
+        if not hasattr(socket, 'SO_PEERCRED'):
+            return True
+        creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        _, uid, _ = struct.unpack('3i', creds)
+        return uid == os.getuid()
+
+
+def main():
+    """
+    Entry point of the daemon process: python -m ec2instanceconnectcli.daemon [--stop] [--debug]
+    """
+    parser = argparse.ArgumentParser(prog='python -m ec2instanceconnectcli.daemon')
+    parser.add_argument('--stop', action='store_true', help='Stop the running daemon')
+    parser.add_argument('--idle-timeout', action='store', help='Seconds without requests after which the daemon '
+                        'exits. Default: {0}'.format(IDLE_TIMEOUT_SECONDS),
+                        type=float, default=IDLE_TIMEOUT_SECONDS, metavar='')
+    parser.add_argument('-d', '--debug', action='store_true', help='Turn on debug logging')
+    args = parser.parse_args()
+
+    if not is_supported():
+        print('The mssh daemon is not supported on this platform')
+        return 1
+    if args.stop:
+        try:
+            request({'op': 'stop', 'version': CLI_VERSION})
+        except (socket.error, IOError):
+            print('No mssh daemon is running')
+            return 1
+        return 0
+
+    from ec2instanceconnectcli.EC2InstanceConnectLogger import EC2InstanceConnectLogger
+    logger = EC2InstanceConnectLogger(args.debug).get_logger()
+    Daemon(logger, idle_timeout=args.idle_timeout).serve()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,10 +12,19 @@
 # language governing permissions and limitations under the License.
 
 from argparse import Namespace
+import logging
 import sys
 
+from ec2instanceconnectcli import hedging, rate_limiter, timings
 
-def get_instance_data(session, instance_id):
+# Number of instance IDs sent per DescribeInstances request
+MAX_INSTANCE_IDS_PER_CALL = 1000
+# Page size when selecting instances by filter
+MAX_RESULTS_PER_PAGE = 1000
+RUNNING_FILTER = {'Name': 'instance-state-name', 'Values': ['running']}
+
+
+def get_instance_data(session, instance_id, client_cache=None, hedge_percentile=None):
     """
     Calls EC2 DescribeInstances API to get the DNS Names and IP addresses of the instance both Public and Private
     and also gets the Availability Zone of an instance
@@ -24,51 +33,177 @@ def get_instance_data(session, instance_id):
     :type session: Botocore.session.Session
     :param instance_id: InstanceID of the instance
     :type instance_id: basestring
-    :return: Namespace with Public DNS Name, Private DNS Name, Public IP, Private IP and Availability Zone
+    :param client_cache: Optional cache to share the EC2 client through
+    :type client_cache: ec2instanceconnectcli.client_cache.ClientCache
+    :param hedge_percentile: Optional latency percentile after which slow DescribeInstances calls are hedged
+    :type hedge_percentile: float
+    :return: Namespace with Public DNS Name, Private DNS Name, Public IP, Private IP, IPv6 addresses and
+        Availability Zone
     :rtype: argparse.Namespace
     """
+    return get_instances_data(session, [instance_id], client_cache=client_cache,
+                              hedge_percentile=hedge_percentile)[instance_id]
+
+
+def get_instances_data(session, instance_ids, client_cache=None, hedge_percentile=None):
+    """
+    Batched form of get_instance_data: looks up any number of instances in the session's region with as few
+    DescribeInstances calls as possible (one per MAX_INSTANCE_IDS_PER_CALL instances, following NextToken)
+
+    :param session: A Botocore session to use to generate the EC2 client
+    :type session: Botocore.session.Session
+    :param instance_ids: InstanceIDs of the instances
+    :type instance_ids: list
+    :param client_cache: Optional cache to share the EC2 client through
+    :type client_cache: ec2instanceconnectcli.client_cache.ClientCache
+    :param hedge_percentile: Optional latency percentile after which slow DescribeInstances calls are hedged
+    :type hedge_percentile: float
+    :return: Dict of InstanceID to Namespace as returned by get_instance_data
+    :rtype: dict
+    """
+    # Preserve order, drop duplicates
+    instance_ids = list(dict.fromkeys(instance_ids))
 
     try:
-        client = session.create_client('ec2')
-        instance_id = [instance_id]
-        response = client.describe_instances(InstanceIds=instance_id)
-        availability_zone = response['Reservations'][0]['Instances'][0]['Placement']['AvailabilityZone']
-        try:
-            public_dns_name = response['Reservations'][0]['Instances'][0]['PublicDnsName']
-        except:
-            public_dns_name = None
-            pass
-        try:
-            private_dns_name = response['Reservations'][0]['Instances'][0]['PrivateDnsName']
-        except:
-            private_dns_name = None
-            pass
-        try:
-            public_ip = response['Reservations'][0]['Instances'][0]['PublicIpAddress']
-        except:
-            public_ip = None
-            pass
-        try:
-            private_ip = response['Reservations'][0]['Instances'][0]['PrivateIpAddress']
-        except:
-            private_ip = None
-            pass
+        with timings.span('client', service='ec2'):
+            if client_cache is not None:
+                client = client_cache.get_client(session, 'ec2', config=rate_limiter.get_client_config())
+            else:
+                client = session.create_client('ec2', config=rate_limiter.get_client_config())
+        instances = {}
+        for start in range(0, len(instance_ids), MAX_INSTANCE_IDS_PER_CALL):
+            chunk = instance_ids[start:start + MAX_INSTANCE_IDS_PER_CALL]
+            with timings.span('describe_instances', instances=len(chunk)):
+                for instance in _describe_instances(client, hedge_percentile, InstanceIds=chunk):
+                    instances[instance['InstanceId']] = _get_instance_info(instance)
     except Exception as e:
         print(str(e))
         sys.exit(1)
-    else:
-        if len(availability_zone) == 0:
-            print("Instance zone information not found")
-            sys.exit(7)
-        if not (public_dns_name or private_dns_name or public_ip or private_ip):
-            print("No hostname or IPs found")
-            sys.exit(8)
+
+    instance_infos = {}
+    for instance_id in instance_ids:
+        instance_info = instances.get(instance_id)
+        if instance_info is None:
+            print("Instance {0} not found".format(instance_id))
+            sys.exit(1)
+        _validate_instance_info(instance_info)
+        instance_infos[instance_id] = instance_info
+
+    return instance_infos
+
+
+def iter_instances(session, filters, client_cache=None, hedge_percentile=None):
+    """
+    Finds the running instances matching DescribeInstances filters in the session's region.  Pages are fetched as
+    the results are consumed, so any number of instances can be processed with one page in memory at a time.
+    Instances without any hostname or IP are skipped, and logged.  Unlike get_instances_data, errors from
+    DescribeInstances are raised rather than printed before exiting, so a caller selecting for many targets can fail
+    just this selection.  Nothing is written to stdout, which fleet mode fills with the prefixed output of each host.
+
+    :param session: A Botocore session to use to generate the EC2 client
+    :type session: Botocore.session.Session
+    :param filters: DescribeInstances filters, e.g. [{'Name': 'tag:Role', 'Values': ['web']}]. Unless they say \
+        otherwise, only running instances are returned.
+    :type filters: list
+    :param client_cache: Optional cache to share the EC2 client through
+    :type client_cache: ec2instanceconnectcli.client_cache.ClientCache
+    :param hedge_percentile: Optional latency percentile after which slow DescribeInstances calls are hedged
+    :type hedge_percentile: float
+    :return: Generator of InstanceID and Namespace as returned by get_instance_data pairs
+    :rtype: generator
+    """
+    filters = list(filters)
+    if not any(instance_filter['Name'] == RUNNING_FILTER['Name'] for instance_filter in filters):
+        filters.append(RUNNING_FILTER)
+
+    with timings.span('client', service='ec2'):
+        if client_cache is not None:
+            client = client_cache.get_client(session, 'ec2', config=rate_limiter.get_client_config())
         else:
-            instance_info = Namespace(public_dns_name=public_dns_name,
-                                      private_dns_name=private_dns_name,
-                                      public_ip=public_ip,
-                                      private_ip=private_ip,
-                                      availability_zone=availability_zone
-                                      )
+            client = session.create_client('ec2', config=rate_limiter.get_client_config())
+    logger = logging.getLogger('EC2InstanceConnect')
+    for instance in _describe_instances(client, hedge_percentile, Filters=filters, MaxResults=MAX_RESULTS_PER_PAGE):
+        instance_info = _get_instance_info(instance)
+        if not _has_address(instance_info):
+            logger.error('No hostname or IPs found for {0}, skipping'.format(instance['InstanceId']))
+            continue
+        yield instance['InstanceId'], instance_info
+
 
+def build_instance_info(instance):
+    """
+    Builds the information get_instance_data returns from an instance description that was obtained some other
+    way, exiting like get_instance_data if it has no zone or no hostname or IP
+
+    :param instance: Instance description from DescribeInstances
+    :type instance: dict
+    :return: Namespace as returned by get_instance_data
+    :rtype: argparse.Namespace
+    """
+    instance_info = _get_instance_info(instance)
+    _validate_instance_info(instance_info)
     return instance_info
+
+
+def _describe_instances(client, hedge_percentile=None, **params):
+    """
+    Calls DescribeInstances through its rate limiter, following NextToken, and yields each instance of each
+    reservation
+
+    :param client: EC2 client
+    :type client: botocore.client.EC2
+    :param hedge_percentile: Optional latency percentile after which slow calls are hedged
+    :type hedge_percentile: float
+    :param params: DescribeInstances request parameters
+    :return: Instance descriptions
+    :rtype: generator
+    """
+    while True:
+        response = hedging.call(client, 'describe_instances', hedge_percentile, **params)
+        for reservation in response['Reservations']:
+            for instance in reservation['Instances']:
+                yield instance
+        next_token = response.get('NextToken')
+        if not next_token:
+            return
+        params['NextToken'] = next_token
+
+
+def _get_instance_info(instance):
+    """
+    Extracts the fields we use from an instance description.  A missing Placement raises KeyError.
+
+    :param instance: Instance description from DescribeInstances
+    :type instance: dict
+    :return: Namespace with Public DNS Name, Private DNS Name, Public IP, Private IP, IPv6 addresses and
+        Availability Zone
+    :rtype: argparse.Namespace
+    """
+    # The primary IPv6 address first, then those of each network interface
+    ipv6_addresses = [instance['Ipv6Address']] if instance.get('Ipv6Address') else []
+    for interface in instance.get('NetworkInterfaces', []):
+        for address in interface.get('Ipv6Addresses', []):
+            if address.get('Ipv6Address') and address['Ipv6Address'] not in ipv6_addresses:
+                ipv6_addresses.append(address['Ipv6Address'])
+    return Namespace(public_dns_name=instance.get('PublicDnsName'),
+                     private_dns_name=instance.get('PrivateDnsName'),
+                     public_ip=instance.get('PublicIpAddress'),
+                     private_ip=instance.get('PrivateIpAddress'),
+                     ipv6_addresses=ipv6_addresses,
+                     availability_zone=instance['Placement']['AvailabilityZone']
+                     )
+
+
+def _has_address(instance_info):
+    # Entries of older instance caches have no IPv6 addresses
+    return bool(instance_info.public_dns_name or instance_info.private_dns_name or instance_info.public_ip or
+                instance_info.private_ip or getattr(instance_info, 'ipv6_addresses', None))
+
+
+def _validate_instance_info(instance_info):
+    if len(instance_info.availability_zone) == 0:
+        print("Instance zone information not found")
+        sys.exit(7)
+    if not _has_address(instance_info):
+        print("No hostname or IPs found")
+        sys.exit(8)
@@ -0,0 +1,252 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Fleet mode: runs one command on many targets concurrently.
+
+Every target goes through the regular EC2InstanceConnectCLI pipeline (instance lookup, key push, ssh), driven by the
+asyncio engine with a bounded number of targets in flight.  The output of each host is streamed line by line,
+prefixed with the host it came from.  Selector targets such as tag:Role=web are expanded page by page as the engine
+asks for more hosts, so fleets of any size are never held in memory at once.
+"""
+
+import collections
+import logging
+import sys
+import threading
+
+from ec2instanceconnectcli import ec2_util
+from ec2instanceconnectcli.EC2InstanceConnectCLI import EC2InstanceConnectCLI
+from ec2instanceconnectcli.EC2InstanceConnectCommand import EC2InstanceConnectCommand
+from ec2instanceconnectcli.client_cache import ClientCache
+from ec2instanceconnectcli.instance_bundle import InstanceBundle
+
+DEFAULT_CONCURRENCY = 10
+# Number of most recently started instances that are remembered so that targets matching them again are skipped.
+# Bounded so that streaming any number of targets runs in flat memory.
+DEDUPE_WINDOW = 10000
+
+
+def get_label(instance_bundles):
+    """
+    :return: The name a fleet host's output is prefixed with: its instance ID, or the target host if it has none
+    :rtype: basestring
+    """
+    bundle = instance_bundles[0]
+    return bundle.instance_id or bundle.target
+
+
+class PrefixedOutput(object):
+    """
+    Writes whole lines from several hosts to shared output streams, each line prefixed with its host
+    """
+
+    def __init__(self, stdout=None, stderr=None):
+        """
+        :param stdout: Binary or text stream for the hosts' standard output. Default: sys.stdout
+        :param stderr: Binary or text stream for the hosts' standard error and fleet messages. Default: sys.stderr
+        """
+        self.stdout = stdout if stdout is not None else sys.stdout
+        self.stderr = stderr if stderr is not None else sys.stderr
+        self.lock = threading.Lock()
+
+    def write_line(self, label, line, stream):
+        """
+        :param label: Host the line came from
+        :type label: basestring
+        :param line: Line of output, with or without its trailing newline
+        :type line: bytes
+        :param stream: self.stdout or self.stderr
+        """
+        if not line.endswith(b'\n'):
+            line += b'\n'
+        data = '[{0}] '.format(label).encode('utf-8') + line
+        out = getattr(stream, 'buffer', stream)
+        with self.lock:
+            out.write(data)
+            out.flush()
+
+
+class FleetRunner(object):
+    """
+    Runs the same command on many targets with at most `concurrency` of them in flight at a time
+    """
+
+    def __init__(self, program, fleet_bundles, pub_key, key_file, flags, program_command, logger, identity_agent=None,
+                 concurrency=DEFAULT_CONCURRENCY, cache_priv_key=None, instance_cache_ttl=0, hedge_percentile=None,
+                 regions=None, control_persist=0, race_port=None, output=None):
+        """
+        :param program: Client program to be invoked on each target
+        :type program: basestring
+        :param fleet_bundles: The instance bundles of each target or selector, as returned by \
+            input_parser.parse_fleet_args, or a generator over them as returned by input_parser.parse_targets_file
+        :type fleet_bundles: iterable
+        :param pub_key: ssh public key to push to every instance
+        :type pub_key: basestring
+        :param key_file: private key file name, or the public key file when using identity_agent
+        :type key_file: basestring
+        :param flags: program specific flags
+        :type flags: list
+        :param program_command: command to run on every target
+        :type program_command: list
+        :param logger: CLI logging utility to send log messages to
+        :type logger: ec2instanceconnectcli.EC2InstanceConnectLogger.EC2InstanceConnectLogger
+        :param identity_agent: ssh-agent socket holding the private key
+        :type identity_agent: basestring
+        :param concurrency: Maximum number of targets processed at once
+        :type concurrency: int
+        :param cache_priv_key: See EC2InstanceConnectCLI
+        :type cache_priv_key: basestring
+        :param instance_cache_ttl: See EC2InstanceConnectCLI
+        :type instance_cache_ttl: int
+        :param hedge_percentile: See EC2InstanceConnectCLI
+        :type hedge_percentile: float
+        :param regions: See EC2InstanceConnectCLI
+        :type regions: list
+        :param control_persist: See EC2InstanceConnectCommand
+        :type control_persist: int
+        :param race_port: See EC2InstanceConnectCLI
+        :type race_port: int
+        :param output: Where the hosts' output goes. Default: sys.stdout and sys.stderr
+        :type output: PrefixedOutput
+        """
+        if concurrency < 1:
+            raise AssertionError('Concurrency must be at least 1')
+        self.program = program
+        self.fleet_bundles = fleet_bundles
+        self.pub_key = pub_key
+        self.key_file = key_file
+        self.flags = flags
+        self.program_command = program_command
+        self.logger = logger
+        self.identity_agent = identity_agent
+        self.concurrency = concurrency
+        self.cache_priv_key = cache_priv_key
+        self.instance_cache_ttl = instance_cache_ttl
+        self.hedge_percentile = hedge_percentile
+        self.regions = regions
+        self.control_persist = control_persist
+        self.race_port = race_port
+        self.output = output if output is not None else PrefixedOutput()
+        # Shared by all hosts, so each profile and region gets one session and one client per service fleet-wide
+        self.client_cache = ClientCache(self._get_session)
+        # Set when reading the targets stopped at an invalid one, or a selector failed or matched nothing
+        self.invalid_target = False
+
+    def run(self):
+        """
+        Runs the command on every target and waits for all of them to finish
+
+        :return: 0 if the command succeeded on every target, otherwise the highest exit status
+        :rtype: int
+        """
+        # asyncio is only needed in fleet mode
+        from ec2instanceconnectcli.async_engine import AsyncEngine
+
+        engine = AsyncEngine(self.logger, self.output, self.concurrency)
+        returncodes = engine.run(self._hosts())
+
+        failed = len([returncode for returncode in returncodes if returncode != 0])
+        if failed:
+            self.logger.error('{0} of {1} hosts failed'.format(failed, len(returncodes)))
+        returncode = max(returncodes) if returncodes else 0
+        if self.invalid_target:
+            returncode = max(returncode, 1)
+        return returncode
+
+    def _hosts(self):
+        """
+        Lazily creates the pipeline of each target, expanding selectors into the instances they match.
+        An instance matched by several targets is only run on once, as long as it is matched again within the next
+        DEDUPE_WINDOW instances.  An invalid target, which streamed targets are
+        only found to be once they are read, stops the fleet from starting further hosts.  A selector that fails or
+        matches nothing is skipped, and fails the fleet once the other targets are done.
+
+        :return: Generator of (label, EC2InstanceConnectCLI) pairs
+        """
+        seen = collections.OrderedDict()
+        targets = iter(self.fleet_bundles)
+        while True:
+            try:
+                target_bundles = next(targets)
+            except StopIteration:
+                return
+            except AssertionError as e:
+                self.logger.error(str(e))
+                self.invalid_target = True
+                return
+            if 'filters' in target_bundles[0]:
+                expanded = self._select(target_bundles[0])
+            else:
+                expanded = [target_bundles]
+            for instance_bundles in expanded:
+                instance_id = instance_bundles[0].instance_id
+                if instance_id:
+                    if instance_id in seen:
+                        continue
+                    seen[instance_id] = None
+                    if len(seen) > DEDUPE_WINDOW:
+                        seen.popitem(last=False)
+                yield self._host(instance_bundles)
+
+    def _select(self, selector_bundle):
+        """
+        Streams the running instances matching a selector
+
+        :param selector_bundle: Selector's bundle as returned by input_parser.parse_fleet_args
+        :type selector_bundle: ec2instanceconnectcli.instance_bundle.InstanceBundle
+        :return: Generator of the instance bundles of each matching instance. Their target and zone are those
+            DescribeInstances returned, so the pipeline does not look them up again.
+        """
+        matched = 0
+        try:
+            session = self.client_cache.get_session(profile_name=selector_bundle.profile,
+                                                    region=selector_bundle.region)
+            for instance_id, instance_info in ec2_util.iter_instances(session, selector_bundle.filters,
+                                                                      client_cache=self.client_cache,
+                                                                      hedge_percentile=self.hedge_percentile):
+                matched += 1
+                yield [InstanceBundle(profile=selector_bundle.profile, region=selector_bundle.region,
+                                      instance_id=instance_id, username=selector_bundle.username,
+                                      zone=instance_info.availability_zone,
+                                      target=instance_info.public_ip or instance_info.private_ip or
+                                      instance_info.public_dns_name or instance_info.private_dns_name)]
+        except Exception as e:
+            # Instances already matched keep running; the rest of this selector is lost
+            self.logger.error('Failed to select {0}: {1}'.format(selector_bundle.selector, e))
+            self.invalid_target = True
+            return
+        if not matched:
+            self.logger.error('No running instances match {0}'.format(selector_bundle.selector))
+            self.invalid_target = True
+
+    def _host(self, instance_bundles):
+        """
+        :return: Label and pipeline of a target
+        :rtype: tuple
+        """
+        cli_command = EC2InstanceConnectCommand(self.program, instance_bundles, self.key_file, self.flags,
+                                                self.program_command, self.logger, identity_agent=self.identity_agent,
+                                                control_persist=self.control_persist)
+        cli = EC2InstanceConnectCLI(instance_bundles, self.pub_key, cli_command, self.logger,
+                                    cache_priv_key=self.cache_priv_key, client_cache=self.client_cache,
+                                    instance_cache_ttl=self.instance_cache_ttl,
+                                    hedge_percentile=self.hedge_percentile, regions=self.regions,
+                                    race_port=self.race_port)
+        return get_label(instance_bundles), cli
+
+    def _get_session(self, profile_name=None, region=None):
+        session = EC2InstanceConnectCLI._get_botocore_session(profile_name=profile_name, region=region)
+        if self.logger.getEffectiveLevel() == logging.DEBUG:
+            session.set_debug_logger()
+        return session
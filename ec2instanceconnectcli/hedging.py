@@ -0,0 +1,202 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Hedged API calls, to cut the latency tail of DescribeInstances and SendSSHPublicKey.
+
+If a call has not returned after the given percentile of its past latencies, an identical second call is sent and
+whichever succeeds first wins.  Latencies are kept per API and region in the local cache, so the delay is tuned
+across runs.  They are recorded in memory and written back when the process exits, or every SAVE_EVERY calls in
+long-running processes, so a fleet does not rewrite the file for each host.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from ec2instanceconnectcli import local_cache, rate_limiter
+
+HEDGE_PERCENTILE_ENV = 'MSSH_HEDGE_PERCENTILE'
+CACHE_DIR = 'latency'
+MAX_SAMPLES = 100
+# Until this many latencies are known, hedge after DEFAULT_DELAY_SECONDS
+MIN_SAMPLES = 10
+DEFAULT_DELAY_SECONDS = 1.0
+MIN_DELAY_SECONDS = 0.02
+# Latencies recorded since the last save after which they are saved without waiting for the process to exit
+SAVE_EVERY = 50
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+class LatencyStats(object):
+    """
+    Recent latencies of one API in one region, persisted in the local cache
+    """
+
+    def __init__(self, path):
+        """
+        :param path: File the latencies are loaded from and saved to
+        :type path: basestring
+        """
+        self.path = path
+        self.samples = []
+        # Latencies recorded since the last save
+        self.unsaved = 0
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r') as f:
+                self.samples = [float(sample) for sample in json.load(f)][-MAX_SAMPLES:]
+        except (IOError, OSError, ValueError, TypeError):
+            pass
+
+    def record(self, latency):
+        """
+        :return: Whether SAVE_EVERY latencies have been recorded since the last save
+        :rtype: bool
+        """
+        with self.lock:
+            self.samples.append(latency)
+            del self.samples[:-MAX_SAMPLES]
+            self.unsaved += 1
+            return self.unsaved >= SAVE_EVERY
+
+    def percentile(self, percentile):
+        """
+        :param percentile: Percentile between 0 and 100
+        :type percentile: float
+        :return: The nearest-rank percentile of the recorded latencies, or None if there are too few of them
+        :rtype: float
+        """
+        with self.lock:
+            if len(self.samples) < MIN_SAMPLES:
+                return None
+            samples = sorted(self.samples)
+        rank = max(1, int(round(percentile / 100.0 * len(samples))))
+        return samples[min(rank, len(samples)) - 1]
+
+    def hedge_delay(self, percentile):
+        """
+        :return: Seconds to wait for a call before sending a second one
+        :rtype: float
+        """
+        delay = self.percentile(percentile)
+        if delay is None:
+            return DEFAULT_DELAY_SECONDS
+        return max(MIN_DELAY_SECONDS, delay)
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.samples).encode('utf-8')
+            self.unsaved = 0
+        local_cache.write_private_file(self.path, data)
+
+
+def _save(stats):
+    try:
+        stats.save()
+    except Exception as e:
+        logging.getLogger('EC2InstanceConnect').debug('Failed to save latency statistics: {0}'.format(str(e)))
+
+
+def save_all():
+    """
+    Saves the latencies recorded since they were last saved.  Registered to run at exit once any are loaded.
+    """
+    with _stats_lock:
+        all_stats = list(_stats.values())
+    for stats in all_stats:
+        if stats.unsaved:
+            _save(stats)
+
+
+def get_stats(operation_name, region):
+    """
+    Returns the latency statistics of the given API in the given region, loading them on first use
+
+    :rtype: LatencyStats
+    """
+    key = (operation_name, region)
+    with _stats_lock:
+        stats = _stats.get(key)
+        if stats is None:
+            name = '{0}-{1}.json'.format(operation_name, region or 'default')
+            stats = LatencyStats(os.path.join(local_cache.get_cache_dir(CACHE_DIR), name))
+            if not _stats:
+                atexit.register(save_all)
+            _stats[key] = stats
+        return stats
+
+
+def call(client, operation_name, percentile=None, **params):
+    """
+    Calls a client API through rate_limiter.call_with_retry, hedged if a percentile is given
+
+    :param client: Botocore client
+    :type client: botocore.client.BaseClient
+    :param operation_name: Client method to call, e.g. 'send_ssh_public_key'
+    :type operation_name: basestring
+    :param percentile: Percentile of past latencies after which to send a second call. None or 0 disables hedging.
+    :type percentile: float
+    :param params: API request parameters
+    :return: The response of the first call to succeed
+    :rtype: dict
+    """
+    if not percentile:
+        return rate_limiter.call_with_retry(client, operation_name, **params)
+
+    logger = logging.getLogger('EC2InstanceConnect')
+    stats = get_stats(operation_name, client.meta.region_name)
+    results = queue.Queue()
+
+    def attempt():
+        start = time.monotonic()
+        try:
+            response = rate_limiter.call_with_retry(client, operation_name, **params)
+        except Exception as e:
+            results.put((False, e))
+            return
+        if stats.record(time.monotonic() - start):
+            _save(stats)
+        results.put((True, response))
+
+    def start_attempt():
+        thread = threading.Thread(target=attempt, name='hedge-{0}'.format(operation_name))
+        # A losing call must not keep the CLI from exiting
+        thread.daemon = True
+        thread.start()
+
+    delay = stats.hedge_delay(percentile)
+    start_attempt()
+    attempts = 1
+    try:
+        succeeded, result = results.get(timeout=delay)
+    except queue.Empty:
+        logger.debug('{0} took longer than {1:.3f}s, sending a hedged request'.format(operation_name, delay))
+        start_attempt()
+        attempts = 2
+        succeeded, result = results.get()
+    if not succeeded and attempts == 2:
+        # The other call may still succeed
+        other_succeeded, other_result = results.get()
+        if other_succeeded:
+            succeeded, result = other_succeeded, other_result
+
+    if not succeeded:
+        raise result
+    return result
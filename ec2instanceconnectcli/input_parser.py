@@ -13,11 +13,22 @@
 
 import re
 import socket
+import sys
+
+from ec2instanceconnectcli.instance_bundle import InstanceBundle
 
 INSTANCE_ID_RE = re.compile("i-[a-f0-9]+")
 UNIX_USER_RE = re.compile("[a-z_][a-z0-9_-]*[$]?")  # Taken from useradd manpage
 REGION_RE = re.compile("([a-z]+-)+[0-9]+")
 ZONE_RE = re.compile("([a-z]+-)+[0-9]+[a-z]")
+FILTER_NAME_RE = re.compile("[A-Za-z0-9.:-]+$")
+HOSTNAME_LABEL_RE = re.compile(r"(?!-)[a-z0-9-]{1,63}(?<!-)$", re.IGNORECASE)
+NUMERIC_RE = re.compile(r"[0-9]+$")
+# Fleet targets selecting instances by tag or by any DescribeInstances filter
+TAG_SELECTOR = 'tag:'
+FILTER_SELECTOR = 'filter:'
+# Joins the conditions of a selector, all of which must match
+SELECTOR_SEPARATOR = '+'
 
 def parseargs(args, mode='ssh'):
     """
@@ -43,7 +54,8 @@ def parseargs(args, mode='ssh'):
     :type args: tuple
     :param mode: The protocol we will be using (ssh, sftp, potentially others in-future)
     :type mode: basestring
-    :return: Args split into three pieces: EC2 instance information, command flags, and and the actual command to run
+    :return: Args split into three pieces: EC2 instance information, command flags, and and the actual command to run.
+        Flags and command are lists of arguments, passed on to the program as-is.
     :rtype: tuple
     """
 
@@ -56,16 +68,16 @@ def parseargs(args, mode='ssh'):
     """
     Our flags.  As these are via argparse they're free.
     Instance details are a bit weird.  Since the instance ID can either be the actual "host" or a flag we have to group it.
-    We do this with an "instance bundle" dict.
+    We do this with an "instance bundle", see InstanceBundle.
     Note we don't load the actual instance DNS/IP/ID here - that comes later.
     """
     instance_bundles = [
-        {
-            'profile': args[0].profile,
-            'instance_id': args[0].instance_id,
-            'region': args[0].region,
-            'zone': args[0].zone
-        }
+        InstanceBundle(
+            profile=args[0].profile,
+            instance_id=args[0].instance_id,
+            region=args[0].region,
+            zone=args[0].zone
+        )
     ]
     # We do this as an array to support future commands that may need multiple instances (eg, scp)
 
@@ -80,8 +92,157 @@ def parseargs(args, mode='ssh'):
 
     return instance_bundles, flags, command
 
-def _validate_custom_flags(flags):
-    if len(flags) < 1:
+def parse_fleet_args(args, mode='ssh'):
+    """
+    Parses the input arguments for fleet mode, where the target is a comma-separated list of targets that the same
+    command runs on.  Each target is parsed and validated exactly as parseargs would parse it on its own, except for
+    selectors such as tag:Role=web, which stand for every running instance that matches; see _parse_selector.
+
+    :param args: A tuple of known arguments and list of string with unknown arguments
+    :type args: tuple
+    :param mode: The protocol we will be using
+    :type mode: basestring
+    :return: A list with the instance bundles of each target, the command flags, and the command to run.
+        A selector's bundle has no instance_id and carries the DescribeInstances filters it stands for instead.
+    :rtype: tuple
+    """
+    if len(args) < 2:
+        raise AssertionError('Missing target')
+    if args[0].instance_id:
+        raise AssertionError('-t cannot be used with multiple targets')
+
+    custom_flags = args[1]
+    _validate_custom_flags(custom_flags)
+    flags, command, instance_bundles = _parse_command_flags(custom_flags, [InstanceBundle()],
+                                                            is_ssh=(mode=='ssh'))
+
+    targets = [target.strip() for target in instance_bundles[0]['target'].split(',') if target.strip()]
+    if not targets:
+        raise AssertionError('Missing target')
+
+    fleet_bundles = [_parse_fleet_target(target, args[0], flags, command, mode) for target in targets]
+    return fleet_bundles, flags, command
+
+def parse_targets_file(args, mode='ssh'):
+    """
+    Parses the input arguments for fleet mode with the targets read from args[0].targets_file, one per line, or from
+    stdin if it is '-'.  Blank lines and lines starting with # are skipped.  The remaining arguments are the command
+    flags followed by the command.
+
+    The file is opened here, but its lines are only read and parsed as the returned generator is consumed, so any
+    number of targets can be processed without holding them all in memory.  The generator raises AssertionError
+    with the file name and line number at the first invalid target.
+
+    :param args: A tuple of known arguments and list of string with unknown arguments
+    :type args: tuple
+    :param mode: The protocol we will be using
+    :type mode: basestring
+    :return: A generator over the instance bundles of each target, as parse_fleet_args returns them in a list, the
+        command flags, and the command to run
+    :rtype: tuple
+    """
+    if args[0].instance_id:
+        raise AssertionError('-t cannot be used with multiple targets')
+
+    raw_command = args[1] if len(args) > 1 else []
+    _validate_custom_flags(raw_command, allow_empty=True)
+    flags, command = _split_command_flags(raw_command)
+
+    path = args[0].targets_file
+    if path == '-':
+        name, targets_file = '<stdin>', sys.stdin
+    else:
+        try:
+            name, targets_file = path, open(path, 'r')
+        except (IOError, OSError) as e:
+            raise AssertionError('Cannot read targets from {0}: {1}'.format(path, e.strerror))
+    return _iter_targets_file(targets_file, name, args[0], flags, command, mode), flags, command
+
+def _iter_targets_file(targets_file, name, known_args, flags, command, mode):
+    with targets_file:
+        for line_number, line in enumerate(targets_file, 1):
+            target = line.strip()
+            if not target or target.startswith('#'):
+                continue
+            try:
+                yield _parse_fleet_target(target, known_args, flags, command, mode)
+            except AssertionError as e:
+                raise AssertionError('{0}:{1}: {2}'.format(name, line_number, str(e)))
+
+def _parse_fleet_target(target, known_args, flags, command, mode):
+    """
+    Parses and validates one fleet target as parseargs would parse it on its own, or as a selector
+
+    :return: The target's instance bundles
+    :rtype: list
+    """
+    selector_bundle = _parse_selector(target, known_args)
+    if selector_bundle is not None:
+        return [selector_bundle]
+    target_bundles, _, _ = parseargs((known_args, flags + [target] + command), mode)
+    return target_bundles
+
+def _split_command_flags(raw_command):
+    """
+    Splits arguments without a target into the leading command flags, each followed by its value as in
+    _parse_command_flags, and the command
+
+    :return: Tuple of flags and command
+    :rtype: tuple
+    """
+    index = 0
+    is_flagged = False
+    while index < len(raw_command) and (raw_command[index].startswith('-') or is_flagged):
+        is_flagged = raw_command[index].startswith('-')
+        index += 1
+    return raw_command[:index], raw_command[index:]
+
+def _parse_selector(target, known_args):
+    """
+    Parses a fleet target of the form [user@]condition[+condition...], where each condition is tag:Key=Value or
+    filter:Name=Value and all of them must match.  Values may use the * and ? wildcards of EC2 filters.
+
+    :param target: Fleet target
+    :type target: basestring
+    :param known_args: Parsed EC2 Instance Connect flags
+    :type known_args: argparse.Namespace
+    :return: The selector's instance bundle with its 'filters', or None if the target is not a selector
+    :rtype: dict
+    """
+    username, selector = 'ec2-user', target
+    if not target.startswith((TAG_SELECTOR, FILTER_SELECTOR)):
+        # Tag values may contain an @ too, so only the first one can end the user name
+        username, _, selector = target.partition('@')
+        if not selector.startswith((TAG_SELECTOR, FILTER_SELECTOR)):
+            return None
+    if not _is_valid_username(username):
+        raise AssertionError('{0} is not a valid UNIX username'.format(username))
+
+    filters = []
+    for condition in selector.split(SELECTOR_SEPARATOR):
+        name, _, value = condition.partition('=')
+        if name.startswith(TAG_SELECTOR) and len(name) > len(TAG_SELECTOR):
+            filter_name = name
+        elif name.startswith(FILTER_SELECTOR) and FILTER_NAME_RE.match(name[len(FILTER_SELECTOR):]):
+            filter_name = name[len(FILTER_SELECTOR):]
+        else:
+            raise AssertionError('{0} is not a valid tag: or filter: condition'.format(condition))
+        if not value:
+            raise AssertionError('Missing value in {0}'.format(condition))
+        filters.append({'Name': filter_name, 'Values': [value]})
+
+    if known_args.region and REGION_RE.match(known_args.region) is None:
+        raise AssertionError('{0} is not a valid region'.format(known_args.region))
+    if known_args.zone:
+        if ZONE_RE.match(known_args.zone) is None:
+            raise AssertionError('{0} is not a valid zone'.format(known_args.zone))
+        filters.append({'Name': 'availability-zone', 'Values': [known_args.zone]})
+
+    return InstanceBundle(profile=known_args.profile, region=known_args.region, zone=None, instance_id='',
+                          target=None, username=username, selector=selector, filters=filters)
+
+def _validate_custom_flags(flags, allow_empty=False):
+    if len(flags) < 1 and not allow_empty:
         raise AssertionError('Missing target')
     for flag in flags:
         flag = flag.strip()
@@ -110,14 +271,14 @@ def _parse_command_flags(raw_command, instance_bundles, is_ssh=False):
 
     :param raw_command: The raw command string, ie, anything not recognized by argparse
     :type raw_command: basestring
-    :param instance_bundles: dicts containing information about desired EC2 instances
+    :param instance_bundles: InstanceBundles containing information about desired EC2 instances
     :type instance_bundles: list
     :param is_ssh: Specifies if we are running an ssh command.  There is an extra flag we consider if so.
     :type is_ssh: bool
-    :return: tuple of flags and final comamnd or file list
+    :return: tuple of flags and final comamnd or file list, each a list of arguments
     :rtype: tuple
     """
-    flags = ''
+    flags = []
     is_user = False
     is_flagged = False
     command_index = 0
@@ -133,7 +294,7 @@ def _parse_command_flags(raw_command, instance_bundles, is_ssh=False):
         used += 1
 
         # This is either a flag or a flag value
-        flags = '{0} {1}'.format(flags, raw_command[command_index])
+        flags.append(raw_command[command_index])
 
         if raw_command[command_index][0] == '-':
             # Flag
@@ -152,8 +313,6 @@ def _parse_command_flags(raw_command, instance_bundles, is_ssh=False):
 
         command_index += 1
 
-    flags = flags.strip()
-
     """
     Target host and command or file list
     """
@@ -168,7 +327,7 @@ def _parse_command_flags(raw_command, instance_bundles, is_ssh=False):
 
     # Command/file list
     command_end = len(raw_command)
-    command = ' '.join(raw_command[command_index:command_end])
+    command = raw_command[command_index:command_end]
 
     return flags, command, instance_bundles
 
@@ -294,8 +453,7 @@ def _is_valid_target(hostname):
     labels = hostname.split(".")
 
     # the TLD must be not all-numeric
-    if re.match(r"[0-9]+$", labels[-1]):
+    if NUMERIC_RE.match(labels[-1]):
         return False
 
-    allowed = re.compile(r"(?!-)[a-z0-9-]{1,63}(?<!-)$", re.IGNORECASE)
-    return all(allowed.match(label) for label in labels)
+    return all(HOSTNAME_LABEL_RE.match(label) for label in labels)
@@ -0,0 +1,114 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import sys
+
+# Everything the parser, the CLI and the command builder record about a target
+FIELDS = ('profile', 'instance_id', 'region', 'zone', 'target', 'username', 'file', 'host_info', 'session',
+          'selector', 'filters')
+# Fields whose values repeat across the targets of a fleet, so all bundles can share one copy
+INTERNED_FIELDS = frozenset(('profile', 'region', 'zone', 'username'))
+_FIELD_SET = frozenset(FIELDS)
+
+
+class InstanceBundle(object):
+    """
+    Information on one target instance, as built up by input_parser, EC2InstanceConnectCLI and
+    EC2InstanceConnectCommand.
+
+    Bundles used to be dicts, and an InstanceBundle still behaves like one for compatibility: fields are read and
+    written by key, support get, in, keys, items, dict() and del, and a bundle equals a dict with the same items.  A
+    field is present once it is set to something other than None.  Keeping the fields in slots instead of a dict, with
+    interned profile, region, zone and user names, makes a bundle a fraction of the size, which adds up over the
+    targets of a large fleet.
+
+    Reading a field by key goes through __getitem__, which is slower than the dict lookup it replaced, so the CLI
+    reads fields as attributes, e.g. bundle.instance_id.  Fields are still written by key, so that shared names are
+    interned.
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, **fields):
+        """
+        :param fields: Initial fields, any of FIELDS
+        """
+        for key in FIELDS:
+            object.__setattr__(self, key, None)
+        for key, value in fields.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        if key in INTERNED_FIELDS and type(value) is str:
+            value = sys.intern(value)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        setattr(self, key, None)
+
+    def __contains__(self, key):
+        return key in _FIELD_SET and getattr(self, key) is not None
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, key, default=None):
+        value = getattr(self, key) if key in _FIELD_SET else None
+        return default if value is None else value
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        if key in self:
+            del self[key]
+        return value
+
+    def keys(self):
+        return [key for key in FIELDS if getattr(self, key) is not None]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def values(self):
+        return [getattr(self, key) for key in self.keys()]
+
+    def copy(self):
+        return InstanceBundle(**dict(self.items()))
+
+    def __eq__(self, other):
+        if isinstance(other, InstanceBundle):
+            return self.items() == other.items()
+        if isinstance(other, dict):
+            return dict(self.items()) == {key: value for key, value in other.items() if value is not None}
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    # Mutable, like the dicts it replaces
+    __hash__ = None
+
+    def __repr__(self):
+        return 'InstanceBundle({0})'.format(', '.join('{0}={1!r}'.format(key, value) for key, value in self.items()))
@@ -0,0 +1,181 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Persistent cache of instance information returned by ec2_util, so repeat connections can skip DescribeInstances.
+
+Entries are namespaced by profile and region: each namespace is a compact JSON index of instance ID to the
+fields of the instance info and the time they were looked up.  New entries are buffered in memory and written with
+one update per namespace when the process exits, or once FLUSH_EVERY are pending, so a fleet rewrites each index
+once rather than once per host.
+"""
+
+from argparse import Namespace
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from ec2instanceconnectcli import local_cache
+
+INSTANCE_CACHE_TTL_ENV = 'MSSH_INSTANCE_CACHE_TTL'
+CACHE_DIR = 'instances'
+LOCK_FILE = '.lock'
+CACHED_AT = 'cached_at'
+# Pending entries after which they are written without waiting for the process to exit
+FLUSH_EVERY = 1000
+
+# Entries put since the last flush: (profile, region) to the TTL of the latest put and a dict of InstanceID to entry
+_pending = {}
+_pending_lock = threading.Lock()
+_flush_registered = []
+
+
+def _index_path(profile, region):
+    namespace = '|'.join([profile or '', region or ''])
+    return os.path.join(local_cache.get_cache_dir(CACHE_DIR),
+                        hashlib.sha256(namespace.encode('utf-8')).hexdigest() + '.json')
+
+
+def _read_index(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _update_index(profile, region, update):
+    """
+    Applies update(index) to the namespace's index under the cache lock and writes it back atomically
+    """
+    path = _index_path(profile, region)
+    with local_cache.file_lock(os.path.join(os.path.dirname(path), LOCK_FILE)):
+        index = _read_index(path)
+        update(index)
+        local_cache.write_private_file(path, json.dumps(index, separators=(',', ':')).encode('utf-8'))
+
+
+def get(profile, region, instance_ids, ttl):
+    """
+    Looks up cached instance information.
+
+    :param profile: AWS profile the instances were looked up with
+    :type profile: basestring
+    :param region: AWS region the instances were looked up in
+    :type region: basestring
+    :param instance_ids: InstanceIDs to look up
+    :type instance_ids: list
+    :param ttl: Maximum age of an entry in seconds
+    :type ttl: int
+    :return: Dict of InstanceID to Namespace, as returned by ec2_util.get_instances_data, for the cached instances
+    :rtype: dict
+    """
+    index = _read_index(_index_path(profile, region))
+    with _pending_lock:
+        if (profile, region) in _pending:
+            index.update(_pending[(profile, region)][1])
+    now = time.time()
+    instance_infos = {}
+    for instance_id in instance_ids:
+        entry = index.get(instance_id)
+        if entry is not None and 0 <= now - entry.get(CACHED_AT, 0) < ttl:
+            fields = dict(entry)
+            del fields[CACHED_AT]
+            instance_infos[instance_id] = Namespace(**fields)
+    return instance_infos
+
+
+def _drop_expired(entries, now, ttl):
+    for instance_id in [instance_id for instance_id, entry in entries.items()
+                        if now - entry.get(CACHED_AT, 0) >= ttl]:
+        del entries[instance_id]
+
+
+def put(profile, region, instance_infos, ttl):
+    """
+    Caches instance information, dropping entries older than the TTL on the way.  The entries are visible to get at
+    once, and written to the index by flush.
+
+    :param profile: AWS profile the instances were looked up with
+    :type profile: basestring
+    :param region: AWS region the instances were looked up in
+    :type region: basestring
+    :param instance_infos: Dict of InstanceID to Namespace, as returned by ec2_util.get_instances_data
+    :type instance_infos: dict
+    :param ttl: Maximum age of an entry in seconds
+    :type ttl: int
+    """
+    now = time.time()
+    with _pending_lock:
+        if not _flush_registered:
+            atexit.register(_flush_at_exit)
+            _flush_registered.append(True)
+        entries = _pending[(profile, region)][1] if (profile, region) in _pending else {}
+        _drop_expired(entries, now, ttl)
+        for instance_id, instance_info in instance_infos.items():
+            entry = dict(vars(instance_info))
+            entry[CACHED_AT] = now
+            entries[instance_id] = entry
+        _pending[(profile, region)] = (ttl, entries)
+        due = sum(len(pending_entries) for _, pending_entries in _pending.values()) >= FLUSH_EVERY
+    if due:
+        flush()
+
+
+def flush():
+    """
+    Writes the entries put since the last flush, with one index update per namespace
+    """
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+    for (profile, region), (ttl, entries) in pending.items():
+        def update(index, ttl=ttl, entries=entries):
+            _drop_expired(index, time.time(), ttl)
+            index.update(entries)
+
+        _update_index(profile, region, update)
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception as e:
+        logging.getLogger('EC2InstanceConnect').debug('Failed to update the instance cache: {0}'.format(str(e)))
+
+
+def invalidate(profile, region, instance_ids):
+    """
+    Removes instances from the cache, e.g. after their cached information turned out to be stale.
+
+    :param profile: AWS profile the instances were looked up with
+    :type profile: basestring
+    :param region: AWS region the instances were looked up in
+    :type region: basestring
+    :param instance_ids: InstanceIDs to remove
+    :type instance_ids: list
+    """
+    with _pending_lock:
+        if (profile, region) in _pending:
+            for instance_id in instance_ids:
+                _pending[(profile, region)][1].pop(instance_id, None)
+
+    def update(index):
+        for instance_id in instance_ids:
+            index.pop(instance_id, None)
+
+    _update_index(profile, region, update)
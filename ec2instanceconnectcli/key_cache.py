@@ -0,0 +1,118 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Cross-process cache of recently pushed keys.
+
+A key pushed with SendSSHPublicKey stays usable on the instance for 60 seconds.  Each entry records the key pair and
+push time for one (instance_id, os_user, profile, region), so a later invocation inside that window can reuse the key
+and skip both key generation and the push.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from ec2instanceconnectcli import local_cache
+
+REUSE_KEY_ENV = 'MSSH_REUSE_KEY'
+CACHE_DIR = 'pushed'
+# EC2 Instance Connect keeps a pushed key for 60 seconds; leave room for the ssh handshake
+KEY_VALIDITY_SECONDS = 60
+SAFE_MARGIN_SECONDS = 15
+MAX_AGE_SECONDS = KEY_VALIDITY_SECONDS - SAFE_MARGIN_SECONDS
+
+
+def _entry_path(instance_id, os_user, profile, region):
+    cache_key = '|'.join([instance_id, os_user, profile or '', region or ''])
+    return os.path.join(local_cache.get_cache_dir(CACHE_DIR), hashlib.sha256(cache_key.encode('utf-8')).hexdigest())
+
+
+def _read_entry(path, max_age):
+    """
+    :return: The entry dict if it exists and is younger than max_age, otherwise None
+    :rtype: dict
+    """
+    try:
+        with open(path, 'r') as f:
+            entry = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if not 0 <= time.time() - entry.get('pushed_at', 0) < max_age:
+        return None
+    return entry
+
+
+def _remove_expired(max_age=KEY_VALIDITY_SECONDS):
+    """
+    Deletes entries whose key has expired on the instance, so private keys don't linger on disk.
+    """
+    cache_dir = local_cache.get_cache_dir(CACHE_DIR)
+    now = time.time()
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            if now - os.stat(path).st_mtime >= max_age:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def lookup(instance_id, os_user, profile, region, max_age=MAX_AGE_SECONDS):
+    """
+    Finds a key pushed to the given instance and user recently enough to be reused.
+
+    :param instance_id: Instance ID of the EC2 instance
+    :type instance_id: basestring
+    :param os_user: EC2 user the key was published to
+    :type os_user: basestring
+    :param profile: AWS profile used for the push
+    :type profile: basestring
+    :param region: AWS region used for the push
+    :type region: basestring
+    :param max_age: Maximum age of the push in seconds. Default: 45
+    :type max_age: int
+    :return: Tuple of OpenSSH public key and PEM private key, or None
+    :rtype: tuple
+    """
+    entry = _read_entry(_entry_path(instance_id, os_user, profile, region), max_age)
+    if entry is None:
+        return None
+    return entry['pub_key'], entry['priv_key']
+
+
+def is_pushed(instance_id, os_user, profile, region, pub_key, max_age=MAX_AGE_SECONDS):
+    """
+    :return: Whether the given public key was pushed to the instance and user recently enough to skip pushing it again
+    :rtype: bool
+    """
+    entry = _read_entry(_entry_path(instance_id, os_user, profile, region), max_age)
+    return entry is not None and entry['pub_key'] == pub_key
+
+
+def store(instance_id, os_user, profile, region, pub_key, priv_key, pushed_at):
+    """
+    Records a successful push.
+
+    :param pub_key: OpenSSH public key that was pushed
+    :type pub_key: basestring
+    :param priv_key: Matching PEM private key
+    :type priv_key: basestring
+    :param pushed_at: time.time() taken before the push was sent
+    :type pushed_at: float
+    """
+    _remove_expired()
+    entry = {'pushed_at': pushed_at, 'pub_key': pub_key, 'priv_key': priv_key}
+    local_cache.write_private_file(_entry_path(instance_id, os_user, profile, region),
+                                   json.dumps(entry).encode('utf-8'))
@@ -0,0 +1,204 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+On-disk pool of pre-generated, never-used ephemeral key pairs.
+
+Each pool entry is a pair of files in a private per-key-type directory: <token>.pub holds the OpenSSH public key and
+<token>.key the private key.  The .key file is written last, so its presence marks a complete entry.
+An entry is claimed by atomically renaming its .key file, so no two processes can ever receive the same key,
+and both files are deleted as soon as the key has been read.
+"""
+
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+from ec2instanceconnectcli import key_utils, local_cache
+
+KEY_POOL_ENV = 'MSSH_KEY_POOL'
+POOL_DIR = 'keys'
+KEY_SUFFIX = '.key'
+PUB_SUFFIX = '.pub'
+CLAIMED_MARKER = '.claimed.'
+LOCK_FILE = '.lock'
+REFILL_LOCK_FILE = '.refill.lock'
+# Claimed or partially written files older than this were left behind by a killed process
+STALE_SECONDS = 60
+
+
+def is_supported():
+    """
+    The pool relies on cross-process file locking, which is not available on every platform.
+
+    :return: Whether the key pool can be used
+    :rtype: bool
+    """
+    return local_cache.locking_supported()
+
+
+def get_pool_dir(key_type):
+    """
+    :param key_type: Key type the pool holds
+    :type key_type: basestring
+    :return: Private pool directory for the given key type
+    :rtype: basestring
+    """
+    return local_cache.get_cache_dir(POOL_DIR, key_type)
+
+
+def _list_entries(pool_dir):
+    return [name[:-len(KEY_SUFFIX)] for name in os.listdir(pool_dir) if name.endswith(KEY_SUFFIX)]
+
+
+def size(key_type):
+    """
+    :param key_type: Key type the pool holds
+    :type key_type: basestring
+    :return: Number of unclaimed key pairs in the pool
+    :rtype: int
+    """
+    return len(_list_entries(get_pool_dir(key_type)))
+
+
+def take(key_type):
+    """
+    Claims a key pair from the pool and removes it from disk.
+
+    :param key_type: Key type to take
+    :type key_type: basestring
+    :return: Tuple of OpenSSH public key and PEM private key, or None if the pool is empty
+    :rtype: tuple
+    """
+    pool_dir = get_pool_dir(key_type)
+    with local_cache.file_lock(os.path.join(pool_dir, LOCK_FILE)):
+        for token in _list_entries(pool_dir):
+            key_path = os.path.join(pool_dir, token + KEY_SUFFIX)
+            claimed_path = '{0}{1}{2}'.format(os.path.join(pool_dir, token), CLAIMED_MARKER, os.getpid())
+            try:
+                os.rename(key_path, claimed_path)
+            except OSError:
+                # Claimed by a process that doesn't honour the lock
+                continue
+            break
+        else:
+            return None
+
+    pub_path = os.path.join(pool_dir, token + PUB_SUFFIX)
+    try:
+        with open(claimed_path, 'r') as f:
+            priv_key = f.read()
+        with open(pub_path, 'r') as f:
+            pub_key = f.read()
+    finally:
+        for path in (claimed_path, pub_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return pub_key, priv_key
+
+
+def add(key_type):
+    """
+    Generates a new key pair and adds it to the pool.
+
+    :param key_type: Key type to generate
+    :type key_type: basestring
+    """
+    pool_dir = get_pool_dir(key_type)
+    key = key_utils.generate_key_by_type(key_type)
+    token = uuid.uuid4().hex
+    local_cache.write_private_file(os.path.join(pool_dir, token + PUB_SUFFIX),
+                                   key_utils.serialize_key(key, encoding='OpenSSH'))
+    local_cache.write_private_file(os.path.join(pool_dir, token + KEY_SUFFIX),
+                                   key_utils.serialize_key(key, return_private=True))
+
+
+def _remove_stale_files(pool_dir):
+    """
+    Removes claimed keys, temporary files and orphaned public keys left behind by killed processes.
+    """
+    now = time.time()
+    entries = set(_list_entries(pool_dir))
+    for name in os.listdir(pool_dir):
+        path = os.path.join(pool_dir, name)
+        if name.startswith('.') or name.endswith(KEY_SUFFIX):
+            continue
+        if name.endswith(PUB_SUFFIX) and name[:-len(PUB_SUFFIX)] in entries:
+            continue
+        try:
+            if now - os.stat(path).st_mtime > STALE_SECONDS:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def refill(key_type, watermark):
+    """
+    Tops the pool up to the watermark.  Only one refill per key type runs at a time; if another process is already
+    refilling this returns immediately.
+
+    :param key_type: Key type to generate
+    :type key_type: basestring
+    :param watermark: Number of key pairs to keep in the pool
+    :type watermark: int
+    :return: Number of key pairs generated
+    :rtype: int
+    """
+    pool_dir = get_pool_dir(key_type)
+    generated = 0
+    with local_cache.file_lock(os.path.join(pool_dir, REFILL_LOCK_FILE), blocking=False) as acquired:
+        if not acquired:
+            return generated
+        _remove_stale_files(pool_dir)
+        while len(_list_entries(pool_dir)) < watermark:
+            add(key_type)
+            generated += 1
+    return generated
+
+
+def spawn_refill(key_type, watermark):
+    """
+    Refills the pool in a detached background process if it is below the watermark, so that key generation stays
+    off the critical path of the current invocation.
+
+    :param key_type: Key type to generate
+    :type key_type: basestring
+    :param watermark: Number of key pairs to keep in the pool
+    :type watermark: int
+    :return: Whether a refill process was started
+    :rtype: bool
+    """
+    if size(key_type) >= watermark:
+        return False
+    subprocess.Popen([sys.executable, '-m', 'ec2instanceconnectcli.key_pool', key_type, str(watermark)],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     close_fds=True, start_new_session=True)
+    return True
+
+
+def main():
+    """
+    Entry point for the background refill process: key_pool.py key_type watermark
+    """
+    if len(sys.argv) != 3 or sys.argv[1] not in key_utils.supported_key_types:
+        print('usage: python -m ec2instanceconnectcli.key_pool {{{0}}} watermark'.format(
+            ','.join(key_utils.supported_key_types)))
+        return 1
+    refill(sys.argv[1], int(sys.argv[2]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,7 +13,9 @@
 
 import sys
 
-def push_public_key(session, instance_id, user, pub_key, target_zone):
+from ec2instanceconnectcli import hedging, rate_limiter, timings
+
+def push_public_key(session, instance_id, user, pub_key, target_zone, client_cache=None, hedge_percentile=None):
     """
     Creates a Boto3 client to make call to the EC2 Instance Connect Service and invokes the SendSSHPublicKey API
 
@@ -29,10 +31,18 @@ def push_public_key(session, instance_id, user, pub_key, target_zone):
     :type pub_key: basestring
     :param target_zone: availability zone the instance lives in
     :type target_zone: basestring
+    :param client_cache: Optional cache to share the EC2 Instance Connect client through
+    :type client_cache: ec2instanceconnectcli.client_cache.ClientCache
+    :param hedge_percentile: Optional latency percentile after which a slow push is hedged with a second one
+    :type hedge_percentile: float
     """
 
     try:
-        client = session.create_client('ec2-instance-connect')
+        with timings.span('client', service='ec2-instance-connect'):
+            if client_cache is not None:
+                client = client_cache.get_client(session, 'ec2-instance-connect', config=rate_limiter.get_client_config())
+            else:
+                client = session.create_client('ec2-instance-connect', config=rate_limiter.get_client_config())
     except Exception as e:
         print("Error while trying to push the public key:\n" + str(e))
         sys.exit(1)
@@ -45,7 +55,9 @@ def push_public_key(session, instance_id, user, pub_key, target_zone):
              }
 
     try:
-        client.send_ssh_public_key(**params)
+        # Throttling and transient errors are retried; e.g. an availability zone mismatch fails right away
+        with timings.span('send_ssh_public_key', instance_id=instance_id):
+            hedging.call(client, 'send_ssh_public_key', hedge_percentile, **params)
     except Exception as e:
         print("Error while pushing the public key:\n" + str(e))
         sys.exit(1)
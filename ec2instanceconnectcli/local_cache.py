@@ -0,0 +1,125 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import contextlib
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+CACHE_DIR_ENV = 'MSSH_CACHE_DIR'
+CACHE_DIR_NAME = 'ec2instanceconnectcli'
+
+
+def locking_supported():
+    """
+    Whether cross-process file locking is available on this platform
+
+    :return: True if fcntl locks can be used
+    :rtype: bool
+    """
+    return fcntl is not None
+
+
+def get_cache_dir(*parts):
+    """
+    Returns a private (0700, owned by the current user) directory under the CLI's local cache,
+    creating it if needed.  The cache lives under $MSSH_CACHE_DIR if set, otherwise under
+    $XDG_CACHE_HOME or ~/.cache.
+
+    :param parts: Path components below the cache root
+    :type parts: basestring
+    :return: Absolute directory path
+    :rtype: basestring
+    """
+    root = os.environ.get(CACHE_DIR_ENV)
+    if root:
+        # The user picked this directory, so only the directories we create below it are locked down
+        os.makedirs(root, mode=0o700, exist_ok=True)
+        path = root
+    else:
+        xdg_cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        path = xdg_cache
+        parts = (CACHE_DIR_NAME,) + parts
+
+    for part in parts:
+        path = os.path.join(path, part)
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        if hasattr(os, 'getuid'):
+            st = os.stat(path)
+            if st.st_uid != os.getuid():
+                raise AssertionError('Cache directory {0} is not owned by the current user'.format(path))
+            if st.st_mode & 0o077:
+                os.chmod(path, 0o700)
+    return path
+
+
+def write_private_file(path, data):
+    """
+    Atomically writes data to a new 0600 file: the data goes to a temporary sibling first, which is then renamed
+    into place so readers never observe a partial file.
+
+    :param path: Destination file path
+    :type path: basestring
+    :param data: File contents
+    :type data: bytes
+    """
+    tmp_path = '{0}.tmp.{1}'.format(path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextlib.contextmanager
+def file_lock(path, blocking=True):
+    """
+    Holds an exclusive advisory lock on the given lock file for the duration of the context.
+    Yields whether the lock was acquired; with blocking=False this is False if another process holds it.  With
+    blocking=True a failure to lock is raised instead, so callers never go on without the lock.
+    Where locking is not supported the context yields True without locking.
+
+    :param path: Lock file path
+    :type path: basestring
+    :param blocking: Whether to wait for the lock
+    :type blocking: bool
+    """
+    if fcntl is None:
+        yield True
+        return
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, flags)
+        except (IOError, OSError):
+            if blocking:
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
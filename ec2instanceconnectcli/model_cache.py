@@ -0,0 +1,180 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Cache of trimmed botocore service models.
+
+Creating the EC2 client is dominated by loading EC2's service model, which describes hundreds of operations and
+thousands of shapes, for a CLI that calls DescribeInstances and nothing else.  On first use the models of the
+services the CLI calls are trimmed to the operations it uses and the shapes they reach, without documentation, and
+written to the local cache in botocore's data layout.  Sessions then find them ahead of botocore's own data.
+
+Trimmed models are kept per botocore version and service API version, so upgrading botocore or its models never
+serves a stale model; any other problem leaves the session with botocore's normal data.  Several installations with
+different botocore versions may share the cache, so the models of another version are only removed once no
+installation has used them for STALE_SECONDS.
+"""
+
+import json
+import logging
+import os
+import shutil
+import time
+
+from ec2instanceconnectcli import local_cache
+
+MODEL_CACHE_ENV = 'MSSH_MODEL_CACHE'
+CACHE_DIR = 'models'
+TYPE_NAME = 'service-2'
+# Operations the CLI calls, per service
+OPERATIONS = {
+    'ec2': ('DescribeInstances',),
+    'ec2-instance-connect': ('SendSSHPublicKey',),
+}
+DOCUMENTATION_KEYS = ('documentation', 'documentationUrl')
+# A botocore version's models are removed after going unused for this long
+STALE_SECONDS = 30 * 24 * 60 * 60
+# How often a version's directory has its modification time refreshed to mark it as used
+TOUCH_SECONDS = 24 * 60 * 60
+
+
+def is_enabled():
+    """
+    :return: Whether trimmed models are used; set $MSSH_MODEL_CACHE to 0 to turn them off
+    :rtype: bool
+    """
+    return os.environ.get(MODEL_CACHE_ENV, '1').lower() not in ('0', 'false', 'no', 'off')
+
+
+def _strip(entry):
+    """
+    :return: Copy of a model entry (operation, shape or shape reference) without documentation
+    :rtype: dict
+    """
+    return dict((key, value) for key, value in entry.items() if key not in DOCUMENTATION_KEYS)
+
+
+def trim_model(model, operation_names):
+    """
+    Reduces a service model to the given operations and the shapes they reach, without documentation
+
+    :param model: Full service-2 model
+    :type model: dict
+    :param operation_names: Operations to keep, e.g. ['DescribeInstances']
+    :type operation_names: iterable
+    :return: The trimmed model
+    :rtype: dict
+    """
+    trimmed = dict((key, value) for key, value in model.items()
+                   if key not in ('operations', 'shapes') + DOCUMENTATION_KEYS)
+    trimmed['operations'] = {}
+    pending = []
+    for name in operation_names:
+        operation = _strip(model['operations'][name])
+        for key in ('input', 'output'):
+            if key in operation:
+                operation[key] = _strip(operation[key])
+                pending.append(operation[key]['shape'])
+        if 'errors' in operation:
+            operation['errors'] = [_strip(error) for error in operation['errors']]
+            pending.extend(error['shape'] for error in operation['errors'])
+        trimmed['operations'][name] = operation
+
+    shapes = {}
+    while pending:
+        shape_name = pending.pop()
+        if shape_name in shapes:
+            continue
+        shape = _strip(model['shapes'][shape_name])
+        if 'members' in shape:
+            shape['members'] = dict((name, _strip(member)) for name, member in shape['members'].items())
+            pending.extend(member['shape'] for member in shape['members'].values())
+        for key in ('member', 'key', 'value'):
+            if key in shape:
+                shape[key] = _strip(shape[key])
+                pending.append(shape[key]['shape'])
+        shapes[shape_name] = shape
+    trimmed['shapes'] = dict((name, shapes[name]) for name in sorted(shapes))
+    return trimmed
+
+
+def build(loader):
+    """
+    Writes the trimmed models that are missing for the installed botocore version
+
+    :param loader: botocore data loader to read the full models with
+    :type loader: botocore.loaders.Loader
+    :return: Directory holding the trimmed models, to be used as a loader search path
+    :rtype: basestring
+    """
+    import botocore
+    from botocore.loaders import Loader
+
+    root = local_cache.get_cache_dir(CACHE_DIR)
+    # Reading the full models through the session's loader would cache them there, shadowing the trimmed ones
+    full_loader = Loader(extra_search_paths=list(loader.search_paths), include_default_search_paths=False)
+    built = False
+    for service_name in sorted(OPERATIONS):
+        api_version = loader.determine_latest_version(service_name, TYPE_NAME)
+        model_dir = local_cache.get_cache_dir(CACHE_DIR, botocore.__version__, service_name, api_version)
+        path = os.path.join(model_dir, TYPE_NAME + '.json')
+        if os.path.exists(path):
+            continue
+        # The raw model: the loader applies any extras when loading the trimmed one
+        model = full_loader.load_data(os.path.join(service_name, api_version, TYPE_NAME))
+        local_cache.write_private_file(path, json.dumps(trim_model(model, OPERATIONS[service_name])).encode('utf-8'))
+        built = True
+
+    version_dir = os.path.join(root, botocore.__version__)
+    now = time.time()
+    if now - os.stat(version_dir).st_mtime > TOUCH_SECONDS:
+        os.utime(version_dir, None)
+    if built:
+        _remove_stale(root, botocore.__version__, now)
+    return version_dir
+
+
+def _remove_stale(root, current_version, now):
+    """
+    Removes the models of other botocore versions that have not been used for STALE_SECONDS
+    """
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name == current_version:
+            continue
+        try:
+            if now - os.stat(path).st_mtime > STALE_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def install(session):
+    """
+    Has the session load the trimmed models ahead of botocore's data.  Must be called before the session creates
+    any client.  Failures are never fatal: the session keeps loading botocore's data.
+
+    :param session: Session to install the trimmed models in
+    :type session: botocore.session.Session
+    :return: Whether the trimmed models are used
+    :rtype: bool
+    """
+    if not is_enabled():
+        return False
+    try:
+        loader = session.get_component('data_loader')
+        loader.search_paths.insert(0, build(loader))
+    except Exception as e:
+        logging.getLogger('EC2InstanceConnect').debug('Service model cache unavailable: {0}'.format(str(e)))
+        return False
+    return True
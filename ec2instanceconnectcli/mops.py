@@ -11,17 +11,92 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+import os
 import sys
 import argparse
+import time
 
-from ec2instanceconnectcli.EC2InstanceConnectCLI import EC2InstanceConnectCLI
-from ec2instanceconnectcli.EC2InstanceConnectKey import EC2InstanceConnectKey
+from ec2instanceconnectcli import timings
+from ec2instanceconnectcli.EC2InstanceConnectCLI import EC2InstanceConnectCLI, SSH_CONNECTION_FAILED
+from ec2instanceconnectcli.EC2InstanceConnectKey import EC2InstanceConnectKey, DELIVERY_MODES, AGENT_DELIVERY, \
+    FILE_DELIVERY, MEMFD_DELIVERY, fd_delivery_supported
 from ec2instanceconnectcli.EC2InstanceConnectCommand import EC2InstanceConnectCommand
 from ec2instanceconnectcli.EC2InstanceConnectLogger import EC2InstanceConnectLogger
-from ec2instanceconnectcli import input_parser
+# The daemon, fleet mode and the ssh-agent are imported where they are used, off the default single-host path
+from ec2instanceconnectcli import address_race, hedging, input_parser, instance_cache, key_cache, key_pool, key_utils, \
+    multiplex, region_discovery
+
+# Recorded once the timings are configured
+_IMPORTED_AT = time.monotonic()
 
 DEFAULT_INSTANCE = ''
 DEFAULT_PROFILE = None
+KEY_TYPE_ENV = 'MSSH_KEY_TYPE'
+KEY_DELIVERY_ENV = 'MSSH_KEY_DELIVERY'
+DAEMON_ENV = 'MSSH_DAEMON'
+FLEET_CONCURRENCY_ENV = 'MSSH_FLEET_CONCURRENCY'
+DEFAULT_FLEET_CONCURRENCY = 10
+
+
+def _env_flag(name):
+    """
+    :return: Whether the given environment variable is set to a true value
+    :rtype: bool
+    """
+    return os.environ.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def _lookup_pushed_key(instance_bundles, logger, regions=None):
+    """
+    Looks for a key recently pushed to the first instance that needs one, so the key can be reused.
+    With region discovery, an instance given without a region is looked up in the region it was found in.
+
+    :return: Tuple of public and private key, or None
+    :rtype: tuple
+    """
+    for bundle in instance_bundles:
+        if len(bundle.instance_id) > 0:
+            try:
+                region = bundle.region
+                if not region and regions:
+                    region = region_discovery.lookup(bundle.profile, bundle.instance_id)
+                return key_cache.lookup(bundle.instance_id, bundle.username, bundle.profile, region)
+            except Exception as e:
+                logger.debug('Pushed key cache unavailable: {0}'.format(str(e)))
+                return None
+    return None
+
+def _get_port(flags, mode):
+    """
+    :return: The port given to the program with -p (ssh) or -P (sftp), or the default ssh port
+    :rtype: int
+    """
+    port_flag = '-p' if mode == 'ssh' else '-P'
+    for index, flag in enumerate(flags):
+        if flag == port_flag and index + 1 < len(flags):
+            return int(flags[index + 1])
+        if flag.startswith(port_flag) and flag[len(port_flag):].isdigit():
+            return int(flag[len(port_flag):])
+    return address_race.DEFAULT_PORT
+
+def _reuse_master(program, instance_bundles, flags, program_command, logger, control_persist, replace_process):
+    """
+    Runs the program over live ssh master connections to the instances, if they all have one.  The masters are
+    already authenticated, so no key is generated, looked up or passed to the program.
+
+    :return: Return code for remote command, or None if there is no master to reuse
+    :rtype: int
+    """
+    cli_command = EC2InstanceConnectCommand(program, instance_bundles, None, flags, program_command, logger,
+                                            control_persist=control_persist)
+    try:
+        cli = EC2InstanceConnectCLI(instance_bundles, None, cli_command, logger, replace_process=replace_process)
+        if not cli.reuse_master():
+            return None
+        return cli.connect()
+    except Exception as e:
+        print('Failed with:\n' + str(e))
+        sys.exit(1)
 
 def main(program, mode):
     """
@@ -36,6 +111,7 @@ def main(program, mode):
     :rtype: int
     """
 
+    parse_start = time.monotonic()
     usage = ""
     if mode == "ssh":
         usage="""
@@ -57,23 +133,170 @@ def main(program, mode):
     parser.add_argument('-u', '--profile', action='store', help='AWS Config Profile', type=str, default=DEFAULT_PROFILE, metavar='')
     parser.add_argument('-t', '--instance_id', action='store', help='EC2 Instance ID. Required if target is hostname', type=str, default=DEFAULT_INSTANCE, metavar='')
     parser.add_argument('-d', '--debug', action="store_true", help='Turn on debug logging')
+    parser.add_argument('--key-type', action='store', help='Ephemeral key type: {0}. Default: ${1} or {2}'.format(
+                        ', '.join(key_utils.supported_key_types), KEY_TYPE_ENV, key_utils.default_key_type),
+                        type=str, default=os.environ.get(KEY_TYPE_ENV, key_utils.default_key_type), metavar='')
+    parser.add_argument('--key-pool', action='store', help='Number of pre-generated keys to keep in the local key pool; '
+                        '0 disables the pool. Default: ${0} or 0'.format(key_pool.KEY_POOL_ENV),
+                        type=int, default=os.environ.get(key_pool.KEY_POOL_ENV) or '0', metavar='')
+    parser.add_argument('--reuse-key', action='store_true', help='Reuse a key pushed to the same instance and user '
+                        'in the last {0} seconds. Default: ${1}'.format(key_cache.MAX_AGE_SECONDS, key_cache.REUSE_KEY_ENV),
+                        default=_env_flag(key_cache.REUSE_KEY_ENV))
+    parser.add_argument('--key-delivery', action='store', help='How the private key is handed to {0}: {1}. '
+                        'Default: ${2} or {3}'.format(program, ', '.join(DELIVERY_MODES), KEY_DELIVERY_ENV, FILE_DELIVERY),
+                        type=str, default=os.environ.get(KEY_DELIVERY_ENV, FILE_DELIVERY), metavar='')
+    parser.add_argument('--instance-cache-ttl', action='store', help='Seconds to reuse instance information from the '
+                        'local instance cache instead of calling DescribeInstances; 0 disables the cache. '
+                        'Default: ${0} or 0'.format(instance_cache.INSTANCE_CACHE_TTL_ENV),
+                        type=int, default=os.environ.get(instance_cache.INSTANCE_CACHE_TTL_ENV) or '0', metavar='')
+    parser.add_argument('--hedge-percentile', action='store', help='Send a second DescribeInstances or '
+                        'SendSSHPublicKey call when one takes longer than this percentile of recent latencies; '
+                        '0 disables hedging. Default: ${0} or 0'.format(hedging.HEDGE_PERCENTILE_ENV),
+                        type=float, default=os.environ.get(hedging.HEDGE_PERCENTILE_ENV) or '0', metavar='')
+    parser.add_argument('--regions', action='store', help='Comma-separated regions to search, along with the '
+                        'profile\'s default region, for instances given without -r. The region found is cached. '
+                        'Default: ${0}'.format(region_discovery.REGIONS_ENV),
+                        type=str, default=os.environ.get(region_discovery.REGIONS_ENV, ''), metavar='')
+    parser.add_argument('--control-persist', action='store', help='Seconds for which {0} keeps the connection to an '
+                        'instance open after the session ends, so that later connections reuse it without looking '
+                        'the instance up or pushing a key; 0 disables multiplexing. '
+                        'Default: ${1} or 0'.format(program, multiplex.CONTROL_PERSIST_ENV),
+                        type=int, default=os.environ.get(multiplex.CONTROL_PERSIST_ENV) or '0', metavar='')
+    parser.add_argument('--race-addresses', action='store_true', help='Connect to whichever of the instance\'s '
+                        'public, private and IPv6 addresses answers first, remembering the winner for this network. '
+                        'Default: ${0}'.format(address_race.ADDRESS_RACE_ENV),
+                        default=_env_flag(address_race.ADDRESS_RACE_ENV))
+    if mode == "ssh":
+        parser.add_argument('--fleet', action='store_true', help='Run the command on each of a comma-separated list '
+                            'of [user@]instance_id targets, streaming each host\'s output prefixed with its name. '
+                            'A [user@]tag:Key=Value or [user@]filter:Name=Value target, with further conditions '
+                            'joined by +, stands for every running instance that matches')
+        parser.add_argument('--targets-file', action='store', help='Read --fleet targets from this file, or - for '
+                            'stdin, one per line, instead of the command line; implies --fleet', type=str,
+                            metavar='')
+        parser.add_argument('--concurrency', action='store', help='Maximum number of fleet targets processed at once. '
+                            'Default: ${0} or {1}'.format(FLEET_CONCURRENCY_ENV, DEFAULT_FLEET_CONCURRENCY),
+                            type=int, default=os.environ.get(FLEET_CONCURRENCY_ENV) or str(DEFAULT_FLEET_CONCURRENCY),
+                            metavar='')
+
+    parser.add_argument('--daemon', action='store_true', help='Have the mssh daemon look up instances and push '
+                        'keys with warm sessions, starting it if it is not running. Default: ${0}'.format(DAEMON_ENV),
+                        default=_env_flag(DAEMON_ENV))
+
+    parser.add_argument('--timings', action='store_true', help='Print how long each phase of the run took')
+    parser.add_argument('--timings-json', action='store', help='Write how long each phase of the run took to this '
+                        'file as JSON', type=str, metavar='')
 
     args = parser.parse_known_args()
+    timings.configure(text=args[0].timings, json_path=args[0].timings_json)
+    timings.add_span('import', timings.ORIGIN, _IMPORTED_AT)
 
     logger = EC2InstanceConnectLogger(args[0].debug)
+    fleet_mode = getattr(args[0], 'fleet', False) or bool(getattr(args[0], 'targets_file', None))
     try:
-        instance_bundles, flags, program_command = input_parser.parseargs(args, mode)
+        if args[0].key_type not in key_utils.supported_key_types:
+            raise AssertionError('{0} is not a supported key type'.format(args[0].key_type))
+        if args[0].key_delivery not in DELIVERY_MODES:
+            raise AssertionError('{0} is not a supported key delivery'.format(args[0].key_delivery))
+        if args[0].key_delivery == AGENT_DELIVERY:
+            from ec2instanceconnectcli import ssh_agent
+            if not ssh_agent.is_supported():
+                raise AssertionError('Agent key delivery is not supported on this platform')
+        if args[0].key_delivery == MEMFD_DELIVERY and not fd_delivery_supported():
+            raise AssertionError('memfd key delivery is not supported on this platform')
+        if not 0 <= args[0].hedge_percentile <= 100:
+            raise AssertionError('--hedge-percentile must be between 0 and 100')
+        if args[0].control_persist < 0:
+            raise AssertionError('--control-persist must not be negative')
+        if args[0].control_persist and not multiplex.is_supported():
+            raise AssertionError('Multiplexing is not supported on this platform')
+        regions = [region.strip() for region in args[0].regions.split(',') if region.strip()]
+        for region in regions:
+            if input_parser.REGION_RE.match(region) is None:
+                raise AssertionError('{0} is not a valid region'.format(region))
+        if fleet_mode:
+            if args[0].key_delivery == MEMFD_DELIVERY:
+                raise AssertionError('memfd key delivery cannot be used with --fleet')
+            if args[0].concurrency < 1:
+                raise AssertionError('--concurrency must be at least 1')
+            if args[0].targets_file:
+                # Streamed, so they are not known up front
+                fleet_bundles, flags, program_command = input_parser.parse_targets_file(args, mode)
+                instance_bundles = []
+            else:
+                fleet_bundles, flags, program_command = input_parser.parse_fleet_args(args, mode)
+                instance_bundles = [bundle for target_bundles in fleet_bundles for bundle in target_bundles]
+        else:
+            instance_bundles, flags, program_command = input_parser.parseargs(args, mode)
+        race_port = None
+        if args[0].race_addresses:
+            if address_race.routes_through_proxy(flags):
+                logger.get_logger().debug('Not racing addresses: {0} connects through a jump host or '
+                                          'proxy'.format(program))
+            else:
+                race_port = _get_port(flags, mode)
     except Exception as e:
         print(str(e))
         parser.print_help()
         sys.exit(1)
+    timings.add_span('parse_args', parse_start, time.monotonic())
+
+    if args[0].control_persist > 0 and not fleet_mode:
+        returncode = _reuse_master(program, instance_bundles, flags, program_command, logger.get_logger(),
+                                   args[0].control_persist, args[0].key_delivery == MEMFD_DELIVERY)
+        if returncode is not None:
+            return returncode
+
+    prepared = None
+    if args[0].daemon and not fleet_mode:
+        from ec2instanceconnectcli import daemon
+        with timings.span('daemon'):
+            prepared = daemon.prepare(instance_bundles, args[0].key_type, logger.get_logger(),
+                                      reuse_key=args[0].reuse_key, instance_cache_ttl=args[0].instance_cache_ttl,
+                                      hedge_percentile=args[0].hedge_percentile, regions=regions,
+                                      race_port=race_port)
+
+    key_pair = None
+    if prepared:
+        # The daemon has looked the instances up and pushed its key; only ssh is left to do
+        instance_bundles, key_pair, cached_bundles = prepared
+    elif args[0].reuse_key:
+        key_pair = _lookup_pushed_key(instance_bundles, logger.get_logger(), regions=regions)
 
     #Generate temp key
-    cli_key = EC2InstanceConnectKey(logger.get_logger())
-    cli_command = EC2InstanceConnectCommand(program, instance_bundles, cli_key.get_priv_key_file(), flags, program_command, logger.get_logger())
+    with timings.span('keygen', key_type=args[0].key_type):
+        cli_key = EC2InstanceConnectKey(logger.get_logger(), key_type=args[0].key_type,
+                                        pool_watermark=args[0].key_pool, key_pair=key_pair,
+                                        delivery=args[0].key_delivery)
+    if fleet_mode:
+        from ec2instanceconnectcli import fleet
+        runner = fleet.FleetRunner(program, fleet_bundles, cli_key.get_pub_key(), cli_key.get_identity_file(), flags,
+                                   program_command, logger.get_logger(), identity_agent=cli_key.get_identity_agent(),
+                                   concurrency=args[0].concurrency,
+                                   cache_priv_key=cli_key.get_priv_key() if args[0].reuse_key else None,
+                                   instance_cache_ttl=args[0].instance_cache_ttl,
+                                   hedge_percentile=args[0].hedge_percentile, regions=regions,
+                                   control_persist=args[0].control_persist, race_port=race_port)
+        return runner.run()
+
+    cli_command = EC2InstanceConnectCommand(program, instance_bundles, cli_key.get_identity_file(), flags, program_command,
+                                            logger.get_logger(), identity_agent=cli_key.get_identity_agent(),
+                                            control_persist=args[0].control_persist)
 
     try:
-        cli = EC2InstanceConnectCLI(instance_bundles, cli_key.get_pub_key(), cli_command, logger.get_logger())
+        cache_priv_key = cli_key.get_priv_key() if args[0].reuse_key else None
+        # With memfd delivery nothing needs cleaning up afterwards, so the CLI execs into the program
+        cli = EC2InstanceConnectCLI(instance_bundles, cli_key.get_pub_key(), cli_command, logger.get_logger(),
+                                    cache_priv_key=cache_priv_key,
+                                    replace_process=args[0].key_delivery == MEMFD_DELIVERY,
+                                    instance_cache_ttl=args[0].instance_cache_ttl,
+                                    hedge_percentile=args[0].hedge_percentile, regions=regions,
+                                    race_port=race_port)
+        if prepared:
+            returncode = cli.connect()
+            if returncode == SSH_CONNECTION_FAILED and cached_bundles:
+                daemon.invalidate(cached_bundles, logger.get_logger())
+            return returncode
         return cli.invoke_command()
     except Exception as e:
         print('Failed with:\n' + str(e))
@@ -0,0 +1,105 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Managed ssh connection multiplexing.
+
+With a ControlPersist duration, ssh keeps the master connection to an instance open after the session ends, listening
+on a ControlPath socket in the private local cache.  Socket paths are derived from the instance, user, profile and
+program flags only, so the CLI can find a live master before it knows the instance's address or region; the address
+is kept in a file next to the socket.  A later connection through a live master needs no lookup, key push or handshake.
+"""
+
+import hashlib
+import json
+import os
+import socket
+
+from ec2instanceconnectcli import local_cache
+
+CONTROL_PERSIST_ENV = 'MSSH_CONTROL_PERSIST'
+CACHE_DIR = 'control'
+HOST_SUFFIX = '.host'
+# Unix socket paths are limited to 104 bytes on some platforms, and ssh appends a 17 character suffix to the
+# ControlPath while it sets a master up
+MAX_SOCKET_PATH = 104 - 17
+
+
+def is_supported():
+    """
+    :return: Whether ssh can multiplex over Unix sockets on this platform
+    :rtype: bool
+    """
+    return hasattr(socket, 'AF_UNIX')
+
+
+def get_control_path(instance_bundle, flags=()):
+    """
+    :param instance_bundle: Bundle of the instance to connect to
+    :type instance_bundle: ec2instanceconnectcli.instance_bundle.InstanceBundle
+    :param flags: Flags given to the program, e.g. a port or jump host, which the master must have been started with
+    :type flags: list
+    :return: ControlPath of the master connection to the bundle's instance, or None if the path would be too long
+        for a Unix socket
+    :rtype: basestring
+    """
+    key = '\0'.join([instance_bundle['instance_id'], instance_bundle['username'], instance_bundle.get('profile') or '']
+                     + list(flags))
+    path = os.path.join(local_cache.get_cache_dir(CACHE_DIR), hashlib.sha256(key.encode('utf-8')).hexdigest()[:20])
+    if len(path.encode('utf-8')) > MAX_SOCKET_PATH:
+        return None
+    return path
+
+
+def is_master_alive(control_path):
+    """
+    Checks for a master listening on the control path by connecting to it, which is much cheaper than `ssh -O check`
+
+    :param control_path: ControlPath of the master
+    :type control_path: basestring
+    :rtype: bool
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(control_path)
+    except (socket.error, IOError):
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def read_host(control_path):
+    """
+    :param control_path: ControlPath of the master
+    :type control_path: basestring
+    :return: Address the master was connected to, or None if not recorded
+    :rtype: basestring
+    """
+    try:
+        with open(control_path + HOST_SUFFIX, 'r') as f:
+            return json.load(f)['host_info']
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def write_host(control_path, host_info):
+    """
+    Records the address a master is about to be connected to
+
+    :param control_path: ControlPath of the master
+    :type control_path: basestring
+    :param host_info: Address of the instance
+    :type host_info: basestring
+    """
+    local_cache.write_private_file(control_path + HOST_SUFFIX, json.dumps({'host_info': host_info}).encode('utf-8'))
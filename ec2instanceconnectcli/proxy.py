@@ -0,0 +1,231 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+ssh ProxyCommand that pushes a key through EC2 Instance Connect just before connecting.
+
+Used from ~/.ssh/config, e.g.
+
+    Host i-*
+        IdentityFile ~/.ssh/id_ed25519
+        ProxyCommand mssh-proxy -u dev -r us-west-2 %r@%h %p
+
+it looks the instance up, pushes the public key of the identity ssh is going to use and then relays ssh's stdin and
+stdout to the instance's port.  Anything that runs ssh, such as rsync, git or Ansible, gets EC2 Instance Connect
+without going through mssh.
+
+Where the platform has splice(2) and ssh hands us pipes, as OpenSSH does, the relay moves data between the pipes and
+the socket inside the kernel.  Otherwise each direction is copied through one preallocated buffer.
+"""
+
+import argparse
+import contextlib
+import errno
+import os
+import socket
+import stat
+import sys
+import threading
+
+from ec2instanceconnectcli import address_race, input_parser, instance_cache, region_discovery
+from ec2instanceconnectcli.instance_bundle import InstanceBundle
+
+DEFAULT_PORT = 22
+CONNECT_TIMEOUT_SECONDS = 30
+CHUNK_SIZE = 64 * 1024
+# Public keys tried, in order, when --public-key is not given
+DEFAULT_PUBLIC_KEYS = ('~/.ssh/id_ed25519.pub', '~/.ssh/id_ecdsa.pub', '~/.ssh/id_rsa.pub')
+
+
+def _is_pipe(fd):
+    return hasattr(os, 'splice') and stat.S_ISFIFO(os.fstat(fd).st_mode)
+
+
+def _splice(src_fd, dst_fd):
+    """
+    Moves data from src_fd to dst_fd inside the kernel until src_fd reaches end of file
+
+    :return: False if splice is not supported between these descriptors and nothing was moved
+    :rtype: bool
+    """
+    try:
+        while os.splice(src_fd, dst_fd, CHUNK_SIZE):
+            pass
+    except OSError as e:
+        if e.errno in (errno.EINVAL, errno.ENOSYS):
+            return False
+        raise
+    return True
+
+
+def _copy_to_socket(fd, sock):
+    if _is_pipe(fd) and _splice(fd, sock.fileno()):
+        return
+    buf = bytearray(CHUNK_SIZE)
+    view = memoryview(buf)
+    with open(fd, 'rb', buffering=0, closefd=False) as src:
+        while True:
+            count = src.readinto(buf)
+            if not count:
+                return
+            sock.sendall(view[:count])
+
+
+def _copy_from_socket(sock, fd):
+    if _is_pipe(fd) and _splice(sock.fileno(), fd):
+        return
+    buf = bytearray(CHUNK_SIZE)
+    view = memoryview(buf)
+    with open(fd, 'wb', buffering=0, closefd=False) as dst:
+        while True:
+            count = sock.recv_into(buf)
+            if not count:
+                return
+            written = 0
+            while written < count:
+                written += dst.write(view[written:count])
+
+
+def relay(sock, in_fd=0, out_fd=1):
+    """
+    Relays in_fd to the socket and the socket to out_fd until the remote end closes the connection.
+    End of file on in_fd is passed on by shutting down the sending side of the socket.
+
+    :param sock: Connected socket
+    :type sock: socket.socket
+    :param in_fd: File descriptor to send to the socket
+    :type in_fd: int
+    :param out_fd: File descriptor to write what is received to
+    :type out_fd: int
+    """
+    def send():
+        try:
+            _copy_to_socket(in_fd, sock)
+        except (IOError, OSError):
+            pass
+        finally:
+            try:
+                sock.shutdown(socket.SHUT_WR)
+            except (IOError, OSError):
+                pass
+
+    sender = threading.Thread(target=send, name='proxy-send')
+    # Blocked on in_fd, it must not keep the proxy alive once the remote end is gone
+    sender.daemon = True
+    sender.start()
+    _copy_from_socket(sock, out_fd)
+
+
+def _get_public_key(path):
+    """
+    :param path: Public key file, or None for the first of DEFAULT_PUBLIC_KEYS that exists
+    :type path: basestring
+    :return: Contents of the public key file
+    :rtype: basestring
+    """
+    candidates = [path] if path else DEFAULT_PUBLIC_KEYS
+    for candidate in candidates:
+        candidate = os.path.expanduser(candidate)
+        if os.path.isfile(candidate):
+            with open(candidate, 'r') as f:
+                return f.read().strip()
+    raise AssertionError('No public key found at {0}'.format(', '.join(candidates)))
+
+
+def parse_target(args):
+    """
+    Builds the instance bundle for the proxy's target
+
+    :param args: Parsed proxy arguments
+    :type args: argparse.Namespace
+    :return: The validated instance bundle
+    :rtype: ec2instanceconnectcli.instance_bundle.InstanceBundle
+    """
+    bundle = InstanceBundle(profile=args.profile, instance_id=args.instance_id, region=args.region, zone=args.zone,
+                            target=args.target, username='')
+    bundle = input_parser._parse_instance_bundles([bundle])[0]
+    if not input_parser.INSTANCE_ID_RE.match(bundle.instance_id):
+        raise AssertionError('Missing instance_id')
+    return bundle
+
+
+def connect(host, port):
+    """
+    :return: Socket connected to the port of the host
+    :rtype: socket.socket
+    """
+    sock = socket.create_connection((host, port), timeout=CONNECT_TIMEOUT_SECONDS)
+    sock.settimeout(None)
+    # ssh sends many small interactive writes
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def main():
+    """
+    Entry point of mssh-proxy
+    """
+    parser = argparse.ArgumentParser(prog='mssh-proxy', usage='mssh-proxy [-u profile] [-r region] [-z zone] '
+                                     '[-t instance_id] [--public-key file] [user@]instance_id|hostname [port]')
+    parser.add_argument('-r', '--region', action='store', help='AWS region', type=str, metavar='')
+    parser.add_argument('-z', '--zone', action='store', help='Availability zone', type=str, metavar='')
+    parser.add_argument('-u', '--profile', action='store', help='AWS Config Profile', type=str, default=None,
+                        metavar='')
+    parser.add_argument('-t', '--instance_id', action='store', help='EC2 Instance ID. Required if target is hostname',
+                        type=str, default='', metavar='')
+    parser.add_argument('-d', '--debug', action='store_true', help='Turn on debug logging')
+    parser.add_argument('--public-key', action='store', help='Public key to push; it must belong to the identity ssh '
+                        'authenticates with. Default: the first of {0}'.format(', '.join(DEFAULT_PUBLIC_KEYS)),
+                        type=str, metavar='')
+    parser.add_argument('--instance-cache-ttl', action='store', help='Seconds to reuse instance information from the '
+                        'local instance cache. Default: ${0} or 0'.format(instance_cache.INSTANCE_CACHE_TTL_ENV),
+                        type=int, default=os.environ.get(instance_cache.INSTANCE_CACHE_TTL_ENV) or '0', metavar='')
+    parser.add_argument('--regions', action='store', help='Comma-separated regions to search for instances given '
+                        'without -r. Default: ${0}'.format(region_discovery.REGIONS_ENV),
+                        type=str, default=os.environ.get(region_discovery.REGIONS_ENV, ''), metavar='')
+    parser.add_argument('--race-addresses', action='store_true', help='Connect to whichever of the instance\'s '
+                        'public, private and IPv6 addresses answers first, remembering the winner for this network. '
+                        'Default: ${0}'.format(address_race.ADDRESS_RACE_ENV),
+                        default=os.environ.get(address_race.ADDRESS_RACE_ENV, '').lower() in ('1', 'true', 'yes', 'on'))
+    parser.add_argument('target', help='[user@]instance_id or [user@]hostname, e.g. %%r@%%h')
+    parser.add_argument('port', nargs='?', type=int, default=DEFAULT_PORT, help='Port to connect to, e.g. %%p')
+    args = parser.parse_args()
+
+    from ec2instanceconnectcli.EC2InstanceConnectCLI import EC2InstanceConnectCLI
+    from ec2instanceconnectcli.EC2InstanceConnectLogger import EC2InstanceConnectLogger
+    logger = EC2InstanceConnectLogger(args.debug).get_logger()
+
+    # stdout belongs to ssh's protocol stream; messages from the lookup and push must go elsewhere
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            bundle = parse_target(args)
+            pub_key = _get_public_key(args.public_key)
+            regions = [region.strip() for region in args.regions.split(',') if region.strip()]
+            cli = EC2InstanceConnectCLI([bundle], pub_key, None, logger, instance_cache_ttl=args.instance_cache_ttl,
+                                        regions=regions, race_port=args.port if args.race_addresses else None)
+            cli.create_sessions()
+            cli.call_ec2()
+            cli.handle_keys()
+            logger.debug('Connecting to {0} port {1}'.format(bundle.host_info, args.port))
+            sock = connect(bundle.host_info, args.port)
+        except Exception as e:
+            print('Failed with: ' + str(e))
+            return 1
+
+    with sock:
+        relay(sock)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Client-side rate limiting and retries for the AWS API calls the CLI makes.
+
+Calls to each API in each region share one token bucket, whose fill rate adapts AIMD-style: it grows by a fixed step
+after every successful call and is halved whenever the service throttles us.  Throttling, transient service errors
+and connection errors are retried with full-jitter exponential backoff; anything else fails immediately.
+"""
+
+import logging
+import random
+import threading
+import time
+
+# Retries are done here, with the limiter seeing every throttled attempt, so botocore's own are turned off
+CLIENT_RETRIES = {'max_attempts': 0}
+
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 20
+MIN_RATE = 0.5
+MAX_RATE = 100.0
+RATE_INCREASE = 0.5
+RATE_DECREASE_FACTOR = 0.5
+
+DEFAULT_MAX_ATTEMPTS = 8
+BASE_BACKOFF_SECONDS = 0.1
+MAX_BACKOFF_SECONDS = 5.0
+
+THROTTLING_ERROR_CODES = frozenset([
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'RequestLimitExceeded', 'RequestThrottled', 'EC2ThrottledException',
+    'SlowDown',
+])
+TRANSIENT_ERROR_CODES = frozenset([
+    'ServiceUnavailable', 'ServiceUnavailableException', 'InternalError', 'InternalFailure',
+    'InternalServerError', 'InternalServiceException', 'RequestTimeout', 'RequestTimeoutException',
+    'PriorRequestNotComplete',
+])
+TRANSIENT_STATUS_CODES = frozenset([500, 502, 503, 504])
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_client_config = []
+
+
+class AdaptiveRateLimiter(object):
+    """
+    Thread-safe token bucket with an AIMD-adjusted fill rate
+    """
+
+    def __init__(self, name, rate=DEFAULT_RATE, burst=DEFAULT_BURST, min_rate=MIN_RATE, max_rate=MAX_RATE,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+        :param name: Name to identify the limiter by in debug output
+        :type name: basestring
+        :param rate: Initial fill rate, in calls per second
+        :type rate: float
+        :param burst: Bucket size, i.e. how many calls can be made at once after a quiet period
+        :type burst: int
+        :param min_rate: Lower bound for the fill rate
+        :type min_rate: float
+        :param max_rate: Upper bound for the fill rate
+        :type max_rate: float
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(burst)
+        self.updated_at = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, waiting for one if the bucket is empty.  Waiting callers are queued by reserving tokens
+        ahead of time, so they are let through at the fill rate rather than all at once.
+
+        :return: Seconds waited
+        :rtype: float
+        """
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            logging.getLogger('EC2InstanceConnect').debug(
+                'Rate limiter {0}: waiting {1:.3f}s for a token'.format(self.name, wait))
+            self.sleep(wait)
+        return wait
+
+    def on_success(self):
+        """
+        Additive increase of the fill rate
+        """
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    def on_throttle(self):
+        """
+        Multiplicative decrease of the fill rate
+        """
+        with self.lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * RATE_DECREASE_FACTOR)
+        logging.getLogger('EC2InstanceConnect').debug('Throttled; {0}'.format(self.describe()))
+
+    def describe(self):
+        """
+        :return: The limiter's current state, for debug output
+        :rtype: basestring
+        """
+        with self.lock:
+            return 'rate limiter {0}: {1:.2f} calls/s, {2:.2f} of {3} tokens'.format(
+                self.name, self.rate, self.tokens, self.burst)
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(float(self.burst), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+def get_limiter(operation_name, region):
+    """
+    Returns the limiter shared by all calls to the given API in the given region, creating it on first use
+
+    :param operation_name: Client method name of the API, e.g. 'describe_instances'
+    :type operation_name: basestring
+    :param region: Region the API is called in
+    :type region: basestring
+    :rtype: AdaptiveRateLimiter
+    """
+    key = (operation_name, region)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter('{0}/{1}'.format(operation_name, region))
+            _limiters[key] = limiter
+        return limiter
+
+
+def get_client_config():
+    """
+    :return: Configuration for the clients whose calls go through call_with_retry
+    :rtype: botocore.config.Config
+    """
+    if not _client_config:
+        from botocore.config import Config
+        _client_config.append(Config(retries=CLIENT_RETRIES))
+    return _client_config[0]
+
+
+def is_throttling_error(error):
+    from botocore.exceptions import ClientError
+
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+def is_retryable_error(error):
+    """
+    :return: Whether the call that raised the given error may succeed when retried
+    :rtype: bool
+    """
+    from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+    if isinstance(error, (ConnectionError, HTTPClientError)):
+        return True
+    if isinstance(error, ClientError):
+        if is_throttling_error(error) or error.response.get('Error', {}).get('Code') in TRANSIENT_ERROR_CODES:
+            return True
+        return error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') in TRANSIENT_STATUS_CODES
+    return False
+
+
+def call_with_retry(client, operation_name, max_attempts=DEFAULT_MAX_ATTEMPTS, sleep=time.sleep, **params):
+    """
+    Calls a client API through its rate limiter, retrying retryable errors with full-jitter exponential backoff
+
+    :param client: Botocore client
+    :type client: botocore.client.BaseClient
+    :param operation_name: Client method to call, e.g. 'describe_instances'
+    :type operation_name: basestring
+    :param max_attempts: Maximum number of calls to make
+    :type max_attempts: int
+    :param params: API request parameters
+    :return: The API response
+    :rtype: dict
+    """
+    logger = logging.getLogger('EC2InstanceConnect')
+    limiter = get_limiter(operation_name, client.meta.region_name)
+    attempt = 1
+    while True:
+        limiter.acquire()
+        try:
+            response = getattr(client, operation_name)(**params)
+        except Exception as e:
+            if not is_retryable_error(e) or attempt >= max_attempts:
+                raise
+            if is_throttling_error(e):
+                limiter.on_throttle()
+            delay = random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** attempt))
+            logger.debug('{0} attempt {1} failed with {2}; retrying in {3:.3f}s ({4})'.format(
+                operation_name, attempt, str(e), delay, limiter.describe()))
+            sleep(delay)
+            attempt += 1
+        else:
+            limiter.on_success()
+            return response
@@ -0,0 +1,188 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Finds the region of an instance when none is given.
+
+DescribeInstances for the instance is sent to every candidate region at once; the first region that knows the
+instance wins and the other probes are abandoned.  Since an instance never changes region, the result is kept in the
+local cache per profile and later connections go straight to that region.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from ec2instanceconnectcli import ec2_util, local_cache, rate_limiter, timings
+
+REGIONS_ENV = 'MSSH_REGIONS'
+CACHE_DIR = 'regions'
+LOCK_FILE = '.lock'
+MAX_ENTRIES = 10000
+# Errors meaning the instance is not in the probed region; any other error is raised
+NOT_FOUND_ERROR_CODES = ('InvalidInstanceID.NotFound', 'InvalidInstanceID.Malformed')
+
+
+class ProbeCancelled(Exception):
+    """
+    Raised in a probe that is still retrying after another region found the instance
+    """
+
+
+def _index_path(profile):
+    return os.path.join(local_cache.get_cache_dir(CACHE_DIR),
+                        hashlib.sha256((profile or '').encode('utf-8')).hexdigest() + '.json')
+
+
+def _read_index(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _update_index(profile, update):
+    """
+    Applies update(index) to the profile's index under the cache lock and writes it back atomically
+    """
+    path = _index_path(profile)
+    with local_cache.file_lock(os.path.join(os.path.dirname(path), LOCK_FILE)):
+        index = _read_index(path)
+        update(index)
+        local_cache.write_private_file(path, json.dumps(index, separators=(',', ':')).encode('utf-8'))
+
+
+def lookup(profile, instance_id):
+    """
+    :param profile: AWS profile the instance was found with
+    :type profile: basestring
+    :param instance_id: InstanceID to look up
+    :type instance_id: basestring
+    :return: The region the instance was found in, or None if it is not cached
+    :rtype: basestring
+    """
+    entry = _read_index(_index_path(profile)).get(instance_id)
+    return entry['region'] if entry else None
+
+
+def remember(profile, instance_id, region):
+    """
+    Caches the region of an instance, dropping the oldest entries beyond MAX_ENTRIES
+
+    :param profile: AWS profile the instance was found with
+    :type profile: basestring
+    :param instance_id: InstanceID of the instance
+    :type instance_id: basestring
+    :param region: Region the instance was found in
+    :type region: basestring
+    """
+    def update(index):
+        index[instance_id] = {'region': region, 'found_at': time.time()}
+        if len(index) > MAX_ENTRIES:
+            for old_id in sorted(index, key=lambda key: index[key]['found_at'])[:len(index) - MAX_ENTRIES]:
+                del index[old_id]
+
+    _update_index(profile, update)
+
+
+def forget(profile, instance_id):
+    """
+    Removes an instance from the cache, e.g. because it no longer exists
+    """
+    def update(index):
+        index.pop(instance_id, None)
+
+    _update_index(profile, update)
+
+
+def _is_not_found(error):
+    from botocore.exceptions import ClientError
+
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in NOT_FOUND_ERROR_CODES
+
+
+def discover(session, instance_id, regions, client_cache=None):
+    """
+    Looks the instance up in all the given regions and the session's default region in parallel.  If no region
+    finds the instance and a probe failed for any other reason than the instance not being in its region, such as
+    invalid credentials or a missing permission, the discovery fails with the first such error.
+
+    :param session: Botocore session for the profile; its region is probed too
+    :type session: botocore.session.Session
+    :param instance_id: InstanceID to find
+    :type instance_id: basestring
+    :param regions: Regions to probe
+    :type regions: list
+    :param client_cache: Optional cache to share the EC2 clients through
+    :type client_cache: ec2instanceconnectcli.client_cache.ClientCache
+    :return: The region the instance was found in and its information as returned by ec2_util.get_instance_data,
+        or None if no region knows the instance
+    :rtype: tuple
+    """
+    logger = logging.getLogger('EC2InstanceConnect')
+    default_region = session.get_config_variable('region')
+    candidates = list(dict.fromkeys(([default_region] if default_region else []) + list(regions)))
+    results = queue.Queue()
+    found = threading.Event()
+
+    def sleep(seconds):
+        # Stops the backoff of probes that are no longer needed
+        if found.wait(seconds):
+            raise ProbeCancelled()
+
+    def probe(region):
+        start = time.monotonic()
+        try:
+            if found.is_set():
+                raise ProbeCancelled()
+            if client_cache is not None:
+                client = client_cache.get_client(session, 'ec2', config=rate_limiter.get_client_config(),
+                                                 region_name=region)
+            else:
+                client = session.create_client('ec2', region_name=region, config=rate_limiter.get_client_config())
+            response = rate_limiter.call_with_retry(client, 'describe_instances', sleep=sleep,
+                                                    InstanceIds=[instance_id])
+        except Exception as e:
+            results.put((region, None, e))
+            return
+        finally:
+            timings.add_span('region_probe', start, time.monotonic(), region=region)
+        instances = [instance for reservation in response['Reservations'] for instance in reservation['Instances']]
+        results.put((region, instances[0] if instances else None, None))
+
+    for region in candidates:
+        thread = threading.Thread(target=probe, args=(region,), name='probe-{0}'.format(region))
+        # Abandoned probes must not keep the CLI from exiting
+        thread.daemon = True
+        thread.start()
+
+    # A region can fail for reasons of its own, such as being a disabled opt-in region, while another knows the
+    # instance, so errors only count once every region has answered
+    errors = []
+    for _ in candidates:
+        region, instance, error = results.get()
+        if instance is not None:
+            found.set()
+            logger.debug('Found {0} in {1}'.format(instance_id, region))
+            return region, ec2_util.build_instance_info(instance)
+        if error is not None and not _is_not_found(error):
+            errors.append(error)
+        logger.debug('{0} not found in {1}: {2}'.format(instance_id, region, str(error) if error else 'no match'))
+    if errors:
+        raise errors[0]
+    return None
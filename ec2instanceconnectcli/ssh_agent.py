@@ -0,0 +1,238 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Minimal in-process ssh-agent serving a single ephemeral key.
+
+Implements the identity listing and signing requests of the ssh-agent protocol
+(https://datatracker.ietf.org/doc/html/draft-miller-ssh-agent) over a Unix socket in a private temporary directory,
+so ssh can authenticate with the key without the private key ever being written to disk.
+"""
+
+import base64
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+
+SSH_AGENT_FAILURE = 5
+SSH_AGENTC_REQUEST_IDENTITIES = 11
+SSH_AGENT_IDENTITIES_ANSWER = 12
+SSH_AGENTC_SIGN_REQUEST = 13
+SSH_AGENT_SIGN_RESPONSE = 14
+
+SSH_AGENT_RSA_SHA2_256 = 0x02
+SSH_AGENT_RSA_SHA2_512 = 0x04
+
+SOCKET_NAME = 'agent.sock'
+PUB_KEY_NAME = 'id.pub'
+# Larger requests than this are not something ssh sends; refuse them rather than buffering
+MAX_MESSAGE_LENGTH = 256 * 1024
+
+
+def is_supported():
+    """
+    :return: Whether Unix sockets, and therefore the agent, are available on this platform
+    :rtype: bool
+    """
+    return hasattr(socket, 'AF_UNIX')
+
+
+def _pack_string(data):
+    return struct.pack('>I', len(data)) + data
+
+
+def _pack_mpint(value):
+    if value == 0:
+        return _pack_string(b'')
+    data = value.to_bytes((value.bit_length() + 8) // 8, 'big')
+    return _pack_string(data)
+
+
+def _unpack_string(data, offset):
+    (length,) = struct.unpack_from('>I', data, offset)
+    offset += 4
+    if offset + length > len(data):
+        raise ValueError('Truncated agent message')
+    return data[offset:offset + length], offset + length
+
+
+def _recv_exactly(conn, length):
+    buf = bytearray(length)
+    view = memoryview(buf)
+    received = 0
+    while received < length:
+        count = conn.recv_into(view[received:])
+        if count == 0:
+            return None
+        received += count
+    return bytes(buf)
+
+
+class SSHAgent(object):
+    """
+    Serves one private key over the ssh-agent protocol until stopped.
+    """
+
+    def __init__(self, priv_key, pub_key, logger):
+        """
+        :param priv_key: Private key to serve
+        :type priv_key: cryptography.hazmat.primitives.asymmetric.rsa.RSAPrivateKey | \
+            cryptography.hazmat.primitives.asymmetric.ed25519.Ed25519PrivateKey | \
+            cryptography.hazmat.primitives.asymmetric.ec.EllipticCurvePrivateKey
+        :param pub_key: Matching public key in OpenSSH format
+        :type pub_key: basestring
+        :param logger: EC2 Instance Connect CLI logger to use for log messages
+        :type logger: ec2instanceconnectcli.EC2InstanceConnectLogger.EC2InstanceConnectLogger
+        """
+        self.priv_key = priv_key
+        self.pub_key = pub_key
+        self.key_blob = base64.b64decode(pub_key.split()[1])
+        self.logger = logger
+        self.sock = None
+        self.socket_dir = None
+
+    def start(self):
+        """
+        Creates the agent socket in a new 0700 temporary directory, alongside a copy of the public key that ssh can
+        use as IdentityFile to select the agent's key, and starts serving on a daemon thread.
+
+        :return: Path of the agent socket
+        :rtype: basestring
+        """
+        self.socket_dir = tempfile.mkdtemp(prefix='mssh-agent-')
+        with open(self.get_pub_key_file(), 'w') as f:
+            f.write(self.pub_key)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.get_socket_path())
+        self.sock.listen(5)
+
+        thread = threading.Thread(target=self._serve, name='ssh-agent')
+        thread.daemon = True
+        thread.start()
+        self.logger.debug('Serving the private key through ssh-agent socket {0}'.format(self.get_socket_path()))
+        return self.get_socket_path()
+
+    def stop(self):
+        """
+        Stops serving and removes the socket directory.
+        """
+        if self.sock is not None:
+            try:
+                # Wakes up the blocked accept() on Linux; close() alone does not
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+            self.sock = None
+        if self.socket_dir is not None:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
+            self.socket_dir = None
+
+    def get_socket_path(self):
+        return os.path.join(self.socket_dir, SOCKET_NAME)
+
+    def get_pub_key_file(self):
+        return os.path.join(self.socket_dir, PUB_KEY_NAME)
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except (OSError, AttributeError):
+                # Listening socket closed by stop()
+                return
+            thread = threading.Thread(target=self._handle_connection, args=(conn,), name='ssh-agent-conn')
+            thread.daemon = True
+            thread.start()
+
+    def _handle_connection(self, conn):
+        try:
+            while True:
+                header = _recv_exactly(conn, 4)
+                if header is None:
+                    return
+                (length,) = struct.unpack('>I', header)
+                if length == 0 or length > MAX_MESSAGE_LENGTH:
+                    return
+                message = _recv_exactly(conn, length)
+                if message is None:
+                    return
+                response = self.handle_message(message)
+                conn.sendall(struct.pack('>I', len(response)) + response)
+        except (OSError, ValueError, struct.error) as e:
+            self.logger.debug('ssh-agent connection failed: {0}'.format(str(e)))
+        finally:
+            conn.close()
+
+    def handle_message(self, message):
+        """
+        Handles one ssh-agent request.
+
+        :param message: Request message without its length prefix
+        :type message: bytes
+        :return: Response message without its length prefix
+        :rtype: bytes
+        """
+        message_type = message[0]
+        if message_type == SSH_AGENTC_REQUEST_IDENTITIES:
+            return (struct.pack('>BI', SSH_AGENT_IDENTITIES_ANSWER, 1) +
+                    _pack_string(self.key_blob) + _pack_string(b'ec2-instance-connect'))
+
+        if message_type == SSH_AGENTC_SIGN_REQUEST:
+            key_blob, offset = _unpack_string(message, 1)
+            data, offset = _unpack_string(message, offset)
+            (flags,) = struct.unpack_from('>I', message, offset)
+            if key_blob != self.key_blob:
+                return struct.pack('>B', SSH_AGENT_FAILURE)
+            return struct.pack('>B', SSH_AGENT_SIGN_RESPONSE) + _pack_string(self.sign(data, flags))
+
+        # Includes extensions such as session-bind@openssh.com, which ssh treats as optional
+        return struct.pack('>B', SSH_AGENT_FAILURE)
+
+    def sign(self, data, flags=0):
+        """
+        Signs data as requested by an SSH_AGENTC_SIGN_REQUEST.
+
+        :param data: Data to sign
+        :type data: bytes
+        :param flags: Request flags selecting the RSA signature algorithm
+        :type flags: int
+        :return: SSH signature blob
+        :rtype: bytes
+        """
+        # Imported here so that checking is_supported() doesn't load cryptography
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+        from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+
+        if isinstance(self.priv_key, ed25519.Ed25519PrivateKey):
+            return _pack_string(b'ssh-ed25519') + _pack_string(self.priv_key.sign(data))
+
+        if isinstance(self.priv_key, ec.EllipticCurvePrivateKey):
+            r, s = decode_dss_signature(self.priv_key.sign(data, ec.ECDSA(hashes.SHA256())))
+            return _pack_string(b'ecdsa-sha2-nistp256') + _pack_string(_pack_mpint(r) + _pack_mpint(s))
+
+        if isinstance(self.priv_key, rsa.RSAPrivateKey):
+            if flags & SSH_AGENT_RSA_SHA2_512:
+                algorithm, hash_alg = b'rsa-sha2-512', hashes.SHA512()
+            elif flags & SSH_AGENT_RSA_SHA2_256:
+                algorithm, hash_alg = b'rsa-sha2-256', hashes.SHA256()
+            else:
+                algorithm, hash_alg = b'ssh-rsa', hashes.SHA1()
+            return _pack_string(algorithm) + _pack_string(self.priv_key.sign(data, padding.PKCS1v15(), hash_alg))
+
+        raise AssertionError('Unsupported key type for ssh-agent signing')
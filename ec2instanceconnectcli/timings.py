@@ -0,0 +1,143 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+"""
+Phase timings of a CLI run.
+
+Spans are recorded with the monotonic clock once a report is requested, and cost nothing otherwise.  --timings prints
+them when the run ends and --timings-json writes them as JSON.
+"""
+
+import atexit
+import contextlib
+import json
+import sys
+import threading
+import time
+
+from ec2instanceconnectcli import __version__ as CLI_VERSION
+
+ORIGIN = time.monotonic()
+
+_spans = []
+_lock = threading.Lock()
+_report = {'text': False, 'json_path': None, 'emitted': False}
+
+
+def add_span(name, start, end, **attributes):
+    """
+    Records a span that has already finished
+
+    :param name: Phase name, e.g. 'describe_instances'
+    :type name: basestring
+    :param start: time.monotonic() at the start of the phase
+    :type start: float
+    :param end: time.monotonic() at the end of the phase
+    :type end: float
+    :param attributes: Extra details to report, e.g. instance_id
+    """
+    if not (_report['text'] or _report['json_path']):
+        return
+    with _lock:
+        _spans.append((name, start, end, attributes))
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """
+    Records the time spent in the context as a span, even if it raises
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        add_span(name, start, time.monotonic(), **attributes)
+
+
+def get_spans():
+    """
+    :return: Recorded spans in the order they started, as dicts with name, start_ms (since the package was imported),
+        duration_ms and any attributes
+    :rtype: list
+    """
+    with _lock:
+        spans = sorted(_spans, key=lambda recorded: recorded[1])
+    result = []
+    for name, start, end, attributes in spans:
+        entry = {'name': name, 'start_ms': round((start - ORIGIN) * 1000, 3),
+                 'duration_ms': round((end - start) * 1000, 3)}
+        if attributes:
+            entry['attributes'] = attributes
+        result.append(entry)
+    return result
+
+
+def clear():
+    """
+    Drops the recorded spans, e.g. between the requests served by a long-lived process
+    """
+    with _lock:
+        del _spans[:]
+
+
+def format_report(spans):
+    """
+    :param spans: Spans as returned by get_spans
+    :type spans: list
+    :return: Human readable table of the spans
+    :rtype: basestring
+    """
+    lines = ['{0:<32} {1:>12} {2:>14}'.format('phase', 'start (ms)', 'duration (ms)')]
+    for entry in spans:
+        name = entry['name']
+        if entry.get('attributes'):
+            name += ' ' + ' '.join('{0}={1}'.format(key, value) for key, value in sorted(entry['attributes'].items()))
+        lines.append('{0:<32} {1:>12.1f} {2:>14.1f}'.format(name, entry['start_ms'], entry['duration_ms']))
+    lines.append('{0:<32} {1:>12} {2:>14.1f}'.format('total', '', (time.monotonic() - ORIGIN) * 1000))
+    return '\n'.join(lines)
+
+
+def configure(text=False, json_path=None):
+    """
+    Selects what emit() produces, and has it run when the process exits.  Spans are only recorded from here on.
+
+    :param text: Print a report to stderr
+    :type text: bool
+    :param json_path: File to write the spans to as JSON
+    :type json_path: basestring
+    """
+    _report['text'] = text
+    _report['json_path'] = json_path
+    if text or json_path:
+        atexit.register(emit)
+
+
+def emit():
+    """
+    Produces the configured reports, once.  Called at the end of the run, or just before the CLI execs into ssh.
+    """
+    if _report['emitted'] or not (_report['text'] or _report['json_path']):
+        return
+    _report['emitted'] = True
+    spans = get_spans()
+    if _report['text']:
+        sys.stderr.write(format_report(spans) + '\n')
+        sys.stderr.flush()
+    if _report['json_path']:
+        document = {'version': CLI_VERSION, 'total_ms': round((time.monotonic() - ORIGIN) * 1000, 3),
+                    'spans': spans}
+        try:
+            with open(_report['json_path'], 'w') as f:
+                json.dump(document, f, indent=2)
+        except (IOError, OSError) as e:
+            sys.stderr.write('Failed to write timings to {0}: {1}\n'.format(_report['json_path'], str(e)))
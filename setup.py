@@ -33,7 +33,7 @@ setup_options = dict(
                      'and using them to connect to EC2 instances.',
     author='Amazon Web Services',
     url='https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/Connect-using-EC2-Instance-Connect.html',
-    scripts=['bin/mssh', 'bin/msftp', 'bin/mssh.cmd', 'bin/msftp.cmd',
+    scripts=['bin/mssh', 'bin/msftp', 'bin/mssh-proxy', 'bin/mssh.cmd', 'bin/msftp.cmd',
         'bin/mssh-putty.cmd', 'bin/msftp-putty.cmd'],
     packages=find_packages(exclude=['test']),
     package_data={},
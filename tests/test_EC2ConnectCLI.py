@@ -11,9 +11,19 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import unittest
+
+from ec2instanceconnectcli import mops, multiplex
 from ec2instanceconnectcli.EC2InstanceConnectCLI import EC2InstanceConnectCLI
 from ec2instanceconnectcli.EC2InstanceConnectCommand import EC2InstanceConnectCommand
 from ec2instanceconnectcli.EC2InstanceConnectLogger import EC2InstanceConnectLogger
+from ec2instanceconnectcli.instance_bundle import InstanceBundle
 from testloader.test_base import TestBase
 try:
     from unittest import mock
@@ -25,28 +35,27 @@ class TestEC2InstanceConnectCLI(TestBase):
 
     @mock.patch('ec2instanceconnectcli.EC2InstanceConnectCLI.EC2InstanceConnectCLI.run_command')
     @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
-    @mock.patch('ec2instanceconnectcli.ec2_util.get_instance_data')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
     def test_mssh_no_target(self,
                   mock_instance_data,
                   mock_push_key,
                   mock_run):
         mock_file = 'identity'
-        flag = '-f flag'
-        command = 'command arg'
+        flag = ['-f', 'flag']
+        command = ['command arg', '; rm -rf *']
         logger = EC2InstanceConnectLogger()
-        instance_bundles = [{'username': self.default_user, 'instance_id': self.instance_id,
-                            'target': None, 'zone': self.availability_zone, 'region': self.region,
-                            'profile': self.profile}]
+        instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                           zone=self.availability_zone, region=self.region, profile=self.profile)]
 
-        mock_instance_data.return_value = self.instance_info
+        mock_instance_data.return_value = {self.instance_id: self.instance_info}
         mock_push_key.return_value = None
 
         cli_command = EC2InstanceConnectCommand("ssh", instance_bundles, mock_file, flag, command, logger.get_logger())
         cli = EC2InstanceConnectCLI(instance_bundles, "", cli_command, logger.get_logger())
         cli.invoke_command()
         
-        expected_command = 'ssh -o "IdentitiesOnly=yes" -i {0} {1} {2}@{3} {4}'.format(mock_file, flag, self.default_user,
-                                                               self.public_ip, command)
+        expected_command = (['ssh', '-o', 'IdentitiesOnly=yes', '-i', mock_file] + flag +
+                            ['{0}@{1}'.format(self.default_user, self.public_ip)] + command)
 
         # Check that we successfully get to the run
         self.assertTrue(mock_instance_data.called)
@@ -56,28 +65,27 @@ class TestEC2InstanceConnectCLI(TestBase):
 
     @mock.patch('ec2instanceconnectcli.EC2InstanceConnectCLI.EC2InstanceConnectCLI.run_command')
     @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
-    @mock.patch('ec2instanceconnectcli.ec2_util.get_instance_data')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
     def test_mssh_no_target_no_public_ip(self,
                   mock_instance_data,
                   mock_push_key,
                   mock_run):
         mock_file = "identity"
-        flag = '-f flag'
-        command = 'command arg'
+        flag = ['-f', 'flag']
+        command = ['command arg', '; rm -rf *']
         logger = EC2InstanceConnectLogger()
-        instance_bundles = [{'username': self.default_user, 'instance_id': self.instance_id,
-                                     'target': None, 'zone': self.availability_zone, 'region': self.region,
-                                     'profile': self.profile}]
+        instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                           zone=self.availability_zone, region=self.region, profile=self.profile)]
 
-        mock_instance_data.return_value = self.private_instance_info
+        mock_instance_data.return_value = {self.instance_id: self.private_instance_info}
         mock_push_key.return_value = None
 
         cli_command = EC2InstanceConnectCommand("ssh", instance_bundles, mock_file, flag, command, logger.get_logger())
         cli = EC2InstanceConnectCLI(instance_bundles, "", cli_command, logger.get_logger())
         cli.invoke_command()
 
-        expected_command = 'ssh -o "IdentitiesOnly=yes" -i {0} {1} {2}@{3} {4}'.format(mock_file, flag, self.default_user,
-                                                               self.private_ip, command)
+        expected_command = (['ssh', '-o', 'IdentitiesOnly=yes', '-i', mock_file] + flag +
+                            ['{0}@{1}'.format(self.default_user, self.private_ip)] + command)
 
         # Check that we successfully get to the run
         self.assertTrue(mock_instance_data.called)
@@ -86,29 +94,28 @@ class TestEC2InstanceConnectCLI(TestBase):
 
     @mock.patch('ec2instanceconnectcli.EC2InstanceConnectCLI.EC2InstanceConnectCLI.run_command')
     @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
-    @mock.patch('ec2instanceconnectcli.ec2_util.get_instance_data')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
     def test_mssh_with_target(self,
                   mock_instance_data,
                   mock_push_key,
                   mock_run):
         mock_file = 'identity'
-        flag = '-f flag'
-        command = 'command arg'
+        flag = ['-f', 'flag']
+        command = ['command arg', '; rm -rf *']
         host = '0.0.0.0'
         logger = EC2InstanceConnectLogger()
-        instance_bundles = [{'username': self.default_user, 'instance_id': self.instance_id,
-                                     'target': host, 'zone': self.availability_zone, 'region': self.region,
-                                     'profile': self.profile}]
+        instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=host,
+                                           zone=self.availability_zone, region=self.region, profile=self.profile)]
 
-        mock_instance_data.return_value = self.instance_info
+        mock_instance_data.return_value = {self.instance_id: self.instance_info}
         mock_push_key.return_value = None
 
         cli_command = EC2InstanceConnectCommand("ssh", instance_bundles, mock_file, flag, command, logger.get_logger())
         cli = EC2InstanceConnectCLI(instance_bundles, "", cli_command, logger.get_logger())
         cli.invoke_command()
 
-        expected_command = 'ssh -o "IdentitiesOnly=yes" -i {0} {1} {2}@{3} {4}'.format(mock_file, flag, self.default_user,
-                                                               host, command)
+        expected_command = (['ssh', '-o', 'IdentitiesOnly=yes', '-i', mock_file] + flag +
+                            ['{0}@{1}'.format(self.default_user, host)] + command)
         # Check that we successfully get to the run
         # Since both target and availability_zone are provided, mock_instance_data should not be called
         self.assertFalse(mock_instance_data.called)
@@ -117,24 +124,24 @@ class TestEC2InstanceConnectCLI(TestBase):
 
     @mock.patch('ec2instanceconnectcli.EC2InstanceConnectCLI.EC2InstanceConnectCLI.run_command')
     @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
-    @mock.patch('ec2instanceconnectcli.ec2_util.get_instance_data')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
     def test_msftp(self,
                   mock_instance_data,
                   mock_push_key,
                   mock_run):
         mock_file = 'identity'
-        flag = '-f flag'
-        command = 'file2 file3'
+        flag = ['-f', 'flag']
+        command = ['file2', 'file3']
         logger = EC2InstanceConnectLogger()
-        instance_bundles = [{'username': self.default_user, 'instance_id': self.instance_id,
-                                     'target': None, 'zone': self.availability_zone, 'region': self.region,
-                                     'profile': self.profile, 'file': 'file1'}]
+        instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                           zone=self.availability_zone, region=self.region, profile=self.profile,
+                                           file='file1')]
 
-        mock_instance_data.return_value = self.instance_info
+        mock_instance_data.return_value = {self.instance_id: self.instance_info}
         mock_push_key.return_value = None
 
-        expected_command = 'sftp -o "IdentitiesOnly=yes" -i {0} {1} {2}@{3}:{4} {5}'.format(mock_file, flag, self.default_user,
-                                                               self.public_ip, 'file1', command)
+        expected_command = (['sftp', '-o', 'IdentitiesOnly=yes', '-i', mock_file] + flag +
+                            ['{0}@{1}:{2}'.format(self.default_user, self.public_ip, 'file1')] + command)
 
         cli_command = EC2InstanceConnectCommand("sftp", instance_bundles, mock_file, flag, command, logger.get_logger())
         cli = EC2InstanceConnectCLI(instance_bundles, "", cli_command, logger.get_logger())
@@ -147,41 +154,412 @@ class TestEC2InstanceConnectCLI(TestBase):
 
     @mock.patch('ec2instanceconnectcli.EC2InstanceConnectCLI.EC2InstanceConnectCLI.run_command')
     @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
-    @mock.patch('ec2instanceconnectcli.ec2_util.get_instance_data')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
     def test_mscp(self,
                    mock_instance_data,
                    mock_push_key,
                    mock_run):
         mock_file = 'identity'
-        flag = '-f flag'
-        command = 'file2 file3'
+        flag = ['-f', 'flag']
+        command = ['file2', 'file3']
         logger = EC2InstanceConnectLogger()
-        instance_bundles = [{'username': self.default_user, 'instance_id': self.instance_id,
-                                     'target': None, 'zone': self.availability_zone, 'region': self.region,
-                                     'profile': self.profile, 'file': 'file1'},
-                                    {'username': self.default_user, 'instance_id': self.instance_id,
-                                     'target': None, 'zone': self.availability_zone, 'region': self.region,
-                                     'profile': self.profile, 'file': 'file4'}]
-
-        mock_instance_data.return_value = self.instance_info
+        instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                           zone=self.availability_zone, region=self.region, profile=self.profile,
+                                           file='file1'),
+                            InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                           zone=self.availability_zone, region=self.region, profile=self.profile,
+                                           file='file4')]
+
+        mock_instance_data.return_value = {self.instance_id: self.instance_info}
         mock_push_key.return_value = None
 
-        expected_command = 'scp -o "IdentitiesOnly=yes" -i {0} {1} {2}@{3}:{4} {5} {6}@{7}:{8}'.format(mock_file, flag, self.default_user,
-                                                                                self.public_ip, 'file1', command,
-                                                                                self.default_user,
-                                                                                self.public_ip, 'file4')
+        expected_command = (['scp', '-o', 'IdentitiesOnly=yes', '-i', mock_file] + flag +
+                            ['{0}@{1}:{2}'.format(self.default_user, self.public_ip, 'file1')] + command +
+                            ['{0}@{1}:{2}'.format(self.default_user, self.public_ip, 'file4')])
 
         cli_command = EC2InstanceConnectCommand("scp", instance_bundles, mock_file, flag, command, logger.get_logger())
         cli = EC2InstanceConnectCLI(instance_bundles, "", cli_command, logger.get_logger())
         cli.invoke_command()
 
+        # Both bundles use the same profile and region, so they share one session
+        self.assertIs(instance_bundles[0]['session'], instance_bundles[1]['session'])
+        # and are looked up with a single batched call
+        self.assertEqual(mock_instance_data.call_count, 1)
+
         # Check that we successfully get to the run
         self.assertTrue(mock_instance_data.called)
         self.assertTrue(mock_push_key.called)
         mock_run.assert_called_with(expected_command)
 
+    @mock.patch('ec2instanceconnectcli.EC2InstanceConnectCLI.EC2InstanceConnectCLI.run_command')
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_mssh_identity_agent(self,
+                                 mock_instance_data,
+                                 mock_push_key,
+                                 mock_run):
+        pub_key_file = 'identity.pub'
+        agent_socket = '/tmp/agent.sock'
+        logger = EC2InstanceConnectLogger()
+        instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                           zone=self.availability_zone, region=self.region, profile=self.profile)]
+
+        mock_instance_data.return_value = {self.instance_id: self.instance_info}
+
+        cli_command = EC2InstanceConnectCommand("ssh", instance_bundles, pub_key_file, [], [], logger.get_logger(),
+                                                identity_agent=agent_socket)
+        cli = EC2InstanceConnectCLI(instance_bundles, "", cli_command, logger.get_logger())
+        cli.invoke_command()
+
+        expected_command = ['ssh', '-o', 'IdentitiesOnly=yes', '-i', pub_key_file,
+                            '-o', 'IdentityAgent={0}'.format(agent_socket),
+                            '{0}@{1}'.format(self.default_user, self.public_ip)]
+        mock_run.assert_called_with(expected_command)
+
+    @mock.patch('ec2instanceconnectcli.key_cache.store')
+    @mock.patch('ec2instanceconnectcli.key_cache.is_pushed')
+    @mock.patch('ec2instanceconnectcli.EC2InstanceConnectCLI.EC2InstanceConnectCLI.run_command')
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_mssh_reuses_pushed_key(self,
+                                    mock_instance_data,
+                                    mock_push_key,
+                                    mock_run,
+                                    mock_is_pushed,
+                                    mock_store):
+        logger = EC2InstanceConnectLogger()
+        instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                           zone=self.availability_zone, region=self.region, profile=self.profile)]
+
+        mock_instance_data.return_value = {self.instance_id: self.instance_info}
+        mock_is_pushed.return_value = True
+
+        cli_command = EC2InstanceConnectCommand("ssh", instance_bundles, 'identity', [], [], logger.get_logger())
+        cli = EC2InstanceConnectCLI(instance_bundles, "pub_key", cli_command, logger.get_logger(),
+                                    cache_priv_key="priv_key")
+        cli.invoke_command()
+
+        mock_is_pushed.assert_called_with(self.instance_id, self.default_user, self.profile, self.region, "pub_key")
+        self.assertFalse(mock_push_key.called)
+        self.assertFalse(mock_store.called)
+        self.assertTrue(mock_run.called)
+
+        mock_is_pushed.return_value = False
+        cli.invoke_command()
+
+        self.assertTrue(mock_push_key.called)
+        self.assertEqual(mock_store.call_args[0][:6], (self.instance_id, self.default_user, self.profile,
+                                                       self.region, "pub_key", "priv_key"))
+
+    @mock.patch('ec2instanceconnectcli.instance_cache.invalidate')
+    @mock.patch('ec2instanceconnectcli.instance_cache.put')
+    @mock.patch('ec2instanceconnectcli.instance_cache.get')
+    @mock.patch('ec2instanceconnectcli.EC2InstanceConnectCLI.EC2InstanceConnectCLI.run_command')
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_mssh_instance_cache(self,
+                                 mock_instance_data,
+                                 mock_push_key,
+                                 mock_run,
+                                 mock_cache_get,
+                                 mock_cache_put,
+                                 mock_invalidate):
+        logger = EC2InstanceConnectLogger()
+        instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                           zone=None, region=self.region, profile=self.profile)]
+
+        mock_cache_get.return_value = {self.instance_id: self.instance_info}
+        mock_run.return_value = 0
+
+        cli_command = EC2InstanceConnectCommand("ssh", instance_bundles, 'identity', [], [], logger.get_logger())
+        cli = EC2InstanceConnectCLI(instance_bundles, "", cli_command, logger.get_logger(), instance_cache_ttl=300)
+        cli.invoke_command()
+
+        mock_cache_get.assert_called_with(self.profile, self.region, [self.instance_id], 300)
+        self.assertFalse(mock_instance_data.called)
+        self.assertFalse(mock_cache_put.called)
+        self.assertEqual(instance_bundles[0]['zone'], self.availability_zone)
+        mock_run.assert_called_with(['ssh', '-o', 'IdentitiesOnly=yes', '-i', 'identity',
+                                     '{0}@{1}'.format(self.default_user, self.public_ip)])
+        self.assertFalse(mock_invalidate.called)
+
+        # ssh could not connect to the cached address
+        mock_run.return_value = 255
+        self.assertEqual(cli.invoke_command(), 255)
+        mock_invalidate.assert_called_with(self.profile, self.region, [self.instance_id])
+
+    @mock.patch('ec2instanceconnectcli.instance_cache.invalidate')
+    @mock.patch('ec2instanceconnectcli.instance_cache.put')
+    @mock.patch('ec2instanceconnectcli.instance_cache.get')
+    @mock.patch('ec2instanceconnectcli.EC2InstanceConnectCLI.EC2InstanceConnectCLI.run_command')
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_mssh_instance_cache_miss_and_push_failure(self,
+                                                       mock_instance_data,
+                                                       mock_push_key,
+                                                       mock_run,
+                                                       mock_cache_get,
+                                                       mock_cache_put,
+                                                       mock_invalidate):
+        logger = EC2InstanceConnectLogger()
+        instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                           zone=None, region=self.region, profile=self.profile)]
+
+        mock_cache_get.return_value = {}
+        mock_instance_data.return_value = {self.instance_id: self.instance_info}
+
+        cli_command = EC2InstanceConnectCommand("ssh", instance_bundles, 'identity', [], [], logger.get_logger())
+        cli = EC2InstanceConnectCLI(instance_bundles, "", cli_command, logger.get_logger(), instance_cache_ttl=300)
+        cli.invoke_command()
+
+        self.assertTrue(mock_instance_data.called)
+        mock_cache_put.assert_called_with(self.profile, self.region, {self.instance_id: self.instance_info}, 300)
+
+        # The cached zone is stale and the push is rejected
+        mock_cache_get.return_value = {self.instance_id: self.instance_info}
+        mock_push_key.side_effect = SystemExit(1)
+        cli = EC2InstanceConnectCLI(instance_bundles, "", cli_command, logger.get_logger(), instance_cache_ttl=300)
+        with self.assertRaises(SystemExit):
+            cli.invoke_command()
+        mock_invalidate.assert_called_with(self.profile, self.region, [self.instance_id])
+
+    @mock.patch('ec2instanceconnectcli.region_discovery.forget')
+    @mock.patch('ec2instanceconnectcli.region_discovery.remember')
+    @mock.patch('ec2instanceconnectcli.region_discovery.lookup')
+    @mock.patch('ec2instanceconnectcli.region_discovery.discover')
+    @mock.patch('ec2instanceconnectcli.EC2InstanceConnectCLI.EC2InstanceConnectCLI.run_command')
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_mssh_region_discovery(self,
+                                   mock_instance_data,
+                                   mock_push_key,
+                                   mock_run,
+                                   mock_discover,
+                                   mock_lookup,
+                                   mock_remember,
+                                   mock_forget):
+        logger = EC2InstanceConnectLogger()
+        regions = ['eu-west-1', 'us-west-2']
+
+        def new_cli():
+            instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                               zone=None, region=None, profile=self.profile)]
+            cli_command = EC2InstanceConnectCommand("ssh", instance_bundles, 'identity', [], [], logger.get_logger())
+            return EC2InstanceConnectCLI(instance_bundles, "", cli_command, logger.get_logger(), regions=regions)
+
+        mock_lookup.return_value = None
+        mock_discover.return_value = ('eu-west-1', self.instance_info)
+        mock_run.return_value = 0
+        cli = new_cli()
+        cli.invoke_command()
+
+        self.assertEqual(mock_discover.call_args[0][1:], (self.instance_id, regions))
+        # The probe already described the instance
+        self.assertFalse(mock_instance_data.called)
+        self.assertEqual(cli.instance_bundles[0]['region'], 'eu-west-1')
+        self.assertEqual(cli.instance_bundles[0]['session'].get_config_variable('region'), 'eu-west-1')
+        mock_remember.assert_called_with(self.profile, self.instance_id, 'eu-west-1')
+        mock_run.assert_called_with(['ssh', '-o', 'IdentitiesOnly=yes', '-i', 'identity',
+                                     '{0}@{1}'.format(self.default_user, self.public_ip)])
+
+        # The cached region is used without probing
+        mock_discover.reset_mock()
+        mock_lookup.return_value = 'eu-west-1'
+        mock_instance_data.return_value = {self.instance_id: self.instance_info}
+        cli = new_cli()
+        cli.invoke_command()
+
+        self.assertFalse(mock_discover.called)
+        self.assertEqual(mock_instance_data.call_args[0][0].get_config_variable('region'), 'eu-west-1')
+
+        # The instance is gone from its cached region
+        mock_instance_data.side_effect = SystemExit(1)
+        with self.assertRaises(SystemExit):
+            new_cli().invoke_command()
+        mock_forget.assert_called_with(self.profile, self.instance_id)
+
+    @mock.patch('ec2instanceconnectcli.region_discovery.discover')
+    def test_mssh_region_discovery_not_found(self, mock_discover):
+        logger = EC2InstanceConnectLogger()
+        instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                           zone=None, region=None, profile=self.profile)]
+        mock_discover.return_value = None
+
+        cli = EC2InstanceConnectCLI(instance_bundles, "", None, logger.get_logger(), regions=['eu-west-1'])
+        with mock.patch('ec2instanceconnectcli.region_discovery.lookup', return_value=None):
+            with self.assertRaises(SystemExit):
+                cli.create_sessions()
+
+    @mock.patch('os.execvp')
+    @mock.patch('ec2instanceconnectcli.EC2InstanceConnectCLI.EC2InstanceConnectCLI.run_command')
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_mssh_replace_process(self,
+                                  mock_instance_data,
+                                  mock_push_key,
+                                  mock_run,
+                                  mock_exec):
+        logger = EC2InstanceConnectLogger()
+        instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                           zone=self.availability_zone, region=self.region, profile=self.profile)]
+
+        mock_instance_data.return_value = {self.instance_id: self.instance_info}
+
+        cli_command = EC2InstanceConnectCommand("ssh", instance_bundles, '/dev/fd/3', [], [], logger.get_logger())
+        cli = EC2InstanceConnectCLI(instance_bundles, "", cli_command, logger.get_logger(), replace_process=True)
+        cli.invoke_command()
+
+        expected_command = ['ssh', '-o', 'IdentitiesOnly=yes', '-i', '/dev/fd/3',
+                            '{0}@{1}'.format(self.default_user, self.public_ip)]
+        mock_exec.assert_called_with('ssh', expected_command)
+
+    @mock.patch('ec2instanceconnectcli.address_race.network_location')
+    @mock.patch('ec2instanceconnectcli.address_race.race')
+    @mock.patch('ec2instanceconnectcli.EC2InstanceConnectCLI.EC2InstanceConnectCLI.run_command')
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_mssh_address_race(self,
+                               mock_instance_data,
+                               mock_push_key,
+                               mock_run,
+                               mock_race,
+                               mock_location):
+        logger = EC2InstanceConnectLogger()
+
+        def new_cli():
+            instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                               zone=self.availability_zone, region=self.region, profile=self.profile)]
+            cli_command = EC2InstanceConnectCommand("ssh", instance_bundles, 'identity', [], [], logger.get_logger())
+            return EC2InstanceConnectCLI(instance_bundles, "", cli_command, logger.get_logger(), race_port=2222)
+
+        mock_instance_data.return_value = {self.instance_id: self.instance_info}
+        mock_location.return_value = '10.0.0.5'
+        # Inside the VPC the private address answers first
+        mock_race.return_value = self.private_ip
+        mock_run.return_value = 0
+        cli = new_cli()
+        cli.invoke_command()
+        mock_race.assert_called_with([self.private_ip, self.public_ip], 2222)
+        self.assertEqual(cli.instance_bundles[0]['host_info'], self.private_ip)
+
+        # The winner is remembered for this network
+        mock_race.reset_mock()
+        mock_run.return_value = 255
+        cli = new_cli()
+        self.assertEqual(cli.invoke_command(), 255)
+        self.assertFalse(mock_race.called)
+        self.assertEqual(cli.instance_bundles[0]['host_info'], self.private_ip)
+
+        # ...until ssh cannot connect to it
+        mock_race.return_value = None
+        cli = new_cli()
+        cli.invoke_command()
+        self.assertTrue(mock_race.called)
+        self.assertEqual(cli.instance_bundles[0]['host_info'], self.public_ip)
+
+    @unittest.skipUnless(multiplex.is_supported(), 'requires Unix domain sockets')
+    @mock.patch('ec2instanceconnectcli.EC2InstanceConnectCLI.EC2InstanceConnectCLI.run_command')
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_mssh_multiplex(self,
+                            mock_instance_data,
+                            mock_push_key,
+                            mock_run):
+        logger = EC2InstanceConnectLogger()
+
+        def new_cli():
+            instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                               zone=self.availability_zone, region=self.region, profile=self.profile)]
+            cli_command = EC2InstanceConnectCommand("ssh", instance_bundles, 'identity', [], [], logger.get_logger(),
+                                                    control_persist=600)
+            return EC2InstanceConnectCLI(instance_bundles, "", cli_command, logger.get_logger())
+
+        mock_instance_data.return_value = {self.instance_id: self.instance_info}
+        mock_run.return_value = 0
+        cli = new_cli()
+        control_path = cli.cli_command.get_control_path(cli.instance_bundles[0])
+        expected_command = ['ssh', '-o', 'IdentitiesOnly=yes', '-i', 'identity', '-o', 'ControlMaster=auto',
+                            '-o', 'ControlPath={0}'.format(control_path), '-o', 'ControlPersist=600',
+                            '{0}@{1}'.format(self.default_user, self.public_ip)]
+
+        # No master yet: the instance is looked up and the key pushed as usual
+        cli.invoke_command()
+        self.assertTrue(mock_instance_data.called)
+        self.assertTrue(mock_push_key.called)
+        mock_run.assert_called_with(expected_command)
+
+        # ssh left a master listening on the control path
+        master = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(master.close)
+        master.bind(control_path)
+        master.listen(1)
+        mock_instance_data.reset_mock()
+        mock_push_key.reset_mock()
+
+        new_cli().invoke_command()
+        self.assertFalse(mock_instance_data.called)
+        self.assertFalse(mock_push_key.called)
+        mock_run.assert_called_with(expected_command)
+
+        # mssh checks for the master before generating a key, and connects over it without one
+        with mock.patch('ec2instanceconnectcli.mops.EC2InstanceConnectKey') as mock_key:
+            instance_bundles = [InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None,
+                                               zone=None, region=self.region, profile=self.profile)]
+            self.assertEqual(mops._reuse_master('ssh', instance_bundles, [], [], logger.get_logger(), 600, False), 0)
+        self.assertFalse(mock_key.called)
+        self.assertFalse(mock_instance_data.called)
+        mock_run.assert_called_with(['ssh', '-o', 'ControlMaster=auto', '-o', 'ControlPath={0}'.format(control_path),
+                                     '-o', 'ControlPersist=600', '{0}@{1}'.format(self.default_user, self.public_ip)])
+
+        master.close()
+        os.unlink(control_path)
+        self.assertIsNone(mops._reuse_master('ssh', instance_bundles, [], [], logger.get_logger(), 600, False))
+
     def test_status_code(self):
-        #TODO: Refine test for checking run_command status code
         cli = EC2InstanceConnectCLI(None, None, None, None)
-        code = cli.run_command("echo ok; exit -1;")
+        code = cli.run_command([sys.executable, '-c', 'print("ok"); raise SystemExit(255)'])
         self.assertEqual(code, 255)
+
+    @unittest.skipUnless(os.name == 'posix', 'requires sh')
+    def test_exit_noticed_promptly(self):
+        cli = EC2InstanceConnectCLI(None, None, None, None)
+        start = time.monotonic()
+        code = cli.run_command(['sh', '-c', 'exit 3'])
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(code, 3)
+        # The old 100 ms poll loop could not notice an exit this quickly
+        self.assertLess(elapsed, 0.05)
+
+    @unittest.skipUnless(hasattr(signal, 'SIGTERM') and os.name == 'posix', 'requires POSIX signals')
+    def test_signal_forwarded_to_child(self):
+        cli = EC2InstanceConnectCLI(None, None, None, None)
+        previous_handler = signal.getsignal(signal.SIGTERM)
+        timer = threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM))
+        timer.start()
+        start = time.monotonic()
+        code = cli.run_command(['sleep', '10'])
+        timer.join()
+
+        self.assertEqual(code, 128 + signal.SIGTERM)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(signal.getsignal(signal.SIGTERM), previous_handler)
+
+    @unittest.skipUnless(hasattr(signal, 'SIGINT') and os.name == 'posix', 'requires POSIX signals')
+    @mock.patch('ec2instanceconnectcli.EC2InstanceConnectCLI._in_terminal_foreground', return_value=True)
+    def test_terminal_signal_not_forwarded_twice(self, mock_foreground):
+        cli = EC2InstanceConnectCLI(None, None, None, None)
+        previous_handler = signal.getsignal(signal.SIGINT)
+        # The terminal signals the child itself; the CLI must neither relay it nor be interrupted
+        timer = threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGINT))
+        timer.start()
+        code = cli.run_command(['sh', '-c', 'sleep 0.5; exit 3'])
+        timer.join()
+
+        self.assertEqual(code, 3)
+        self.assertEqual(signal.getsignal(signal.SIGINT), previous_handler)
+
+    def test_render_command(self):
+        rendered = EC2InstanceConnectCommand.render_command(['ssh', '-i', 'identity', 'host', 'echo "a b"; ls'])
+
+        self.assertEqual(rendered, 'ssh -i identity host \'echo "a b"; ls\'')
@@ -0,0 +1,54 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import stat
+import unittest
+
+from ec2instanceconnectcli.EC2InstanceConnectKey import EC2InstanceConnectKey, fd_delivery_supported
+from ec2instanceconnectcli.EC2InstanceConnectLogger import EC2InstanceConnectLogger
+from testloader.test_base import TestBase
+
+
+class TestEC2InstanceConnectKey(TestBase):
+
+    def test_file_delivery(self):
+        key = EC2InstanceConnectKey(EC2InstanceConnectLogger().get_logger(), key_type='ed25519')
+        key_file = key.get_priv_key_file()
+
+        with open(key_file) as f:
+            self.assertEqual(f.read(), key.get_priv_key())
+        self.assertEqual(stat.S_IMODE(os.stat(key_file).st_mode), 0o600)
+        self.assertEqual(key.get_identity_file(), key_file)
+        self.assertIsNone(key.get_identity_agent())
+
+        del key
+        self.assertFalse(os.path.exists(key_file))
+
+    def test_key_pair(self):
+        key = EC2InstanceConnectKey(EC2InstanceConnectLogger().get_logger(), key_pair=('pub_key', 'priv_key'))
+
+        self.assertEqual(key.get_pub_key(), 'pub_key')
+        with open(key.get_priv_key_file()) as f:
+            self.assertEqual(f.read(), 'priv_key')
+
+    @unittest.skipUnless(fd_delivery_supported(), 'requires /dev/fd')
+    def test_memfd_delivery(self):
+        key = EC2InstanceConnectKey(EC2InstanceConnectLogger().get_logger(), key_type='ed25519', delivery='memfd')
+        key_file = key.get_priv_key_file()
+
+        self.assertTrue(key_file.startswith('/dev/fd/'))
+        self.assertTrue(os.get_inheritable(key.key_fd))
+        self.assertEqual(stat.S_IMODE(os.fstat(key.key_fd).st_mode), 0o600)
+        with open(key_file) as f:
+            self.assertEqual(f.read(), key.get_priv_key())
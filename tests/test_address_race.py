@@ -0,0 +1,119 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+from argparse import Namespace
+import socket
+import threading
+import time
+
+from ec2instanceconnectcli import address_race
+from testloader.test_base import TestBase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+create_connection = socket.create_connection
+
+
+class TestCandidates(TestBase):
+
+    def test_addresses_in_order_of_preference(self):
+        instance_info = Namespace(public_dns_name=self.public_dns_name, private_dns_name=self.private_dns_name,
+                                  public_ip=self.public_ip, private_ip=self.private_ip,
+                                  ipv6_addresses=['2600:1f14::1'], availability_zone=self.availability_zone)
+
+        self.assertEqual(address_race.get_candidates(instance_info), [self.private_ip, '2600:1f14::1', self.public_ip])
+
+    def test_dns_names_without_addresses(self):
+        # As cached by older versions, without IPv6 addresses
+        instance_info = Namespace(public_dns_name=self.public_dns_name, private_dns_name=self.private_dns_name,
+                                  public_ip=None, private_ip=None, availability_zone=self.availability_zone)
+
+        self.assertEqual(address_race.get_candidates(instance_info), [self.private_dns_name, self.public_dns_name])
+
+
+class TestRoutesThroughProxy(TestBase):
+
+    def test_routes_through_proxy(self):
+        for flags in (['-J', 'bastion'], ['-Jbastion'], ['-o', 'ProxyJump=bastion'], ['-oproxyjump bastion'],
+                      ['-p', '2222', '-o', 'ProxyCommand=ssh -W %h:%p bastion']):
+            self.assertTrue(address_race.routes_through_proxy(flags), flags)
+        for flags in ([], ['-p', '2222'], ['-o', 'ProxyJump=none'], ['-o', 'StrictHostKeyChecking=no']):
+            self.assertFalse(address_race.routes_through_proxy(flags), flags)
+
+
+class TestRace(TestBase):
+
+    def setUp(self):
+        super(TestRace, self).setUp()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(8)
+        self.port = self.server.getsockname()[1]
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.server.close()
+
+    def _create_connection(self, address, timeout=None):
+        host, port = address
+        if host == 'hangs':
+            self.release.wait(timeout)
+            raise socket.timeout()
+        if host == 'refuses':
+            raise ConnectionRefusedError()
+        return create_connection(address, timeout=timeout)
+
+    def test_failure_starts_next_attempt_at_once(self):
+        with mock.patch('socket.create_connection', side_effect=self._create_connection):
+            start = time.monotonic()
+            winner = address_race.race(['refuses', '127.0.0.1'], self.port, stagger=10)
+
+        self.assertEqual(winner, '127.0.0.1')
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_hanging_address_loses_after_stagger(self):
+        with mock.patch('socket.create_connection', side_effect=self._create_connection):
+            start = time.monotonic()
+            winner = address_race.race(['hangs', '127.0.0.1'], self.port, stagger=0.05)
+
+        self.assertEqual(winner, '127.0.0.1')
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_nothing_reachable(self):
+        with mock.patch('socket.create_connection', side_effect=self._create_connection):
+            self.assertIsNone(address_race.race(['refuses', 'hangs'], self.port, stagger=0.01, timeout=0.2))
+
+
+class TestAddressCache(TestBase):
+
+    def test_remember_and_forget(self):
+        candidates = [self.public_ip, self.private_ip]
+        address_race.remember('10.0.0.5', self.instance_id, self.private_ip)
+
+        self.assertEqual(address_race.lookup('10.0.0.5', self.instance_id, candidates), self.private_ip)
+        # Another network races again
+        self.assertIsNone(address_race.lookup('192.168.1.20', self.instance_id, candidates))
+        # The instance no longer has that address
+        self.assertIsNone(address_race.lookup('10.0.0.5', self.instance_id, [self.public_ip]))
+
+        address_race.forget('10.0.0.5', self.instance_id)
+        self.assertIsNone(address_race.lookup('10.0.0.5', self.instance_id, candidates))
+
+    def test_entries_expire(self):
+        with mock.patch('time.time', return_value=1000):
+            address_race.remember('10.0.0.5', self.instance_id, self.private_ip)
+        with mock.patch('time.time', return_value=1000 + address_race.MAX_AGE_SECONDS):
+            self.assertIsNone(address_race.lookup('10.0.0.5', self.instance_id, [self.private_ip]))
@@ -0,0 +1,147 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import io
+import sys
+import threading
+import time
+
+from ec2instanceconnectcli.async_engine import AsyncEngine
+from ec2instanceconnectcli.EC2InstanceConnectLogger import EC2InstanceConnectLogger
+from ec2instanceconnectcli.fleet import PrefixedOutput
+from testloader.test_base import TestBase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class FakeCLI(object):
+    """
+    Stands in for EC2InstanceConnectCLI, recording when each stage ran
+    """
+
+    def __init__(self, events, label, lookup_delay, command, live_master=False):
+        self.events = events
+        self.label = label
+        self.lookup_delay = lookup_delay
+        self.live_master = live_master
+        self.cli_command = mock.Mock()
+        self.cli_command.get_command.return_value = command
+
+    def reuse_master(self):
+        return self.live_master
+
+    def create_sessions(self):
+        pass
+
+    def call_ec2(self):
+        time.sleep(self.lookup_delay)
+        self.events.append((self.label, 'lookup'))
+
+    def handle_keys(self):
+        self.events.append((self.label, 'push'))
+
+    def command_finished(self, returncode):
+        return returncode
+
+
+class TestAsyncEngine(TestBase):
+
+    def setUp(self):
+        super(TestAsyncEngine, self).setUp()
+        self.output = PrefixedOutput(io.BytesIO(), io.BytesIO())
+        self.engine = AsyncEngine(EC2InstanceConnectLogger().get_logger(), self.output, 2)
+
+    def test_connect_streams_prefixed_output(self):
+        command = [sys.executable, '-c', 'import sys; print("one"); print("two"); sys.stderr.write("err"); '
+                                         'sys.exit(3 if sys.stdin.read() == "" else 0)']
+        cli = FakeCLI([], 'i-1', 0, command)
+
+        self.assertEqual(self.engine.run([('i-1', cli)]), [3])
+        self.assertEqual(self.output.stdout.getvalue(), b'[i-1] one\n[i-1] two\n')
+        self.assertEqual(self.output.stderr.getvalue(), b'[i-1] err\n[i-1] exited with status 3\n')
+
+    def test_long_lines_are_split(self):
+        command = [sys.executable, '-c', 'print("x" * 200000)']
+
+        self.assertEqual(self.engine.run([('i-1', FakeCLI([], 'i-1', 0, command))]), [0])
+        lines = self.output.stdout.getvalue().splitlines()
+        self.assertTrue(len(lines) > 1)
+        self.assertEqual(sum(len(line) - len(b'[i-1] ') for line in lines), 200000)
+
+    def test_hosts_move_through_stages_independently(self):
+        events = []
+        command = [sys.executable, '-c', '']
+        hosts = [('slow', FakeCLI(events, 'slow', 0.2, command)), ('fast', FakeCLI(events, 'fast', 0, command))]
+
+        self.assertEqual(self.engine.run(hosts), [0, 0])
+        # The fast host's push does not wait for the slow host's lookup
+        self.assertTrue(events.index(('fast', 'push')) < events.index(('slow', 'lookup')))
+
+    def test_hosts_are_consumed_lazily(self):
+        created = []
+        in_flight = []
+        peak = [0]
+        lock = threading.Lock()
+
+        class CountingCLI(FakeCLI):
+            def call_ec2(self):
+                with lock:
+                    in_flight.append(self.label)
+                    peak[0] = max(peak[0], len(in_flight))
+                time.sleep(0.01)
+
+            def handle_keys(self):
+                with lock:
+                    in_flight.remove(self.label)
+
+        def hosts():
+            for i in range(8):
+                created.append(i)
+                # Never more than the concurrency limit plus the one being created
+                self.assertTrue(len(created) <= len(results) + 3)
+                yield str(i), CountingCLI([], str(i), 0, [sys.executable, '-c', ''])
+
+        results = []
+        original_run_host = self.engine.run_host
+
+        async def run_host(label, cli, executor):
+            returncode = await original_run_host(label, cli, executor)
+            results.append(returncode)
+            return returncode
+
+        with mock.patch.object(self.engine, 'run_host', run_host):
+            self.assertEqual(self.engine.run(hosts()), [0] * 8)
+        self.assertEqual(peak[0], 2)
+
+    def test_stage_exit_fails_only_that_host(self):
+        command = [sys.executable, '-c', '']
+
+        class FailingCLI(FakeCLI):
+            def call_ec2(self):
+                sys.exit(7)
+
+        hosts = [('bad', FailingCLI([], 'bad', 0, command)), ('good', FakeCLI([], 'good', 0, command))]
+
+        self.assertEqual(sorted(self.engine.run(hosts)), [0, 7])
+        self.assertEqual(self.output.stderr.getvalue(), b'[bad] exited with status 7\n')
+
+    def test_live_master_skips_lookup_and_push(self):
+        events = []
+        command = [sys.executable, '-c', '']
+        hosts = [('warm', FakeCLI(events, 'warm', 0, command, live_master=True)),
+                 ('cold', FakeCLI(events, 'cold', 0, command))]
+
+        self.assertEqual(self.engine.run(hosts), [0, 0])
+        self.assertEqual(events, [('cold', 'lookup'), ('cold', 'push')])
@@ -0,0 +1,69 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+from ec2instanceconnectcli.client_cache import ClientCache
+from testloader.test_base import TestBase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class TestClientCache(TestBase):
+
+    @staticmethod
+    def _make_session(**kwargs):
+        session = mock.Mock()
+        session.create_client.side_effect = lambda service_name, config=None, region_name=None: mock.Mock()
+        return session
+
+    def setUp(self):
+        super(TestClientCache, self).setUp()
+        self.session_factory = mock.Mock(side_effect=self._make_session)
+        self.cache = ClientCache(self.session_factory)
+
+    def test_sessions_shared_per_profile_and_region(self):
+        session = self.cache.get_session(profile_name=self.profile, region=self.region)
+
+        self.assertIs(self.cache.get_session(profile_name=self.profile, region=self.region), session)
+        self.assertIsNot(self.cache.get_session(profile_name=self.profile, region=self.new_region), session)
+        self.assertIsNot(self.cache.get_session(profile_name=self.new_profile, region=self.region), session)
+        self.assertEqual(self.session_factory.call_count, 3)
+        self.session_factory.assert_any_call(profile_name=self.profile, region=self.region)
+
+    def test_clients_shared_per_service(self):
+        session = self.cache.get_session(profile_name=self.profile, region=self.region)
+
+        ec2 = self.cache.get_client(session, 'ec2')
+
+        self.assertIs(self.cache.get_client(session, 'ec2'), ec2)
+        self.assertIsNot(self.cache.get_client(session, 'ec2-instance-connect'), ec2)
+        self.assertEqual(session.create_client.call_count, 2)
+
+    def test_clients_shared_per_region(self):
+        session = self.cache.get_session(profile_name=self.profile)
+
+        ec2 = self.cache.get_client(session, 'ec2', region_name=self.region)
+
+        self.assertIs(self.cache.get_client(session, 'ec2', region_name=self.region), ec2)
+        self.assertIsNot(self.cache.get_client(session, 'ec2', region_name=self.new_region), ec2)
+        self.assertIsNot(self.cache.get_client(session, 'ec2'), ec2)
+        session.create_client.assert_any_call('ec2', config=None, region_name=self.new_region)
+
+    def test_foreign_session_not_cached(self):
+        session = mock.Mock()
+
+        self.cache.get_client(session, 'ec2')
+        self.cache.get_client(session, 'ec2')
+
+        self.assertEqual(session.create_client.call_count, 2)
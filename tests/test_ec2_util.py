@@ -138,3 +138,137 @@ class TestEC2Util(TestBase):
             ec2_util.get_instance_data(mock_session, self.instance_id)
             mock_boto_client.describe_instances.assert_called_with(InstanceIds=[self.instance_id])
         self.assertEqual(context.exception.code, 8)
+
+    def test_ipv6_addresses(self):
+        instance = {
+            'InstanceId': self.instance_id,
+            'Placement': {
+                'AvailabilityZone': self.availability_zone,
+            },
+            'Ipv6Address': '2600:1f14::1',
+            'NetworkInterfaces': [
+                {'Ipv6Addresses': [{'Ipv6Address': '2600:1f14::1'}, {'Ipv6Address': '2600:1f14::2'}]},
+                {'Ipv6Addresses': []},
+            ],
+        }
+
+        mock_session = mock.Mock()
+        mock_boto_client = mock.Mock()
+        mock_session.create_client.return_value = mock_boto_client
+        mock_boto_client.describe_instances.return_value = {'Reservations': [{'Instances': [instance]}]}
+
+        # An IPv6-only instance is reachable
+        instance_info = ec2_util.get_instance_data(mock_session, self.instance_id)
+        self.assertEqual(instance_info.ipv6_addresses, ['2600:1f14::1', '2600:1f14::2'])
+        self.assertIsNone(instance_info.public_ip)
+
+    def _instance(self, instance_id, public_ip):
+        return {
+            'InstanceId': instance_id,
+            'Placement': {
+                'AvailabilityZone': self.availability_zone,
+            },
+            'PublicIpAddress': public_ip,
+            'PrivateIpAddress': self.private_ip
+        }
+
+    def test_get_instances_data(self):
+        other_instance_id = 'i-1234abcd'
+        mock_session = mock.Mock()
+        mock_boto_client = mock.Mock()
+        mock_session.create_client.return_value = mock_boto_client
+        mock_boto_client.describe_instances.side_effect = [
+            {'Reservations': [{'Instances': [self._instance(other_instance_id, '21.0.0.11')]}], 'NextToken': 'token'},
+            {'Reservations': [{'Instances': [self._instance(self.instance_id, self.public_ip)]}]},
+        ]
+
+        instance_infos = ec2_util.get_instances_data(mock_session, [self.instance_id, other_instance_id,
+                                                                    self.instance_id])
+
+        mock_boto_client.describe_instances.assert_has_calls([
+            mock.call(InstanceIds=[self.instance_id, other_instance_id]),
+            mock.call(InstanceIds=[self.instance_id, other_instance_id], NextToken='token')])
+        self.assertEqual(instance_infos[self.instance_id].public_ip, self.public_ip)
+        self.assertEqual(instance_infos[other_instance_id].public_ip, '21.0.0.11')
+
+    @mock.patch('ec2instanceconnectcli.ec2_util.MAX_INSTANCE_IDS_PER_CALL', 1)
+    def test_get_instances_data_chunked(self):
+        other_instance_id = 'i-1234abcd'
+        mock_session = mock.Mock()
+        mock_boto_client = mock.Mock()
+        mock_session.create_client.return_value = mock_boto_client
+        mock_boto_client.describe_instances.side_effect = [
+            {'Reservations': [{'Instances': [self._instance(self.instance_id, self.public_ip)]}]},
+            {'Reservations': [{'Instances': [self._instance(other_instance_id, '21.0.0.11')]}]},
+        ]
+
+        instance_infos = ec2_util.get_instances_data(mock_session, [self.instance_id, other_instance_id])
+
+        self.assertEqual(mock_boto_client.describe_instances.call_count, 2)
+        self.assertEqual(sorted(instance_infos), sorted([self.instance_id, other_instance_id]))
+
+    def test_get_instances_data_missing_instance(self):
+        mock_session = mock.Mock()
+        mock_boto_client = mock.Mock()
+        mock_session.create_client.return_value = mock_boto_client
+        mock_boto_client.describe_instances.return_value = {
+            'Reservations': [{'Instances': [self._instance(self.instance_id, self.public_ip)]}]}
+
+        with self.assertRaises(SystemExit) as context:
+            ec2_util.get_instances_data(mock_session, [self.instance_id, 'i-1234abcd'])
+        self.assertEqual(context.exception.code, 1)
+
+    def test_iter_instances_pages_through_filters(self):
+        def instance(instance_id, ip):
+            return {'InstanceId': instance_id, 'Placement': {'AvailabilityZone': self.availability_zone},
+                    'PrivateIpAddress': ip}
+
+        mock_session = mock.Mock()
+        mock_boto_client = mock.Mock()
+        mock_session.create_client.return_value = mock_boto_client
+        mock_boto_client.describe_instances.side_effect = [
+            {'Reservations': [{'Instances': [instance('i-1', '10.0.0.1'), instance('i-2', None)]}],
+             'NextToken': 'page2'},
+            {'Reservations': [{'Instances': [instance('i-3', '10.0.0.3')]}]},
+        ]
+        filters = [{'Name': 'tag:Role', 'Values': ['web']}]
+
+        instances = ec2_util.iter_instances(mock_session, filters)
+        with mock.patch('sys.stdout') as mock_stdout, \
+                mock.patch('ec2instanceconnectcli.ec2_util.logging.getLogger') as mock_get_logger:
+            instance_id, instance_info = next(instances)
+
+            # Later pages are only fetched when needed
+            self.assertEqual(instance_id, 'i-1')
+            self.assertEqual(instance_info.private_ip, '10.0.0.1')
+            self.assertEqual(mock_boto_client.describe_instances.call_count, 1)
+
+            remaining = [instance_id for instance_id, _ in instances]
+
+        # Instances without any address are skipped, and logged rather than mixed into fleet output on stdout
+        self.assertEqual(remaining, ['i-3'])
+        mock_get_logger.return_value.error.assert_called_with('No hostname or IPs found for i-2, skipping')
+        self.assertFalse(mock_stdout.write.called)
+        mock_boto_client.describe_instances.assert_called_with(
+            Filters=filters + [ec2_util.RUNNING_FILTER], MaxResults=ec2_util.MAX_RESULTS_PER_PAGE, NextToken='page2')
+
+    def test_iter_instances_keeps_state_filter(self):
+        mock_session = mock.Mock()
+        mock_boto_client = mock.Mock()
+        mock_session.create_client.return_value = mock_boto_client
+        mock_boto_client.describe_instances.return_value = {'Reservations': []}
+        filters = [{'Name': 'instance-state-name', 'Values': ['stopped']}]
+
+        self.assertEqual(list(ec2_util.iter_instances(mock_session, filters)), [])
+        mock_boto_client.describe_instances.assert_called_with(Filters=filters,
+                                                               MaxResults=ec2_util.MAX_RESULTS_PER_PAGE)
+
+    def test_iter_instances_raises_errors(self):
+        mock_session = mock.Mock()
+        mock_boto_client = mock.Mock()
+        mock_session.create_client.return_value = mock_boto_client
+        mock_boto_client.describe_instances.side_effect = Exception('AuthFailure')
+
+        with self.assertRaises(Exception) as context:
+            list(ec2_util.iter_instances(mock_session, [{'Name': 'tag:Role', 'Values': ['web']}]))
+        self.assertEqual(str(context.exception), 'AuthFailure')
@@ -0,0 +1,217 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import asyncio
+import io
+import sys
+
+from ec2instanceconnectcli import fleet
+from ec2instanceconnectcli.async_engine import AsyncEngine
+from ec2instanceconnectcli.EC2InstanceConnectLogger import EC2InstanceConnectLogger
+from ec2instanceconnectcli.instance_bundle import InstanceBundle
+from testloader.test_base import TestBase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+async def connect_ok(engine, label, command):
+    return 0
+
+
+class TestFleet(TestBase):
+
+    def _fleet_bundles(self, instance_ids):
+        return [[InstanceBundle(username=self.default_user, instance_id=instance_id, target=None, zone=None,
+                                region=self.region, profile=self.profile)] for instance_id in instance_ids]
+
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_run_aggregates_exit_status(self, mock_instance_data, mock_push_key):
+        instance_ids = ['i-{0:08x}'.format(i) for i in range(6)]
+        returncodes = {instance_ids[1]: 2, instance_ids[4]: 255}
+        mock_instance_data.side_effect = lambda session, ids, **kwargs: {
+            instance_id: self.instance_info for instance_id in ids}
+
+        async def connect(engine, label, command):
+            return returncodes.get(label, 0)
+
+        output = fleet.PrefixedOutput(io.BytesIO(), io.BytesIO())
+        runner = fleet.FleetRunner('ssh', self._fleet_bundles(instance_ids), 'pub', 'identity', [], ['uptime'],
+                                   EC2InstanceConnectLogger().get_logger(), concurrency=1, output=output)
+        with mock.patch.object(AsyncEngine, 'connect', connect):
+            self.assertEqual(runner.run(), 255)
+
+        self.assertEqual(mock_push_key.call_count, len(instance_ids))
+        self.assertEqual(output.stderr.getvalue(),
+                         '[{0}] exited with status 2\n[{1}] exited with status 255\n'.format(
+                             instance_ids[1], instance_ids[4]).encode('utf-8'))
+
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_duplicates_skipped_within_window(self, mock_instance_data, mock_push_key):
+        mock_instance_data.side_effect = lambda session, ids, **kwargs: {
+            instance_id: self.instance_info for instance_id in ids}
+        connected = []
+
+        async def connect(engine, label, command):
+            connected.append(label)
+            return 0
+
+        instance_ids = ['i-00000001', 'i-00000002', 'i-00000001', 'i-00000003', 'i-00000001']
+        runner = fleet.FleetRunner('ssh', self._fleet_bundles(instance_ids), 'pub', 'identity', [], [],
+                                   EC2InstanceConnectLogger().get_logger(), concurrency=1,
+                                   output=fleet.PrefixedOutput(io.BytesIO(), io.BytesIO()))
+        with mock.patch.object(fleet, 'DEDUPE_WINDOW', 2), mock.patch.object(AsyncEngine, 'connect', connect):
+            self.assertEqual(runner.run(), 0)
+
+        # Only the last two instances started are remembered
+        self.assertEqual(connected, ['i-00000001', 'i-00000002', 'i-00000003', 'i-00000001'])
+
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_invalid_streamed_target_stops_fleet(self, mock_instance_data, mock_push_key):
+        mock_instance_data.side_effect = lambda session, ids, **kwargs: {
+            instance_id: self.instance_info for instance_id in ids}
+
+        def targets():
+            yield self._fleet_bundles(['i-00000001'])[0]
+            raise AssertionError('targets.txt:2: Invalid target')
+
+        runner = fleet.FleetRunner('ssh', targets(), 'pub', 'identity', [], [],
+                                   EC2InstanceConnectLogger().get_logger(), concurrency=1,
+                                   output=fleet.PrefixedOutput(io.BytesIO(), io.BytesIO()))
+        with mock.patch.object(AsyncEngine, 'connect', connect_ok):
+            self.assertEqual(runner.run(), 1)
+        self.assertEqual(mock_push_key.call_count, 1)
+        self.assertTrue(runner.invalid_target)
+
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_run_all_succeed(self, mock_instance_data, mock_push_key):
+        instance_ids = ['i-{0:08x}'.format(i) for i in range(3)]
+        mock_instance_data.side_effect = lambda session, ids, **kwargs: {
+            instance_id: self.instance_info for instance_id in ids}
+
+        runner = fleet.FleetRunner('ssh', self._fleet_bundles(instance_ids), 'pub', 'identity', [], [],
+                                   EC2InstanceConnectLogger().get_logger(),
+                                   output=fleet.PrefixedOutput(io.BytesIO(), io.BytesIO()))
+        with mock.patch.object(AsyncEngine, 'connect', connect_ok):
+            self.assertEqual(runner.run(), 0)
+
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_run_bounds_concurrency(self, mock_instance_data, mock_push_key):
+        instance_ids = ['i-{0:08x}'.format(i) for i in range(12)]
+        mock_instance_data.side_effect = lambda session, ids, **kwargs: {
+            instance_id: self.instance_info for instance_id in ids}
+        running = [0]
+        peak = [0]
+
+        async def connect(engine, label, command):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.02)
+            running[0] -= 1
+            return 0
+
+        runner = fleet.FleetRunner('ssh', self._fleet_bundles(instance_ids), 'pub', 'identity', [], [],
+                                   EC2InstanceConnectLogger().get_logger(), concurrency=3,
+                                   output=fleet.PrefixedOutput(io.BytesIO(), io.BytesIO()))
+        with mock.patch.object(AsyncEngine, 'connect', connect):
+            self.assertEqual(runner.run(), 0)
+
+        self.assertEqual(peak[0], 3)
+
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_lookup_failure_only_fails_host(self, mock_instance_data, mock_push_key):
+        instance_ids = ['i-{0:08x}'.format(i) for i in range(3)]
+
+        def get_instances_data(session, ids, **kwargs):
+            if ids == [instance_ids[0]]:
+                sys.exit(1)
+            return {instance_id: self.instance_info for instance_id in ids}
+        mock_instance_data.side_effect = get_instances_data
+
+        runner = fleet.FleetRunner('ssh', self._fleet_bundles(instance_ids), 'pub', 'identity', [], [],
+                                   EC2InstanceConnectLogger().get_logger(),
+                                   output=fleet.PrefixedOutput(io.BytesIO(), io.BytesIO()))
+        connected = []
+
+        async def connect(engine, label, command):
+            connected.append(label)
+            return 0
+
+        with mock.patch.object(AsyncEngine, 'connect', connect):
+            self.assertEqual(runner.run(), 1)
+
+        self.assertEqual(sorted(connected), instance_ids[1:])
+
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    @mock.patch('ec2instanceconnectcli.ec2_util.iter_instances')
+    def test_selectors_expand_to_matching_instances(self, mock_iter_instances, mock_instance_data, mock_push_key):
+        matches = {'tag:Role=web': ['i-00000001', 'i-00000002'], 'tag:Role=db': []}
+        selectors = [[InstanceBundle(profile=self.profile, region=self.region, zone=None, instance_id='', target=None,
+                                     username='admin', selector=selector,
+                                     filters=[{'Name': 'tag:Role', 'Values': [selector.split('=')[1]]}])]
+                     for selector in sorted(matches)]
+        mock_iter_instances.side_effect = lambda session, filters, **kwargs: iter(
+            [(instance_id, self.instance_info) for instance_id in matches['tag:Role=' + filters[0]['Values'][0]]])
+        logger = mock.Mock()
+        commands = {}
+
+        async def connect(engine, label, command):
+            commands[label] = command
+            return 0
+
+        runner = fleet.FleetRunner('ssh', selectors + self._fleet_bundles(['i-00000002']), 'pub', 'identity', [], [],
+                                   logger, output=fleet.PrefixedOutput(io.BytesIO(), io.BytesIO()))
+        with mock.patch.object(AsyncEngine, 'connect', connect):
+            # tag:Role=db matches nothing, which fails the fleet
+            self.assertEqual(runner.run(), 1)
+
+        # i-00000002 is matched twice but only run on once, and was not looked up again
+        self.assertEqual(sorted(commands), ['i-00000001', 'i-00000002'])
+        self.assertFalse(mock_instance_data.called)
+        self.assertEqual(commands['i-00000001'][-1], 'admin@{0}'.format(self.public_ip))
+        self.assertEqual(mock_push_key.call_args[0][4], self.availability_zone)
+        logger.error.assert_called_with('No running instances match tag:Role=db')
+
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    @mock.patch('ec2instanceconnectcli.ec2_util.iter_instances')
+    def test_failed_selector_only_fails_selector(self, mock_iter_instances, mock_instance_data, mock_push_key):
+        mock_instance_data.side_effect = lambda session, ids, **kwargs: {
+            instance_id: self.instance_info for instance_id in ids}
+        mock_iter_instances.side_effect = Exception('AuthFailure')
+        selector = [InstanceBundle(profile=self.profile, region=self.region, zone=None, instance_id='', target=None,
+                                   username='admin', selector='tag:Role=web',
+                                   filters=[{'Name': 'tag:Role', 'Values': ['web']}])]
+        logger = mock.Mock()
+        connected = []
+
+        async def connect(engine, label, command):
+            connected.append(label)
+            return 0
+
+        runner = fleet.FleetRunner('ssh', [selector] + self._fleet_bundles(['i-00000001']), 'pub', 'identity', [],
+                                   [], logger, output=fleet.PrefixedOutput(io.BytesIO(), io.BytesIO()))
+        with mock.patch.object(AsyncEngine, 'connect', connect):
+            self.assertEqual(runner.run(), 1)
+
+        self.assertEqual(connected, ['i-00000001'])
+        self.assertTrue(runner.invalid_target)
+        logger.error.assert_any_call('Failed to select tag:Role=web: AuthFailure')
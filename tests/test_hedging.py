@@ -0,0 +1,121 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import threading
+
+from botocore.exceptions import ClientError
+
+from ec2instanceconnectcli import hedging
+from testloader.test_base import TestBase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class TestHedging(TestBase):
+
+    def setUp(self):
+        super(TestHedging, self).setUp()
+        stats_registry = mock.patch.dict(hedging._stats, clear=True)
+        stats_registry.start()
+        self.addCleanup(stats_registry.stop)
+        self.client = mock.Mock()
+        self.client.meta.region_name = self.region
+
+    def _prime(self, latency):
+        stats = hedging.get_stats('send_ssh_public_key', self.region)
+        for _ in range(hedging.MIN_SAMPLES):
+            stats.record(latency)
+        return stats
+
+    def test_hedge_delay(self):
+        stats = hedging.get_stats('send_ssh_public_key', self.region)
+        self.assertEqual(stats.hedge_delay(95), hedging.DEFAULT_DELAY_SECONDS)
+
+        for latency in range(1, 101):
+            stats.record(latency / 1000.0)
+        self.assertEqual(stats.hedge_delay(50), 0.05)
+        self.assertEqual(stats.hedge_delay(99), 0.099)
+        self.assertEqual(stats.hedge_delay(100), 0.1)
+        self.assertEqual(stats.hedge_delay(1), hedging.MIN_DELAY_SECONDS)
+
+    def test_stats_persist_across_runs(self):
+        stats = self._prime(0.25)
+        stats.save()
+
+        reloaded = hedging.LatencyStats(stats.path)
+        self.assertEqual(reloaded.samples, [0.25] * hedging.MIN_SAMPLES)
+
+    def test_latencies_are_saved_at_exit_or_every_save_every_calls(self):
+        self.client.send_ssh_public_key.return_value = {'Success': True}
+        stats = hedging.get_stats('send_ssh_public_key', self.region)
+
+        with mock.patch.object(hedging, 'SAVE_EVERY', 3):
+            for _ in range(2):
+                hedging.call(self.client, 'send_ssh_public_key', 95)
+            self.assertFalse(os.path.exists(stats.path))
+            hedging.call(self.client, 'send_ssh_public_key', 95)
+        self.assertEqual(len(hedging.LatencyStats(stats.path).samples), 3)
+        self.assertEqual(stats.unsaved, 0)
+
+        hedging.call(self.client, 'send_ssh_public_key', 95)
+        hedging.save_all()
+        self.assertEqual(len(hedging.LatencyStats(stats.path).samples), 4)
+
+    def test_no_percentile_is_a_plain_call(self):
+        self.client.send_ssh_public_key.return_value = {'Success': True}
+
+        self.assertEqual(hedging.call(self.client, 'send_ssh_public_key', None, InstanceId=self.instance_id),
+                         {'Success': True})
+        self.assertEqual(self.client.send_ssh_public_key.call_count, 1)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_fast_call_is_not_hedged(self):
+        self._prime(1.0)
+        self.client.send_ssh_public_key.return_value = {'Success': True}
+
+        self.assertEqual(hedging.call(self.client, 'send_ssh_public_key', 95), {'Success': True})
+        self.assertEqual(self.client.send_ssh_public_key.call_count, 1)
+
+    def test_slow_call_is_hedged(self):
+        self._prime(0.001)
+        release = threading.Event()
+        calls = []
+
+        def send_ssh_public_key(**params):
+            calls.append(params)
+            if len(calls) == 1:
+                # The first call hangs until the test is done
+                release.wait(5)
+                return {'Success': True, 'RequestId': 'first'}
+            return {'Success': True, 'RequestId': 'hedge'}
+        self.client.send_ssh_public_key.side_effect = send_ssh_public_key
+
+        try:
+            response = hedging.call(self.client, 'send_ssh_public_key', 95, InstanceId=self.instance_id)
+        finally:
+            release.set()
+
+        self.assertEqual(response['RequestId'], 'hedge')
+        self.assertEqual(calls, [{'InstanceId': self.instance_id}] * 2)
+
+    def test_fatal_error_is_not_hedged(self):
+        self._prime(1.0)
+        self.client.send_ssh_public_key.side_effect = ClientError(
+            {'Error': {'Code': 'InvalidArgsException', 'Message': 'Wrong zone'}}, 'SendSSHPublicKey')
+
+        with self.assertRaises(ClientError):
+            hedging.call(self.client, 'send_ssh_public_key', 95)
+        self.assertEqual(self.client.send_ssh_public_key.call_count, 1)
@@ -0,0 +1,75 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import subprocess
+import sys
+
+from testloader.test_base import TestBase
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Cumulative import time of ec2instanceconnectcli.mops, as reported by python -X importtime.  Loading botocore or
+# cryptography up front costs well over this on its own.
+IMPORT_TIME_BUDGET_MS = 150
+# Modules that must only be loaded once they are needed
+HEAVY_MODULES = ('botocore', 'cryptography', 'asyncio')
+# Feature modules that the default single-host path never uses
+OPTIONAL_MODULES = ('ec2instanceconnectcli.daemon', 'ec2instanceconnectcli.fleet', 'ec2instanceconnectcli.ssh_agent')
+
+
+class TestImportTime(TestBase):
+
+    def _run_python(self, *args):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([REPO_ROOT, env.get('PYTHONPATH', '')])
+        return subprocess.run([sys.executable] + list(args), env=env, cwd=REPO_ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    def test_import_time_budget(self):
+        # Once to populate __pycache__, then measure
+        self._run_python('-c', 'import ec2instanceconnectcli.mops')
+        result = self._run_python('-X', 'importtime', '-c', 'import ec2instanceconnectcli.mops')
+
+        cumulative_us = None
+        for line in result.stderr.splitlines():
+            fields = [field.strip() for field in line.split('|')]
+            if len(fields) == 3 and fields[2] == 'ec2instanceconnectcli.mops':
+                cumulative_us = int(fields[1])
+        self.assertIsNotNone(cumulative_us)
+        self.assertLess(cumulative_us / 1000.0, IMPORT_TIME_BUDGET_MS)
+
+    def test_help_does_not_load_heavy_modules(self):
+        code = '\n'.join([
+            'import sys',
+            'from ec2instanceconnectcli import mops',
+            'sys.argv = ["mssh", "--help"]',
+            'try:',
+            '    mops.main("ssh", "ssh")',
+            'except SystemExit:',
+            '    pass',
+            'print("loaded:" + ",".join(m for m in {0!r} if m in sys.modules))'.format(HEAVY_MODULES),
+        ])
+
+        result = self._run_python('-c', code)
+
+        self.assertEqual(result.stdout.splitlines()[-1], 'loaded:')
+
+    def test_optional_features_are_not_imported(self):
+        code = '\n'.join([
+            'import sys',
+            'from ec2instanceconnectcli import mops',
+            'print("loaded:" + ",".join(m for m in {0!r} if m in sys.modules))'.format(OPTIONAL_MODULES),
+        ])
+        result = self._run_python('-c', code)
+
+        self.assertEqual(result.stdout.splitlines()[-1], 'loaded:')
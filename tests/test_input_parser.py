@@ -13,7 +13,12 @@
 
 import argparse
 import getpass
+import io
+import os
+import sys
+import tempfile
 from ec2instanceconnectcli import input_parser
+from ec2instanceconnectcli.instance_bundle import InstanceBundle
 from testloader.test_base import TestBase
 
 
@@ -33,6 +38,7 @@ class TestInputParser(TestBase):
     parser.add_argument('-T', '--dest_instance_id', action='store', type=str, default='',
                         help='EC2 Instance ID. Required if destination is a second instance and is given as a DNS name'
                              'or IP address')
+    parser.add_argument('--targets-file', action='store', type=str)
 
     def test_basic_target(self):
         args = self.parser.parse_known_args(['-u', self.profile, self.instance_id])
@@ -41,8 +47,9 @@ class TestInputParser(TestBase):
 
         self.assertEqual(bundles, [{'username': self.default_user, 'instance_id': self.instance_id,
                                    'target': None, 'zone': None, 'region': None, 'profile': self.profile}])
-        self.assertEqual(flags, '')
-        self.assertEqual(command, '')
+        self.assertIsInstance(bundles[0], InstanceBundle)
+        self.assertEqual(flags, [])
+        self.assertEqual(command, [])
 
     def test_username(self):
         args = self.parser.parse_known_args(['-u', self.profile, "myuser@{0}".format(self.instance_id)])
@@ -51,8 +58,8 @@ class TestInputParser(TestBase):
 
         self.assertEqual(bundles, [{'username': 'myuser', 'instance_id': self.instance_id,
                                     'target': None, 'zone': None, 'region': None, 'profile': self.profile}])
-        self.assertEqual(flags, '')
-        self.assertEqual(command, '')
+        self.assertEqual(flags, [])
+        self.assertEqual(command, [])
 
     def test_dns_name(self):
         args = self.parser.parse_known_args(['-u', self.profile, '-t', self.instance_id, '-r', self.region,
@@ -63,8 +70,8 @@ class TestInputParser(TestBase):
         self.assertEqual(bundles, [{'username': self.default_user, 'instance_id': self.instance_id,
                                     'target': self.dns_name, 'zone': self.availability_zone,
                                     'region': self.region, 'profile': self.profile}])
-        self.assertEqual(flags, '')
-        self.assertEqual(command, '')
+        self.assertEqual(flags, [])
+        self.assertEqual(command, [])
 
     def test_flags(self):
         args = self.parser.parse_known_args(['-u', self.profile, "-1", "-l", "login", self.instance_id])
@@ -73,8 +80,8 @@ class TestInputParser(TestBase):
 
         self.assertEqual(bundles, [{'username': 'login', 'instance_id': self.instance_id,
                                     'target': None, 'zone': None, 'region': None, 'profile': self.profile}])
-        self.assertEqual(flags, '-1 -l login')
-        self.assertEqual(command, '')
+        self.assertEqual(flags, ['-1', '-l', 'login'])
+        self.assertEqual(command, [])
 
     def test_command(self):
         args = self.parser.parse_known_args(['-u', self.profile, self.instance_id, 'uname', '-a'])
@@ -83,8 +90,8 @@ class TestInputParser(TestBase):
 
         self.assertEqual(bundles, [{'username': self.default_user, 'instance_id': self.instance_id,
                                     'target': None, 'zone': None, 'region': None, 'profile': self.profile}])
-        self.assertEqual(flags, '')
-        self.assertEqual(command, 'uname -a')
+        self.assertEqual(flags, [])
+        self.assertEqual(command, ['uname', '-a'])
 
     def test_sftp(self):
         args = self.parser.parse_known_args(['-u', self.profile, "{0}:{1}".format(self.instance_id, 'first_file'),
@@ -95,8 +102,8 @@ class TestInputParser(TestBase):
         self.assertEqual(bundles, [{'username': self.default_user, 'instance_id': self.instance_id,
                                     'target': None, 'zone': None, 'region': None, 'profile': self.profile,
                                     'file': 'first_file'}])
-        self.assertEqual(flags, '')
-        self.assertEqual(command, 'second_file')
+        self.assertEqual(flags, [])
+        self.assertEqual(command, ['second_file'])
 
     def test_invalid_username(self):
         args = self.parser.parse_known_args(['-u', self.profile, "BADUSER@{0}".format(self.instance_id)])
@@ -137,3 +144,123 @@ class TestInputParser(TestBase):
         args = self.parser.parse_known_args(['-u', self.profile, "-1", "-l", "login", "  -i ", self.instance_id])
 
         self.assertRaises(AssertionError, input_parser.parseargs, args)
+
+    def test_command_with_metacharacters(self):
+        args = self.parser.parse_known_args(['-u', self.profile, self.instance_id, 'echo "a b"; ls > out'])
+
+        bundles, flags, command = input_parser.parseargs(args)
+
+        self.assertEqual(command, ['echo "a b"; ls > out'])
+
+    def test_fleet_targets(self):
+        args = self.parser.parse_known_args(['-u', self.profile, '-p', '22',
+                                             '{0},myuser@i-1234abcd,'.format(self.instance_id), 'uptime'])
+
+        fleet_bundles, flags, command = input_parser.parse_fleet_args(args)
+
+        self.assertEqual(fleet_bundles, [
+            [{'username': self.default_user, 'instance_id': self.instance_id, 'target': None, 'zone': None,
+              'region': None, 'profile': self.profile}],
+            [{'username': 'myuser', 'instance_id': 'i-1234abcd', 'target': None, 'zone': None,
+              'region': None, 'profile': self.profile}]])
+        self.assertEqual(flags, ['-p', '22'])
+        self.assertEqual(command, ['uptime'])
+
+    def test_fleet_rejects_instance_flag(self):
+        args = self.parser.parse_known_args(['-t', self.instance_id, self.dns_name])
+
+        self.assertRaises(AssertionError, input_parser.parse_fleet_args, args)
+
+    def test_fleet_invalid_target(self):
+        args = self.parser.parse_known_args(['{0},{1}'.format(self.instance_id, self.dns_name)])
+
+        self.assertRaises(AssertionError, input_parser.parse_fleet_args, args)
+
+    def test_fleet_selectors(self):
+        args = self.parser.parse_known_args(['-u', self.profile, '-z', self.availability_zone,
+                                             'tag:Role=web,admin@tag:Name=api-*+filter:instance-type=t3.*,{0}'.format(
+                                                 self.instance_id), 'uptime'])
+
+        fleet_bundles, flags, command = input_parser.parse_fleet_args(args)
+
+        zone_filter = {'Name': 'availability-zone', 'Values': [self.availability_zone]}
+        self.assertEqual(fleet_bundles[0], [
+            {'profile': self.profile, 'region': None, 'zone': None, 'instance_id': '', 'target': None,
+             'username': self.default_user, 'selector': 'tag:Role=web',
+             'filters': [{'Name': 'tag:Role', 'Values': ['web']}, zone_filter]}])
+        self.assertEqual(fleet_bundles[1][0]['username'], 'admin')
+        self.assertEqual(fleet_bundles[1][0]['filters'], [{'Name': 'tag:Name', 'Values': ['api-*']},
+                                                          {'Name': 'instance-type', 'Values': ['t3.*']},
+                                                          zone_filter])
+        self.assertEqual(fleet_bundles[2][0]['instance_id'], self.instance_id)
+        self.assertEqual(command, ['uptime'])
+
+    def test_fleet_selector_value_with_at(self):
+        args = self.parser.parse_known_args(['tag:Owner=ops@example.com'])
+
+        fleet_bundles, _, _ = input_parser.parse_fleet_args(args)
+
+        self.assertEqual(fleet_bundles[0][0]['username'], self.default_user)
+        self.assertEqual(fleet_bundles[0][0]['filters'], [{'Name': 'tag:Owner', 'Values': ['ops@example.com']}])
+
+    def test_fleet_invalid_selectors(self):
+        for target in ['tag:=web', 'tag:Role', 'filter:bad name=x', 'tag:Role=web+Name=x', 'Bad User@tag:Role=web']:
+            args = self.parser.parse_known_args([target])
+            self.assertRaises(AssertionError, input_parser.parse_fleet_args, args)
+
+    def _write_targets(self, lines):
+        targets_file = tempfile.NamedTemporaryFile('w', delete=False)
+        targets_file.write('\n'.join(lines) + '\n')
+        targets_file.close()
+        self.addCleanup(os.remove, targets_file.name)
+        return targets_file.name
+
+    def test_targets_file(self):
+        path = self._write_targets(['# web servers', '', '  {0}  '.format(self.instance_id), 'myuser@i-1234abcd',
+                                    'tag:Role=web'])
+        args = self.parser.parse_known_args(['-u', self.profile, '--targets-file', path, '-p', '22', 'uptime', '-a'])
+
+        fleet_bundles, flags, command = input_parser.parse_targets_file(args)
+
+        self.assertEqual(flags, ['-p', '22'])
+        self.assertEqual(command, ['uptime', '-a'])
+        # Nothing is read until the targets are consumed
+        self.assertFalse(isinstance(fleet_bundles, list))
+        fleet_bundles = list(fleet_bundles)
+        self.assertEqual(fleet_bundles[:2], [
+            [{'username': self.default_user, 'instance_id': self.instance_id, 'target': None, 'zone': None,
+              'region': None, 'profile': self.profile}],
+            [{'username': 'myuser', 'instance_id': 'i-1234abcd', 'target': None, 'zone': None,
+              'region': None, 'profile': self.profile}]])
+        self.assertEqual(fleet_bundles[2][0]['filters'], [{'Name': 'tag:Role', 'Values': ['web']}])
+
+    def test_targets_file_reports_line_number(self):
+        path = self._write_targets([self.instance_id, '# comment', 'Bad User@{0}'.format(self.instance_id),
+                                    'i-1234abcd'])
+        args = self.parser.parse_known_args(['--targets-file', path])
+
+        fleet_bundles, flags, command = input_parser.parse_targets_file(args)
+
+        self.assertEqual(next(fleet_bundles)[0]['instance_id'], self.instance_id)
+        with self.assertRaises(AssertionError) as context:
+            next(fleet_bundles)
+        self.assertTrue(str(context.exception).startswith('{0}:3: '.format(path)))
+        self.assertEqual((flags, command), ([], []))
+
+    def test_targets_file_stdin(self):
+        args = self.parser.parse_known_args(['--targets-file', '-', 'uptime'])
+        stdin = io.StringIO('{0}\n'.format(self.instance_id))
+
+        original_stdin = sys.stdin
+        sys.stdin = stdin
+        try:
+            fleet_bundles, _, command = input_parser.parse_targets_file(args)
+            self.assertEqual([bundles[0]['instance_id'] for bundles in fleet_bundles], [self.instance_id])
+        finally:
+            sys.stdin = original_stdin
+        self.assertEqual(command, ['uptime'])
+
+    def test_targets_file_missing(self):
+        args = self.parser.parse_known_args(['--targets-file', os.path.join(tempfile.gettempdir(), 'no-such-file')])
+
+        self.assertRaises(AssertionError, input_parser.parse_targets_file, args)
@@ -0,0 +1,58 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+
+from ec2instanceconnectcli.instance_bundle import InstanceBundle
+from testloader.test_base import TestBase
+
+
+class TestInstanceBundle(TestBase):
+
+    def test_behaves_like_a_dict(self):
+        bundle = InstanceBundle(profile=self.profile, instance_id=self.instance_id, region=None)
+
+        self.assertEqual(bundle['instance_id'], self.instance_id)
+        self.assertIn('profile', bundle)
+        self.assertNotIn('region', bundle)
+        self.assertIsNone(bundle['region'])
+        self.assertEqual(bundle.get('file', 'none'), 'none')
+        self.assertEqual(dict(bundle), {'profile': self.profile, 'instance_id': self.instance_id})
+        self.assertEqual(json.loads(json.dumps(dict(bundle))), {'profile': self.profile,
+                                                               'instance_id': self.instance_id})
+
+        bundle['host_info'] = self.public_ip
+        self.assertEqual(sorted(bundle), ['host_info', 'instance_id', 'profile'])
+        del bundle['host_info']
+        self.assertNotIn('host_info', bundle)
+        self.assertRaises(KeyError, bundle.__delitem__, 'host_info')
+        self.assertRaises(KeyError, bundle.__setitem__, 'port', 22)
+        self.assertRaises(KeyError, bundle.__getitem__, 'get')
+
+    def test_equals_dicts_with_the_same_items(self):
+        bundle = InstanceBundle(username=self.default_user, instance_id=self.instance_id, target=None)
+
+        self.assertEqual(bundle, {'username': self.default_user, 'instance_id': self.instance_id, 'target': None})
+        self.assertEqual({'username': self.default_user, 'instance_id': self.instance_id}, bundle)
+        self.assertEqual(bundle, InstanceBundle(instance_id=self.instance_id, username=self.default_user))
+        self.assertNotEqual(bundle, {'username': 'other', 'instance_id': self.instance_id})
+        self.assertNotEqual(bundle, InstanceBundle(instance_id=self.instance_id))
+
+    def test_shared_fields_are_interned(self):
+        first = InstanceBundle(profile=''.join(['de', 'v']), username=''.join(['ec2-', 'user']))
+        second = InstanceBundle()
+        second['profile'] = ''.join(['d', 'ev'])
+        second['username'] = ''.join(['ec2', '-user'])
+
+        self.assertIs(first['profile'], second['profile'])
+        self.assertIs(first['username'], second['username'])
@@ -0,0 +1,118 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import stat
+import time
+import unittest
+
+from ec2instanceconnectcli import instance_cache, local_cache
+from testloader.test_base import TestBase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class TestInstanceCache(TestBase):
+
+    ttl = 300
+
+    def setUp(self):
+        super(TestInstanceCache, self).setUp()
+        pending = mock.patch.dict(instance_cache._pending, clear=True)
+        pending.start()
+        self.addCleanup(pending.stop)
+
+    def test_get_after_put(self):
+        instance_cache.put(self.profile, self.region, {self.instance_id: self.instance_info}, self.ttl)
+
+        self.assertEqual(instance_cache.get(self.profile, self.region, [self.instance_id, 'i-1234abcd'], self.ttl),
+                         {self.instance_id: self.instance_info})
+
+    def test_index_is_private(self):
+        instance_cache.put(self.profile, self.region, {self.instance_id: self.instance_info}, self.ttl)
+        instance_cache.flush()
+
+        index_dir = os.path.join(self.cache_dir, instance_cache.CACHE_DIR)
+        for name in os.listdir(index_dir):
+            self.assertEqual(stat.S_IMODE(os.stat(os.path.join(index_dir, name)).st_mode), 0o600)
+
+    def test_get_is_namespaced(self):
+        instance_cache.put(self.profile, self.region, {self.instance_id: self.instance_info}, self.ttl)
+
+        self.assertEqual(instance_cache.get(self.new_profile, self.region, [self.instance_id], self.ttl), {})
+        self.assertEqual(instance_cache.get(self.profile, self.new_region, [self.instance_id], self.ttl), {})
+
+    def test_get_expired(self):
+        with mock.patch('time.time', return_value=time.time() - self.ttl - 1):
+            instance_cache.put(self.profile, self.region, {self.instance_id: self.instance_info}, self.ttl)
+
+        self.assertEqual(instance_cache.get(self.profile, self.region, [self.instance_id], self.ttl), {})
+
+    def test_put_drops_expired(self):
+        with mock.patch('time.time', return_value=time.time() - self.ttl - 1):
+            instance_cache.put(self.profile, self.region, {'i-1234abcd': self.instance_info}, self.ttl)
+        instance_cache.put(self.profile, self.region, {self.instance_id: self.instance_info}, self.ttl)
+
+        self.assertEqual(instance_cache.get(self.profile, self.region, ['i-1234abcd'], self.ttl * 2), {})
+
+    def test_puts_are_written_once_per_namespace(self):
+        with mock.patch('ec2instanceconnectcli.local_cache.write_private_file',
+                        wraps=local_cache.write_private_file) as mock_write:
+            for index in range(100):
+                instance_cache.put(self.profile, self.region, {'i-{0:08x}'.format(index): self.instance_info},
+                                   self.ttl)
+            instance_cache.put(self.profile, self.new_region, {self.instance_id: self.instance_info}, self.ttl)
+            self.assertFalse(mock_write.called)
+
+            instance_cache.flush()
+            self.assertEqual(mock_write.call_count, 2)
+
+        # Read back from the index alone
+        self.assertEqual(len(instance_cache.get(self.profile, self.region,
+                                                ['i-{0:08x}'.format(index) for index in range(100)], self.ttl)), 100)
+        self.assertEqual(instance_cache.get(self.profile, self.new_region, [self.instance_id], self.ttl),
+                         {self.instance_id: self.instance_info})
+
+    def test_put_flushes_every_flush_every_entries(self):
+        with mock.patch.object(instance_cache, 'FLUSH_EVERY', 2):
+            instance_cache.put(self.profile, self.region, {self.instance_id: self.instance_info}, self.ttl)
+            self.assertEqual(len(instance_cache._pending), 1)
+            instance_cache.put(self.profile, self.region, {'i-1234abcd': self.instance_info}, self.ttl)
+        self.assertEqual(instance_cache._pending, {})
+
+    def test_invalidate_flushed(self):
+        instance_cache.put(self.profile, self.region, {self.instance_id: self.instance_info}, self.ttl)
+        instance_cache.flush()
+        instance_cache.invalidate(self.profile, self.region, [self.instance_id])
+
+        self.assertEqual(instance_cache.get(self.profile, self.region, [self.instance_id], self.ttl), {})
+
+    def test_invalidate(self):
+        instance_cache.put(self.profile, self.region, {self.instance_id: self.instance_info,
+                                                       'i-1234abcd': self.private_instance_info}, self.ttl)
+        instance_cache.invalidate(self.profile, self.region, [self.instance_id])
+
+        self.assertEqual(instance_cache.get(self.profile, self.region, [self.instance_id, 'i-1234abcd'], self.ttl),
+                         {'i-1234abcd': self.private_instance_info})
+
+    @unittest.skipIf(local_cache.fcntl is None, 'requires flock')
+    def test_index_not_written_without_lock(self):
+        instance_cache.put(self.profile, self.region, {self.instance_id: self.instance_info}, self.ttl)
+
+        with mock.patch('fcntl.flock', side_effect=OSError('No locks available')), \
+                mock.patch('ec2instanceconnectcli.local_cache.write_private_file') as mock_write:
+            with self.assertRaises(OSError):
+                instance_cache.flush()
+        self.assertFalse(mock_write.called)
@@ -0,0 +1,115 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import time
+
+import botocore
+import botocore.session
+
+from ec2instanceconnectcli import local_cache, model_cache
+from testloader.test_base import TestBase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class TestModelCache(TestBase):
+
+    model = {
+        'version': '2.0',
+        'metadata': {'protocol': 'ec2'},
+        'documentation': 'Service documentation',
+        'operations': {
+            'Describe': {'name': 'Describe', 'input': {'shape': 'DescribeRequest'},
+                         'output': {'shape': 'DescribeResult', 'documentation': 'Output'},
+                         'documentation': 'Describes', 'documentationUrl': 'https://example.com'},
+            'Delete': {'name': 'Delete', 'input': {'shape': 'DeleteRequest'}},
+        },
+        'shapes': {
+            'DescribeRequest': {'type': 'structure', 'members': {
+                'Ids': {'shape': 'IdList', 'documentation': 'IDs'},
+                'documentation': {'shape': 'String'}}},
+            'DescribeResult': {'type': 'structure', 'members': {'Tags': {'shape': 'TagMap'}},
+                               'documentation': 'Result'},
+            'IdList': {'type': 'list', 'member': {'shape': 'String'}},
+            'TagMap': {'type': 'map', 'key': {'shape': 'String'}, 'value': {'shape': 'Integer'}},
+            'String': {'type': 'string'},
+            'Integer': {'type': 'integer'},
+            'DeleteRequest': {'type': 'structure', 'members': {}},
+        },
+    }
+
+    def test_trim_keeps_reachable_shapes(self):
+        trimmed = model_cache.trim_model(self.model, ['Describe'])
+
+        self.assertEqual(list(trimmed['operations']), ['Describe'])
+        self.assertEqual(sorted(trimmed['shapes']),
+                         ['DescribeRequest', 'DescribeResult', 'IdList', 'Integer', 'String', 'TagMap'])
+        self.assertEqual(trimmed['metadata'], self.model['metadata'])
+
+    def test_trim_strips_documentation(self):
+        trimmed = model_cache.trim_model(self.model, ['Describe'])
+
+        self.assertNotIn('documentation', trimmed)
+        self.assertEqual(trimmed['operations']['Describe'],
+                         {'name': 'Describe', 'input': {'shape': 'DescribeRequest'},
+                          'output': {'shape': 'DescribeResult'}})
+        self.assertNotIn('documentation', trimmed['shapes']['DescribeResult'])
+        self.assertEqual(trimmed['shapes']['DescribeRequest']['members']['Ids'], {'shape': 'IdList'})
+        # A member that happens to be called documentation is not documentation
+        self.assertIn('documentation', trimmed['shapes']['DescribeRequest']['members'])
+
+    def test_session_loads_trimmed_models(self):
+        session = botocore.session.get_session()
+        self.assertTrue(model_cache.install(session))
+
+        client = session.create_client('ec2', region_name='us-east-1')
+
+        self.assertTrue(hasattr(client, 'describe_instances'))
+        self.assertFalse(hasattr(client, 'run_instances'))
+        self.assertTrue(client.can_paginate('describe_instances'))
+        self.assertTrue(hasattr(session.create_client('ec2-instance-connect', region_name='us-east-1'),
+                                'send_ssh_public_key'))
+        self.assertEqual(os.listdir(local_cache.get_cache_dir(model_cache.CACHE_DIR)), [botocore.__version__])
+
+    def test_unused_botocore_versions_are_removed(self):
+        stale_dir = local_cache.get_cache_dir(model_cache.CACHE_DIR, '0.0.1')
+        last_used = time.time() - model_cache.STALE_SECONDS - 60
+        os.utime(stale_dir, (last_used, last_used))
+        # Another installation's models, in use
+        recent_dir = local_cache.get_cache_dir(model_cache.CACHE_DIR, '0.0.2', 'ec2')
+
+        model_cache.install(botocore.session.get_session())
+
+        self.assertFalse(os.path.exists(stale_dir))
+        self.assertTrue(os.path.exists(recent_dir))
+
+    def test_disabled(self):
+        session = botocore.session.get_session()
+        search_paths = list(session.get_component('data_loader').search_paths)
+
+        with mock.patch.dict(os.environ, {model_cache.MODEL_CACHE_ENV: '0'}):
+            self.assertFalse(model_cache.install(session))
+
+        self.assertEqual(session.get_component('data_loader').search_paths, search_paths)
+
+    @mock.patch('ec2instanceconnectcli.model_cache.build')
+    def test_failure_falls_back_to_botocore_data(self, mock_build):
+        mock_build.side_effect = IOError('read-only file system')
+        session = botocore.session.get_session()
+
+        self.assertFalse(model_cache.install(session))
+
+        self.assertTrue(hasattr(session.create_client('ec2', region_name='us-east-1'), 'run_instances'))
@@ -0,0 +1,63 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import socket
+import unittest
+
+from ec2instanceconnectcli import local_cache, multiplex
+from testloader.test_base import TestBase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+@unittest.skipUnless(multiplex.is_supported(), 'requires Unix domain sockets')
+class TestMultiplex(TestBase):
+
+    def setUp(self):
+        super(TestMultiplex, self).setUp()
+        self.bundle = {'instance_id': self.instance_id, 'username': self.default_user, 'profile': self.profile,
+                       'region': self.region}
+
+    def test_control_path(self):
+        control_path = multiplex.get_control_path(self.bundle)
+
+        self.assertEqual(os.path.dirname(control_path), os.path.join(self.cache_dir, multiplex.CACHE_DIR))
+        self.assertEqual(control_path, multiplex.get_control_path(dict(self.bundle, region=None)))
+        self.assertNotEqual(control_path, multiplex.get_control_path(dict(self.bundle, username='other')))
+        self.assertNotEqual(control_path, multiplex.get_control_path(self.bundle, ['-p', '2222']))
+
+    def test_control_path_too_long(self):
+        long_dir = os.path.join(self.cache_dir, 'x' * multiplex.MAX_SOCKET_PATH)
+        with mock.patch.dict(os.environ, {local_cache.CACHE_DIR_ENV: long_dir}):
+            self.assertIsNone(multiplex.get_control_path(self.bundle))
+
+    def test_master_alive_and_host(self):
+        control_path = multiplex.get_control_path(self.bundle)
+        self.assertFalse(multiplex.is_master_alive(control_path))
+        self.assertIsNone(multiplex.read_host(control_path))
+
+        master = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(master.close)
+        master.bind(control_path)
+        master.listen(1)
+        multiplex.write_host(control_path, self.public_ip)
+
+        self.assertTrue(multiplex.is_master_alive(control_path))
+        self.assertEqual(multiplex.read_host(control_path), self.public_ip)
+
+        # A socket left behind by a master that exited
+        master.close()
+        self.assertFalse(multiplex.is_master_alive(control_path))
@@ -0,0 +1,116 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+from ec2instanceconnectcli import proxy
+from testloader.test_base import TestBase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+@unittest.skipUnless(hasattr(socket, 'socketpair') and os.name == 'posix', 'requires POSIX pipes')
+class TestRelay(TestBase):
+
+    def _relay(self):
+        stdin_read, stdin_write = os.pipe()
+        stdout_read, stdout_write = os.pipe()
+        local, remote = socket.socketpair()
+        payload = os.urandom(3 * proxy.CHUNK_SIZE + 5)
+        received = []
+
+        def server():
+            data = b''
+            while True:
+                chunk = remote.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            received.append(data)
+            remote.sendall(data[::-1])
+            remote.close()
+
+        server_thread = threading.Thread(target=server)
+        server_thread.start()
+        relay_thread = threading.Thread(target=proxy.relay, args=(local, stdin_read, stdout_write))
+        relay_thread.start()
+
+        os.write(stdin_write, payload)
+        os.close(stdin_write)
+        output = b''
+        while len(output) < len(payload):
+            output += os.read(stdout_read, 65536)
+        relay_thread.join(5)
+        server_thread.join(5)
+        self.assertFalse(relay_thread.is_alive())
+
+        self.assertEqual(received, [payload])
+        self.assertEqual(output, payload[::-1])
+        for fd in (stdin_read, stdout_read, stdout_write):
+            os.close(fd)
+        local.close()
+
+    @unittest.skipUnless(hasattr(os, 'splice'), 'requires splice')
+    def test_relay_splice(self):
+        with mock.patch('os.splice', wraps=os.splice) as mock_splice:
+            self._relay()
+        self.assertTrue(mock_splice.called)
+
+    def test_relay_copy(self):
+        with mock.patch('ec2instanceconnectcli.proxy._is_pipe', return_value=False):
+            self._relay()
+
+
+class TestProxyMain(TestBase):
+
+    def setUp(self):
+        super(TestProxyMain, self).setUp()
+        key_file = tempfile.NamedTemporaryFile('w', suffix='.pub', delete=False)
+        key_file.write('ssh-ed25519 AAAA test\n')
+        key_file.close()
+        self.key_path = key_file.name
+
+    def tearDown(self):
+        os.remove(self.key_path)
+
+    @mock.patch('ec2instanceconnectcli.proxy.relay')
+    @mock.patch('ec2instanceconnectcli.proxy.connect')
+    @mock.patch('ec2instanceconnectcli.key_publisher.push_public_key')
+    @mock.patch('ec2instanceconnectcli.ec2_util.get_instances_data')
+    def test_push_then_relay(self, mock_instance_data, mock_push_key, mock_connect, mock_relay):
+        mock_instance_data.return_value = {self.instance_id: self.instance_info}
+        argv = ['mssh-proxy', '-r', self.region, '--public-key', self.key_path,
+                'ubuntu@{0}'.format(self.instance_id), '2222']
+
+        with mock.patch.object(sys, 'argv', argv):
+            self.assertEqual(proxy.main(), 0)
+
+        self.assertEqual(mock_push_key.call_args[0][1:5],
+                         (self.instance_id, 'ubuntu', 'ssh-ed25519 AAAA test', self.availability_zone))
+        mock_connect.assert_called_with(self.public_ip, 2222)
+        mock_relay.assert_called_with(mock_connect.return_value)
+
+    @mock.patch('ec2instanceconnectcli.proxy.connect')
+    def test_hostname_requires_instance_id(self, mock_connect):
+        argv = ['mssh-proxy', '--public-key', self.key_path, 'host.example.com']
+
+        with mock.patch.object(sys, 'argv', argv):
+            self.assertEqual(proxy.main(), 1)
+        self.assertFalse(mock_connect.called)
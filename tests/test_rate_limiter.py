@@ -0,0 +1,120 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from ec2instanceconnectcli import rate_limiter
+from testloader.test_base import TestBase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def client_error(code, status=400):
+    return ClientError({'Error': {'Code': code, 'Message': code},
+                        'ResponseMetadata': {'HTTPStatusCode': status}}, 'SendSSHPublicKey')
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestAdaptiveRateLimiter(TestBase):
+
+    def setUp(self):
+        super(TestAdaptiveRateLimiter, self).setUp()
+        self.clock = FakeClock()
+        self.limiter = rate_limiter.AdaptiveRateLimiter('test', rate=2.0, burst=2, min_rate=0.5, max_rate=4.0,
+                                                        clock=self.clock, sleep=self.clock.sleep)
+
+    def test_burst_then_fill_rate(self):
+        self.assertEqual(self.limiter.acquire(), 0)
+        self.assertEqual(self.limiter.acquire(), 0)
+        self.assertAlmostEqual(self.limiter.acquire(), 0.5)
+        self.assertAlmostEqual(self.limiter.acquire(), 0.5)
+
+    def test_aimd(self):
+        self.limiter.on_throttle()
+        self.assertEqual(self.limiter.rate, 1.0)
+        self.limiter.on_throttle()
+        self.limiter.on_throttle()
+        self.assertEqual(self.limiter.rate, 0.5)
+
+        for _ in range(20):
+            self.limiter.on_success()
+        self.assertEqual(self.limiter.rate, 4.0)
+
+    def test_get_limiter_is_shared(self):
+        self.assertIs(rate_limiter.get_limiter('describe_instances', self.region),
+                      rate_limiter.get_limiter('describe_instances', self.region))
+        self.assertIsNot(rate_limiter.get_limiter('describe_instances', self.region),
+                         rate_limiter.get_limiter('describe_instances', self.new_region))
+
+
+class TestCallWithRetry(TestBase):
+
+    def setUp(self):
+        super(TestCallWithRetry, self).setUp()
+        self.client = mock.Mock()
+        self.client.meta.region_name = self.region
+        self.limiter = rate_limiter.AdaptiveRateLimiter('test', rate=1000.0, burst=1000, max_rate=1000.0)
+        patcher = mock.patch('ec2instanceconnectcli.rate_limiter.get_limiter', return_value=self.limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sleep = mock.Mock()
+
+    def test_retries_throttling(self):
+        self.client.send_ssh_public_key.side_effect = [client_error('ThrottlingException'),
+                                                       client_error('ServiceUnavailable', 503),
+                                                       {'Success': True}]
+
+        response = rate_limiter.call_with_retry(self.client, 'send_ssh_public_key', sleep=self.sleep,
+                                                InstanceId=self.instance_id)
+
+        self.assertEqual(response, {'Success': True})
+        self.assertEqual(self.client.send_ssh_public_key.call_count, 3)
+        self.client.send_ssh_public_key.assert_called_with(InstanceId=self.instance_id)
+        self.assertEqual(self.sleep.call_count, 2)
+        # Halved once for the throttle, then one additive increase for the success
+        self.assertEqual(self.limiter.rate, 500.0 + rate_limiter.RATE_INCREASE)
+
+    def test_retries_connection_errors(self):
+        self.client.describe_instances.side_effect = [EndpointConnectionError(endpoint_url='https://ec2'), {}]
+
+        self.assertEqual(rate_limiter.call_with_retry(self.client, 'describe_instances', sleep=self.sleep), {})
+
+    def test_fatal_error_not_retried(self):
+        self.client.send_ssh_public_key.side_effect = client_error('InvalidArgsException')
+
+        with self.assertRaises(ClientError):
+            rate_limiter.call_with_retry(self.client, 'send_ssh_public_key', sleep=self.sleep)
+        self.assertEqual(self.client.send_ssh_public_key.call_count, 1)
+        self.assertFalse(self.sleep.called)
+
+    def test_gives_up_after_max_attempts(self):
+        self.client.send_ssh_public_key.side_effect = client_error('RequestLimitExceeded')
+
+        with self.assertRaises(ClientError):
+            rate_limiter.call_with_retry(self.client, 'send_ssh_public_key', max_attempts=3, sleep=self.sleep)
+        self.assertEqual(self.client.send_ssh_public_key.call_count, 3)
+        for call, attempt in zip(self.sleep.call_args_list, range(1, 3)):
+            self.assertTrue(0 <= call[0][0] <= rate_limiter.BASE_BACKOFF_SECONDS * 2 ** attempt)
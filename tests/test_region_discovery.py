@@ -0,0 +1,114 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import threading
+
+from botocore.exceptions import ClientError
+
+from ec2instanceconnectcli import region_discovery
+from testloader.test_base import TestBase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def not_found_error():
+    return ClientError({'Error': {'Code': 'InvalidInstanceID.NotFound', 'Message': 'not found'},
+                        'ResponseMetadata': {'HTTPStatusCode': 400}}, 'DescribeInstances')
+
+
+class TestRegionCache(TestBase):
+
+    def test_remember_and_forget(self):
+        self.assertIsNone(region_discovery.lookup(self.profile, self.instance_id))
+
+        region_discovery.remember(self.profile, self.instance_id, 'eu-west-1')
+        self.assertEqual(region_discovery.lookup(self.profile, self.instance_id), 'eu-west-1')
+        self.assertIsNone(region_discovery.lookup('other', self.instance_id))
+
+        region_discovery.forget(self.profile, self.instance_id)
+        self.assertIsNone(region_discovery.lookup(self.profile, self.instance_id))
+
+    @mock.patch('ec2instanceconnectcli.region_discovery.MAX_ENTRIES', 2)
+    def test_oldest_entries_dropped(self):
+        for index in range(3):
+            with mock.patch('time.time', return_value=1000 + index):
+                region_discovery.remember(self.profile, 'i-{0}'.format(index), 'us-east-1')
+
+        self.assertIsNone(region_discovery.lookup(self.profile, 'i-0'))
+        self.assertEqual(region_discovery.lookup(self.profile, 'i-2'), 'us-east-1')
+
+
+class TestDiscover(TestBase):
+
+    def setUp(self):
+        super(TestDiscover, self).setUp()
+        self.instance = {'InstanceId': self.instance_id, 'PublicIpAddress': self.public_ip,
+                         'Placement': {'AvailabilityZone': 'eu-west-1a'}}
+        self.release = threading.Event()
+        self.failed = threading.Event()
+        self.session = mock.Mock()
+        self.session.get_config_variable.return_value = 'us-east-1'
+        self.session.create_client.side_effect = self._create_client
+        self.probed = []
+
+    def tearDown(self):
+        self.release.set()
+
+    def _create_client(self, service_name, region_name=None, config=None):
+        client = mock.Mock()
+        client.meta.region_name = region_name
+
+        def describe_instances(**kwargs):
+            self.probed.append(region_name)
+            if region_name == 'ap-south-1':
+                # A slow region that must not hold up the result
+                self.release.wait(5)
+            if region_name == 'eu-north-1':
+                # Only answers once the failing region has
+                self.failed.wait(5)
+            if region_name in ('eu-west-1', 'eu-north-1'):
+                return {'Reservations': [{'Instances': [self.instance]}]}
+            if region_name == 'me-south-1':
+                self.failed.set()
+                raise ClientError({'Error': {'Code': 'AuthFailure', 'Message': 'not authorized'},
+                                   'ResponseMetadata': {'HTTPStatusCode': 401}}, 'DescribeInstances')
+            raise not_found_error()
+
+        client.describe_instances.side_effect = describe_instances
+        return client
+
+    def test_first_region_with_the_instance_wins(self):
+        region, instance_info = region_discovery.discover(self.session, self.instance_id,
+                                                          ['ap-south-1', 'eu-west-1', 'us-west-2'])
+
+        self.assertEqual(region, 'eu-west-1')
+        self.assertEqual(instance_info.public_ip, self.public_ip)
+        self.assertEqual(instance_info.availability_zone, 'eu-west-1a')
+        self.assertIn('us-east-1', self.probed)
+
+    def test_not_found_anywhere(self):
+        self.assertIsNone(region_discovery.discover(self.session, self.instance_id, ['us-west-2', 'us-east-1']))
+        self.assertEqual(sorted(self.probed), ['us-east-1', 'us-west-2'])
+
+    def test_other_errors_are_raised(self):
+        with self.assertRaises(ClientError) as context:
+            region_discovery.discover(self.session, self.instance_id, ['us-west-2', 'me-south-1'])
+        self.assertEqual(context.exception.response['Error']['Code'], 'AuthFailure')
+
+    def test_errors_do_not_hide_a_later_match(self):
+        region, instance_info = region_discovery.discover(self.session, self.instance_id, ['me-south-1', 'eu-north-1'])
+
+        self.assertEqual(region, 'eu-north-1')
+        self.assertEqual(instance_info.public_ip, self.public_ip)
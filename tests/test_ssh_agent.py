@@ -0,0 +1,98 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import socket
+import struct
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from ec2instanceconnectcli import key_utils, ssh_agent
+from ec2instanceconnectcli.EC2InstanceConnectLogger import EC2InstanceConnectLogger
+from testloader.test_base import TestBase
+
+
+class TestSSHAgent(TestBase):
+
+    def _make_agent(self, key_type):
+        key = key_utils.generate_key_by_type(key_type)
+        pub_key = key_utils.serialize_key(key, encoding='OpenSSH').decode('utf-8')
+        return ssh_agent.SSHAgent(key, pub_key, EC2InstanceConnectLogger().get_logger())
+
+    def _sign_request(self, agent, data, flags=0):
+        return (struct.pack('>B', ssh_agent.SSH_AGENTC_SIGN_REQUEST) + ssh_agent._pack_string(agent.key_blob) +
+                ssh_agent._pack_string(data) + struct.pack('>I', flags))
+
+    def test_request_identities(self):
+        agent = self._make_agent('ed25519')
+
+        response = agent.handle_message(struct.pack('>B', ssh_agent.SSH_AGENTC_REQUEST_IDENTITIES))
+
+        self.assertEqual(response[0], ssh_agent.SSH_AGENT_IDENTITIES_ANSWER)
+        self.assertEqual(struct.unpack_from('>I', response, 1)[0], 1)
+        key_blob, _ = ssh_agent._unpack_string(response, 5)
+        self.assertEqual(key_blob, agent.key_blob)
+
+    def test_sign_ed25519(self):
+        agent = self._make_agent('ed25519')
+
+        response = agent.handle_message(self._sign_request(agent, b'data'))
+
+        self.assertEqual(response[0], ssh_agent.SSH_AGENT_SIGN_RESPONSE)
+        signature, _ = ssh_agent._unpack_string(response, 1)
+        algorithm, offset = ssh_agent._unpack_string(signature, 0)
+        sig_blob, _ = ssh_agent._unpack_string(signature, offset)
+        self.assertEqual(algorithm, b'ssh-ed25519')
+        agent.priv_key.public_key().verify(sig_blob, b'data')
+
+    def test_sign_rsa_sha2_256(self):
+        agent = self._make_agent('rsa')
+
+        response = agent.handle_message(self._sign_request(agent, b'data', ssh_agent.SSH_AGENT_RSA_SHA2_256))
+
+        signature, _ = ssh_agent._unpack_string(response, 1)
+        algorithm, offset = ssh_agent._unpack_string(signature, 0)
+        sig_blob, _ = ssh_agent._unpack_string(signature, offset)
+        self.assertEqual(algorithm, b'rsa-sha2-256')
+        agent.priv_key.public_key().verify(sig_blob, b'data', padding.PKCS1v15(), hashes.SHA256())
+
+    def test_sign_unknown_key(self):
+        agent = self._make_agent('ecdsa')
+        request = (struct.pack('>B', ssh_agent.SSH_AGENTC_SIGN_REQUEST) + ssh_agent._pack_string(b'other') +
+                   ssh_agent._pack_string(b'data') + struct.pack('>I', 0))
+
+        self.assertEqual(agent.handle_message(request), struct.pack('>B', ssh_agent.SSH_AGENT_FAILURE))
+
+    def test_unsupported_request(self):
+        agent = self._make_agent('ecdsa')
+
+        self.assertEqual(agent.handle_message(struct.pack('>B', 27)), struct.pack('>B', ssh_agent.SSH_AGENT_FAILURE))
+
+    def test_socket_lifecycle(self):
+        agent = self._make_agent('ed25519')
+        socket_path = agent.start()
+        socket_dir = os.path.dirname(socket_path)
+
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(socket_path)
+        client.sendall(struct.pack('>IB', 1, ssh_agent.SSH_AGENTC_REQUEST_IDENTITIES))
+        length = struct.unpack('>I', ssh_agent._recv_exactly(client, 4))[0]
+        response = ssh_agent._recv_exactly(client, length)
+        client.close()
+
+        self.assertEqual(response[0], ssh_agent.SSH_AGENT_IDENTITIES_ANSWER)
+        with open(agent.get_pub_key_file()) as f:
+            self.assertEqual(f.read(), agent.pub_key)
+
+        agent.stop()
+        self.assertFalse(os.path.exists(socket_dir))
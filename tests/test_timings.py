@@ -0,0 +1,99 @@
+# Copyright 2019 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from ec2instanceconnectcli import timings
+from testloader.test_base import TestBase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class TestTimings(TestBase):
+
+    def setUp(self):
+        super(TestTimings, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        patchers = [mock.patch.object(timings, '_spans', []),
+                    mock.patch.dict(timings._report, {'text': False, 'json_path': None, 'emitted': False}),
+                    mock.patch('atexit.register')]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_span(self):
+        timings.configure(text=True)
+        with self.assertRaises(ValueError):
+            with timings.span('describe_instances', instances=2):
+                raise ValueError()
+        timings.add_span('import', timings.ORIGIN, timings.ORIGIN + 0.5)
+
+        spans = timings.get_spans()
+
+        self.assertEqual([entry['name'] for entry in spans], ['import', 'describe_instances'])
+        self.assertEqual(spans[0], {'name': 'import', 'start_ms': 0.0, 'duration_ms': 500.0})
+        self.assertEqual(spans[1]['attributes'], {'instances': 2})
+
+    def test_report(self):
+        timings.configure(text=True)
+        timings.add_span('keygen', timings.ORIGIN + 0.1, timings.ORIGIN + 0.125, key_type='ed25519')
+
+        lines = timings.format_report(timings.get_spans()).splitlines()
+
+        self.assertEqual(lines[1].split(), ['keygen', 'key_type=ed25519', '100.0', '25.0'])
+        self.assertEqual(lines[-1].split()[0], 'total')
+
+    def test_nothing_recorded_without_report(self):
+        with timings.span('describe_instances'):
+            pass
+        timings.add_span('import', timings.ORIGIN, timings.ORIGIN + 0.5)
+
+        self.assertEqual(timings.get_spans(), [])
+
+    def test_clear(self):
+        timings.configure(json_path=os.path.join(self.tmpdir, 'timings.json'))
+        timings.add_span('import', timings.ORIGIN, timings.ORIGIN + 0.5)
+
+        timings.clear()
+
+        self.assertEqual(timings.get_spans(), [])
+
+    def test_emit_nothing_by_default(self):
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            timings.emit()
+        self.assertEqual(stderr.getvalue(), '')
+
+    def test_emit_once(self):
+        path = os.path.join(self.tmpdir, 'timings.json')
+        timings.configure(text=True, json_path=path)
+        timings.add_span('ssh', timings.ORIGIN, timings.ORIGIN + 1, program='ssh')
+
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            timings.emit()
+            timings.emit()
+
+        self.assertEqual(stderr.getvalue().count('ssh program=ssh'), 1)
+        with open(path) as f:
+            document = json.load(f)
+        self.assertEqual(document['spans'], [{'name': 'ssh', 'start_ms': 0.0, 'duration_ms': 1000.0,
+                                              'attributes': {'program': 'ssh'}}])
+        self.assertIn('version', document)
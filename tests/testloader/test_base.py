@@ -13,8 +13,16 @@
 
 from unittest import TestCase
 import os
+import shutil
+import tempfile
 from argparse import Namespace
 
+from ec2instanceconnectcli import local_cache
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 
 class TestBase(TestCase):
     """
@@ -66,6 +74,7 @@ class TestBase(TestCase):
         private_ip=private_ip,
         availability_zone=availability_zone
     )
+
     private_instance_info = Namespace(
         public_dns_name=None,
         private_dns_name=private_dns_name,
@@ -73,3 +82,12 @@ class TestBase(TestCase):
         private_ip=private_ip,
         availability_zone=availability_zone
     )
+
+    def setUp(self):
+        # Everything the CLI caches locally, such as keys, instances and service models, goes to a fresh directory
+        # instead of the user's ~/.cache
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, True)
+        env = mock.patch.dict(os.environ, {local_cache.CACHE_DIR_ENV: self.cache_dir})
+        env.start()
+        self.addCleanup(env.stop)